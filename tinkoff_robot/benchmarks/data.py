@@ -0,0 +1,48 @@
+"""
+Synthetic market data for benchmarks and the API stub
+"""
+import datetime
+
+import numpy as np
+
+from tinkoff.invest import Candle, MarketDataResponse, SubscriptionInterval
+
+from helpers.candles import CandleArrays, datetime_to_nanos
+from helpers.money import MOD
+
+
+def synthetic_candles(size: int, end: datetime.datetime, seed: int = 0, price: float = 100.0) -> CandleArrays:
+    """
+    Random walk of minute candles, the last one starting at end
+    """
+    rng = np.random.default_rng(seed)
+    close = np.maximum(price + np.cumsum(rng.normal(0, price / 500, size)), price / 10)
+    close = np.round(close * 100).astype(np.int64) * (MOD // 100)
+    open_ = np.concatenate([close[:1], close[:-1]])
+    spread = np.abs(rng.normal(0, price / 1000, size) * MOD).astype(np.int64)
+    end_nanos = datetime_to_nanos(end.replace(second=0, microsecond=0))
+    return CandleArrays(
+        time=end_nanos - np.arange(size - 1, -1, -1, dtype=np.int64) * 60 * 10 ** 9,
+        volume=rng.integers(1, 1000, size, dtype=np.int64),
+        open=open_,
+        high=np.maximum(open_, close) + spread,
+        low=np.minimum(open_, close) - spread,
+        close=close,
+    )
+
+
+def market_data(candles: CandleArrays, figi: str) -> list[MarketDataResponse]:
+    """
+    Candles as messages of the market data stream
+    """
+    return [MarketDataResponse(candle=Candle(
+        figi=figi,
+        interval=SubscriptionInterval.SUBSCRIPTION_INTERVAL_ONE_MINUTE,
+        open=historic.open,
+        high=historic.high,
+        low=historic.low,
+        close=historic.close,
+        volume=historic.volume,
+        time=historic.time,
+        last_trade_ts=historic.time,
+    )) for historic in candles.candles()]
@@ -0,0 +1,460 @@
+"""
+Local stand-in for the subset of the Tinkoff Invest gRPC API used by the robot:
+market data stream and candles, trading status, orders (real and sandbox), order trades stream,
+accounts, positions and instrument lookup. Candles are replayed at a fixed rate or as fast as possible.
+
+tinkoff.invest always connects over TLS, so the server needs a certificate for localhost, e.g.
+    openssl req -x509 -newkey rsa:2048 -nodes -days 365 -subj /CN=localhost \\
+        -addext subjectAltName=DNS:localhost -keyout stub.key -out stub.crt
+and the client process has to trust it before the first channel is created:
+    GRPC_DEFAULT_SSL_ROOTS_FILE_PATH=stub.crt
+
+Run from the project root: python -m benchmarks.invest_stub_server --cert stub.crt --key stub.key
+"""
+from __future__ import annotations
+
+import argparse
+import datetime
+import queue
+import random
+import threading
+import time
+import uuid
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import grpc
+import numpy as np
+
+from google.protobuf.timestamp_pb2 import Timestamp
+from tinkoff.invest import CandleInterval
+from tinkoff.invest.grpc import (
+    common_pb2,
+    instruments_pb2,
+    instruments_pb2_grpc,
+    marketdata_pb2,
+    marketdata_pb2_grpc,
+    operations_pb2,
+    operations_pb2_grpc,
+    orders_pb2,
+    orders_pb2_grpc,
+    sandbox_pb2_grpc,
+    users_pb2,
+    users_pb2_grpc,
+)
+
+from benchmarks.data import synthetic_candles
+from helpers.candles import CandleArrays
+from helpers.money import MOD
+from lib.candle_store import CandleStore
+
+
+def _quotation(nanos: int) -> common_pb2.Quotation:
+    return common_pb2.Quotation(units=nanos // MOD, nano=nanos % MOD)
+
+
+def _money(nanos: int, currency: str) -> common_pb2.MoneyValue:
+    return common_pb2.MoneyValue(currency=currency, units=nanos // MOD, nano=nanos % MOD)
+
+
+def _timestamp(nanos: int) -> Timestamp:
+    timestamp = Timestamp()
+    timestamp.FromNanoseconds(int(nanos))
+    return timestamp
+
+
+@dataclass
+class StubOrder:
+    order_id: str
+    direction: int
+    order_type: int
+    lots_requested: int
+    price: int  # billionths per instrument unit
+    status: int = orders_pb2.EXECUTION_REPORT_STATUS_NEW
+    lots_executed: int = 0
+    time: int = field(default_factory=time.time_ns)
+
+
+class StubMarket:  # pylint:disable=too-many-instance-attributes
+    """
+    State shared by the servicers: one instrument, one account, candles to serve and orders placed by the robot.
+    Market orders and marketable limit orders are filled at once at the last replayed close.
+    """
+    figi: str = 'BBG000STUB01'
+    ticker: str = 'STUB'
+    class_code: str = 'TQBR'
+    currency: str = 'rub'
+
+    def __init__(self, history: CandleArrays, replay: CandleArrays,  # pylint:disable=too-many-arguments
+                 account_id: str = 'stub-account', sandbox: bool = False, rate: float = 0.0,
+                 money: int = 1_000_000, lot: int = 1, candles_error_rate: float = 0.0):
+        self.history = history
+        self.replay = replay
+        self.account_id = account_id
+        self.sandbox = sandbox
+        self.rate = rate
+        self.money = money * MOD
+        self.lot = lot
+        self.candles_error_rate = candles_error_rate
+        self.positions = 0
+        self.last_price = int(history.close[-1]) if len(history) else int(replay.close[0])
+        self.orders: dict[str, StubOrder] = {}
+        self.trades_subscribers: list[queue.SimpleQueue] = []
+        self.lock = threading.Lock()
+
+        self.candles_sent = 0
+        self.first_sent_ns = 0
+        self.last_sent_ns = 0
+        self.tick_to_order_ns: list[int] = []
+
+    def instrument(self) -> instruments_pb2.Instrument:
+        return instruments_pb2.Instrument(
+            figi=self.figi, ticker=self.ticker, class_code=self.class_code, lot=self.lot, currency=self.currency,
+            name='Stub instrument', min_price_increment=_quotation(MOD // 100), api_trade_available_flag=True,
+            buy_available_flag=True, sell_available_flag=True,
+            trading_status=common_pb2.SECURITY_TRADING_STATUS_NORMAL_TRADING
+        )
+
+    def account(self) -> users_pb2.Account:
+        return users_pb2.Account(id=self.account_id, name='stub', type=users_pb2.ACCOUNT_TYPE_TINKOFF,
+                                 status=users_pb2.ACCOUNT_STATUS_OPEN,
+                                 access_level=users_pb2.ACCOUNT_ACCESS_LEVEL_FULL_ACCESS)
+
+    def trading_status(self, available: bool) -> marketdata_pb2.TradingStatus:
+        return marketdata_pb2.TradingStatus(
+            figi=self.figi, time=_timestamp(time.time_ns()), limit_order_available_flag=available,
+            market_order_available_flag=available,
+            trading_status=common_pb2.SECURITY_TRADING_STATUS_NORMAL_TRADING if available
+            else common_pb2.SECURITY_TRADING_STATUS_NOT_AVAILABLE_FOR_TRADING
+        )
+
+    def replay_messages(self) -> list[marketdata_pb2.MarketDataResponse]:
+        replay = self.replay
+        return [marketdata_pb2.MarketDataResponse(candle=marketdata_pb2.Candle(
+            figi=self.figi, interval=marketdata_pb2.SUBSCRIPTION_INTERVAL_ONE_MINUTE,
+            open=_quotation(int(replay.open[i])), high=_quotation(int(replay.high[i])),
+            low=_quotation(int(replay.low[i])), close=_quotation(int(replay.close[i])),
+            volume=int(replay.volume[i]), time=_timestamp(replay.time[i]), last_trade_ts=_timestamp(replay.time[i])
+        )) for i in range(len(replay))]
+
+    def on_candle_sent(self, close: int) -> None:
+        now = time.perf_counter_ns()
+        with self.lock:
+            self.first_sent_ns = self.first_sent_ns or now
+            self.last_sent_ns = now
+            self.last_price = close
+            self.candles_sent += 1
+
+    def post_order(self, request: orders_pb2.PostOrderRequest) -> StubOrder:
+        with self.lock:
+            if self.last_sent_ns:
+                self.tick_to_order_ns.append(time.perf_counter_ns() - self.last_sent_ns)
+            price = request.price.units * MOD + request.price.nano
+            buy = request.direction == orders_pb2.ORDER_DIRECTION_BUY
+            order = StubOrder(order_id=str(uuid.uuid4()), direction=request.direction, order_type=request.order_type,
+                              lots_requested=request.quantity, price=price or self.last_price)
+            self.orders[order.order_id] = order
+            if request.order_type != orders_pb2.ORDER_TYPE_LIMIT or \
+                    (price >= self.last_price if buy else price <= self.last_price):
+                order.price = self.last_price
+                order.lots_executed = order.lots_requested
+                order.status = orders_pb2.EXECUTION_REPORT_STATUS_FILL
+                sign = 1 if buy else -1
+                self.positions += sign * order.lots_executed * self.lot
+                self.money -= sign * order.lots_executed * self.lot * order.price
+                self._publish_trades(order)
+            return order
+
+    def cancel_order(self, order_id: str) -> bool:
+        with self.lock:
+            order = self.orders.get(order_id)
+            if order is None or order.status != orders_pb2.EXECUTION_REPORT_STATUS_NEW:
+                return False
+            order.status = orders_pb2.EXECUTION_REPORT_STATUS_CANCELLED
+            return True
+
+    def _publish_trades(self, order: StubOrder) -> None:
+        response = orders_pb2.TradesStreamResponse(order_trades=orders_pb2.OrderTrades(
+            order_id=order.order_id, created_at=_timestamp(time.time_ns()), direction=order.direction, figi=self.figi,
+            account_id=self.account_id, trades=[orders_pb2.OrderTrade(
+                date_time=_timestamp(time.time_ns()), price=_quotation(order.price),
+                quantity=order.lots_executed * self.lot)]
+        ))
+        for subscriber in self.trades_subscribers:
+            subscriber.put(response)
+
+    def order_amount(self, order: StubOrder) -> int:
+        return order.lots_executed * self.lot * order.price
+
+    def post_order_response(self, order: StubOrder) -> orders_pb2.PostOrderResponse:
+        return orders_pb2.PostOrderResponse(
+            order_id=order.order_id, execution_report_status=order.status, lots_requested=order.lots_requested,
+            lots_executed=order.lots_executed,
+            initial_order_price=_money(order.lots_requested * self.lot * order.price, self.currency),
+            executed_order_price=_money(order.price, self.currency),
+            total_order_amount=_money(self.order_amount(order), self.currency),
+            initial_commission=_money(0, self.currency), executed_commission=_money(0, self.currency),
+            figi=self.figi, direction=order.direction, initial_security_price=_money(order.price, self.currency),
+            order_type=order.order_type
+        )
+
+    def order_state(self, order: StubOrder) -> orders_pb2.OrderState:
+        return orders_pb2.OrderState(
+            order_id=order.order_id, execution_report_status=order.status, lots_requested=order.lots_requested,
+            lots_executed=order.lots_executed,
+            initial_order_price=_money(order.lots_requested * self.lot * order.price, self.currency),
+            executed_order_price=_money(order.price, self.currency),
+            total_order_amount=_money(self.order_amount(order), self.currency),
+            average_position_price=_money(order.price, self.currency),
+            initial_commission=_money(0, self.currency), executed_commission=_money(0, self.currency),
+            service_commission=_money(0, self.currency), figi=self.figi, direction=order.direction,
+            initial_security_price=_money(order.price, self.currency), currency=self.currency,
+            order_type=order.order_type, order_date=_timestamp(order.time)
+        )
+
+    def report(self) -> dict[str, float]:
+        latencies = np.array(self.tick_to_order_ns, dtype=np.float64) / 1e6
+        elapsed = (self.last_sent_ns - self.first_sent_ns) / 1e9
+        return {
+            'candles_sent': self.candles_sent,
+            'candles_per_second': self.candles_sent / elapsed if elapsed > 0 else float('nan'),
+            'orders': len(self.orders),
+            'tick_to_order_p50_ms': float(np.percentile(latencies, 50)) if len(latencies) else float('nan'),
+            'tick_to_order_p99_ms': float(np.percentile(latencies, 99)) if len(latencies) else float('nan'),
+        }
+
+
+class MarketDataService(marketdata_pb2_grpc.MarketDataServiceServicer):
+    def __init__(self, market: StubMarket):
+        self.market = market
+
+    def GetCandles(self, request, context):  # pylint:disable=invalid-name
+        if random.random() < self.market.candles_error_rate:
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, 'Injected candles error')
+        history = self.market.history
+        first, last = np.searchsorted(history.time, [getattr(request, 'from').ToNanoseconds(),
+                                                     request.to.ToNanoseconds()])
+        return marketdata_pb2.GetCandlesResponse(candles=[marketdata_pb2.HistoricCandle(
+            open=_quotation(int(history.open[i])), high=_quotation(int(history.high[i])),
+            low=_quotation(int(history.low[i])), close=_quotation(int(history.close[i])),
+            volume=int(history.volume[i]), time=_timestamp(history.time[i]), is_complete=True
+        ) for i in range(first, last)])
+
+    def GetTradingStatus(self, request, context):  # pylint:disable=invalid-name
+        return marketdata_pb2.GetTradingStatusResponse(
+            figi=self.market.figi, trading_status=common_pb2.SECURITY_TRADING_STATUS_NORMAL_TRADING,
+            limit_order_available_flag=True, market_order_available_flag=True, api_trade_available_flag=True
+        )
+
+
+class MarketDataStreamService(marketdata_pb2_grpc.MarketDataStreamServiceServicer):
+    """
+    Replays the candles once the client subscribes to them, then reports that trading is closed and ends the stream
+    """
+    def __init__(self, market: StubMarket):
+        self.market = market
+
+    def MarketDataStream(self, request_iterator, context):  # pylint:disable=invalid-name
+        subscribed = threading.Event()
+        responses = queue.SimpleQueue()
+        threading.Thread(target=self._read_requests, args=(request_iterator, responses, subscribed),
+                         daemon=True).start()
+        subscribed.wait()
+        while not responses.empty():
+            yield responses.get()
+
+        market = self.market
+        yield marketdata_pb2.MarketDataResponse(trading_status=market.trading_status(available=True))
+        start = time.perf_counter()
+        for i, message in enumerate(market.replay_messages()):
+            if not context.is_active():
+                return
+            if market.rate > 0 and (delay := start + i / market.rate - time.perf_counter()) > 0:
+                time.sleep(delay)
+            market.on_candle_sent(int(market.replay.close[i]))
+            yield message
+        yield marketdata_pb2.MarketDataResponse(trading_status=market.trading_status(available=False))
+
+    def _read_requests(self, request_iterator, responses: queue.SimpleQueue, subscribed: threading.Event):
+        for request in request_iterator:
+            if request.HasField('subscribe_candles_request'):
+                responses.put(marketdata_pb2.MarketDataResponse(
+                    subscribe_candles_response=marketdata_pb2.SubscribeCandlesResponse(
+                        tracking_id=str(uuid.uuid4()),
+                        candles_subscriptions=[marketdata_pb2.CandleSubscription(
+                            figi=instrument.figi, interval=instrument.interval,
+                            subscription_status=marketdata_pb2.SUBSCRIPTION_STATUS_SUCCESS
+                        ) for instrument in request.subscribe_candles_request.instruments]
+                    )))
+                subscribed.set()
+        subscribed.set()
+
+
+class OrdersService(orders_pb2_grpc.OrdersServiceServicer):
+    def __init__(self, market: StubMarket):
+        self.market = market
+
+    def PostOrder(self, request, context):  # pylint:disable=invalid-name
+        return self.market.post_order_response(self.market.post_order(request))
+
+    def GetOrderState(self, request, context):  # pylint:disable=invalid-name
+        order = self.market.orders.get(request.order_id)
+        if order is None:
+            context.abort(grpc.StatusCode.NOT_FOUND, f'Order {request.order_id} not found')
+        return self.market.order_state(order)
+
+    def CancelOrder(self, request, context):  # pylint:disable=invalid-name
+        if not self.market.cancel_order(request.order_id):
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT, f'Order {request.order_id} can not be cancelled')
+        return orders_pb2.CancelOrderResponse(time=_timestamp(time.time_ns()))
+
+
+class OrdersStreamService(orders_pb2_grpc.OrdersStreamServiceServicer):
+    def __init__(self, market: StubMarket):
+        self.market = market
+
+    def TradesStream(self, request, context):  # pylint:disable=invalid-name
+        subscriber = queue.SimpleQueue()
+        self.market.trades_subscribers.append(subscriber)
+        try:
+            while context.is_active():
+                try:
+                    yield subscriber.get(timeout=1)
+                except queue.Empty:
+                    continue
+        finally:
+            self.market.trades_subscribers.remove(subscriber)
+
+
+class SandboxService(sandbox_pb2_grpc.SandboxServiceServicer):
+    def __init__(self, market: StubMarket, orders: OrdersService):
+        self.market = market
+        self.orders = orders
+
+    def GetSandboxAccounts(self, request, context):  # pylint:disable=invalid-name
+        return users_pb2.GetAccountsResponse(accounts=[self.market.account()] if self.market.sandbox else [])
+
+    def PostSandboxOrder(self, request, context):  # pylint:disable=invalid-name
+        return self.orders.PostOrder(request, context)
+
+    def GetSandboxOrderState(self, request, context):  # pylint:disable=invalid-name
+        return self.orders.GetOrderState(request, context)
+
+    def CancelSandboxOrder(self, request, context):  # pylint:disable=invalid-name
+        return self.orders.CancelOrder(request, context)
+
+
+class UsersService(users_pb2_grpc.UsersServiceServicer):
+    def __init__(self, market: StubMarket):
+        self.market = market
+
+    def GetAccounts(self, request, context):  # pylint:disable=invalid-name
+        return users_pb2.GetAccountsResponse(accounts=[] if self.market.sandbox else [self.market.account()])
+
+    def GetInfo(self, request, context):  # pylint:disable=invalid-name
+        return users_pb2.GetInfoResponse(prem_status=False, qual_status=False, tariff='investor')
+
+
+class OperationsService(operations_pb2_grpc.OperationsServiceServicer):
+    def __init__(self, market: StubMarket):
+        self.market = market
+
+    def GetPositions(self, request, context):  # pylint:disable=invalid-name
+        market = self.market
+        with market.lock:
+            return operations_pb2.PositionsResponse(
+                money=[_money(market.money, market.currency)],
+                securities=[operations_pb2.PositionsSecurities(figi=market.figi, balance=market.positions)]
+                if market.positions else []
+            )
+
+
+class InstrumentsService(instruments_pb2_grpc.InstrumentsServiceServicer):
+    def __init__(self, market: StubMarket):
+        self.market = market
+
+    def GetInstrumentBy(self, request, context):  # pylint:disable=invalid-name
+        if request.id not in (self.market.figi, self.market.ticker):
+            context.abort(grpc.StatusCode.NOT_FOUND, f'Instrument {request.id} not found')
+        return instruments_pb2.InstrumentResponse(instrument=self.market.instrument())
+
+
+class InvestStubServer:
+    """
+    gRPC server hosting the stub services on localhost
+    """
+    market: StubMarket
+    port: int
+
+    def __init__(self, market: StubMarket, cert: bytes, key: bytes, port: int = 0, max_workers: int = 16):
+        self.market = market
+        self.server = grpc.server(ThreadPoolExecutor(max_workers=max_workers))
+        orders = OrdersService(market)
+        marketdata_pb2_grpc.add_MarketDataServiceServicer_to_server(MarketDataService(market), self.server)
+        marketdata_pb2_grpc.add_MarketDataStreamServiceServicer_to_server(MarketDataStreamService(market),
+                                                                          self.server)
+        orders_pb2_grpc.add_OrdersServiceServicer_to_server(orders, self.server)
+        orders_pb2_grpc.add_OrdersStreamServiceServicer_to_server(OrdersStreamService(market), self.server)
+        sandbox_pb2_grpc.add_SandboxServiceServicer_to_server(SandboxService(market, orders), self.server)
+        users_pb2_grpc.add_UsersServiceServicer_to_server(UsersService(market), self.server)
+        operations_pb2_grpc.add_OperationsServiceServicer_to_server(OperationsService(market), self.server)
+        instruments_pb2_grpc.add_InstrumentsServiceServicer_to_server(InstrumentsService(market), self.server)
+        self.port = self.server.add_secure_port(f'localhost:{port}', grpc.ssl_server_credentials([(key, cert)]))
+
+    @property
+    def target(self) -> str:
+        return f'localhost:{self.port}'
+
+    def start(self) -> InvestStubServer:
+        self.server.start()
+        return self
+
+    def stop(self, grace: float = None) -> None:
+        self.server.stop(grace)
+
+
+def load_market(args: argparse.Namespace) -> StubMarket:
+    if args.candle_store:
+        candles = CandleStore(args.candle_store).load_arrays(args.figi, CandleInterval[args.interval],
+                                                             args.start, args.end)
+    else:
+        candles = synthetic_candles(args.history + args.candles, datetime.datetime.now(datetime.timezone.utc),
+                                    seed=args.seed)
+        # replayed candles continue after the history
+        candles.time = candles.time + args.candles * 60 * 10 ** 9
+    history = candles[:args.history]
+    return StubMarket(history=history, replay=candles[args.history:], sandbox=args.sandbox, rate=args.rate,
+                      candles_error_rate=args.candles_error_rate)
+
+
+def add_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--cert', required=True, help='PEM certificate for localhost')
+    parser.add_argument('--key', required=True, help='PEM private key of the certificate')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--candles', type=int, default=10_000, help='number of candles to replay')
+    parser.add_argument('--history', type=int, default=60, help='number of candles served before the replay')
+    parser.add_argument('--rate', type=float, default=0.0, help='candles per second, 0 for as fast as possible')
+    parser.add_argument('--sandbox', action='store_true', help='serve the account as a sandbox one')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--candles-error-rate', type=float, default=0.0,
+                        help='share of GetCandles requests failed with RESOURCE_EXHAUSTED')
+    parser.add_argument('--candle-store', help='replay recorded candles from the CandleStore at this path')
+    parser.add_argument('--figi', help='figi of recorded candles')
+    parser.add_argument('--interval', default='CANDLE_INTERVAL_1_MIN', help='CandleInterval name of recorded candles')
+    parser.add_argument('--start', type=datetime.datetime.fromisoformat, help='start of recorded candles')
+    parser.add_argument('--end', type=datetime.datetime.fromisoformat, help='end of recorded candles')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    args = parser.parse_args()
+    with open(args.cert, 'rb') as cert, open(args.key, 'rb') as key:
+        server = InvestStubServer(load_market(args), cert=cert.read(), key=key.read(), port=args.port).start()
+    print(f'Serving {server.market.figi} on {server.target}, account {server.market.account_id}')
+    server.server.wait_for_termination()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Microbenchmarks of helpers.money against the previous dataclass-based Money.
+Run from the project root: python -m benchmarks.money_benchmark
+"""
+from __future__ import annotations
+
+import contextlib
+import math
+import os
+import timeit
+
+from dataclasses import dataclass
+
+import numpy as np
+
+from tinkoff.invest import MoneyValue, Quotation
+
+from helpers.money import Money, MoneyArray
+
+
+@dataclass(init=False, order=True)
+class LegacyMoney:  # Money as it was before switching to integer billionths
+    units: int
+    nano: int
+    MOD: int = 10 ** 9
+
+    def __init__(self, value: int | float | Quotation | MoneyValue, nano: int = None):
+        if nano:
+            self.units = value
+            self.nano = nano
+        else:
+            match value:
+                case int() as value:
+                    self.units = value
+                    self.nano = 0
+                case float() as value:
+                    self.units = int(math.floor(value))
+                    self.nano = int((value - math.floor(value)) * self.MOD)
+                case Quotation() | MoneyValue() as value:
+                    self.units = value.units
+                    self.nano = value.nano
+
+    def __float__(self):
+        return self.units + self.nano / self.MOD
+
+    def __add__(self, other: LegacyMoney) -> LegacyMoney:
+        print(self.units + other.units + (self.nano + other.nano) // self.MOD)
+        print((self.nano + other.nano) % self.MOD)
+        return LegacyMoney(
+            self.units + other.units + (self.nano + other.nano) // self.MOD,
+            (self.nano + other.nano) % self.MOD
+        )
+
+    def __mul__(self, other: int) -> LegacyMoney:
+        return LegacyMoney(self.units * other + (self.nano * other) // self.MOD, (self.nano * other) % self.MOD)
+
+
+def measure(statement, number: int) -> float:
+    """
+    Best of 5 runs, microseconds per call
+    """
+    with open(os.devnull, 'w', encoding='utf-8') as devnull, contextlib.redirect_stdout(devnull):
+        return min(timeit.repeat(statement, number=number, repeat=5)) / number * 1e6
+
+
+def main():
+    size = 100_000
+    quotations = [Quotation(units=100 + i % 50, nano=i * 7919 % 10 ** 9) for i in range(size)]
+    legacy = [LegacyMoney(quotation) for quotation in quotations]
+    current = [Money(quotation) for quotation in quotations]
+    array = MoneyArray.from_quotations(quotations)
+
+    def legacy_sum():
+        total = LegacyMoney(0)
+        for money in legacy:
+            total = total + money
+        return total
+
+    def current_sum():
+        total = Money(0)
+        for money in current:
+            total = total + money
+        return total
+
+    results = {
+        'construct from Quotation': (measure(lambda: LegacyMoney(quotations[0]), 100_000),
+                                     measure(lambda: Money(quotations[0]), 100_000)),
+        'add': (measure(lambda: legacy[0] + legacy[1], 10_000),
+                measure(lambda: current[0] + current[1], 100_000)),
+        'multiply by int': (measure(lambda: legacy[0] * 7, 100_000),
+                            measure(lambda: current[0] * 7, 100_000)),
+        'float()': (measure(lambda: float(legacy[0]), 100_000),
+                    measure(lambda: float(current[0]), 100_000)),
+        f'sum of {size}': (measure(legacy_sum, 1), measure(current_sum, 1)),
+        f'MoneyArray sum of {size}': (measure(legacy_sum, 1), measure(array.sum, 100)),
+        f'MoneyArray * 10 + itself, {size}': (measure(lambda: [m * 10 + m for m in legacy[:1000]], 1) * size / 1000,
+                                              measure(lambda: array * 10 + array, 100)),
+    }
+
+    print(f'{"operation":<40}{"legacy, us":>14}{"current, us":>14}{"speedup":>10}')
+    for name, (legacy_time, current_time) in results.items():
+        print(f'{name:<40}{legacy_time:>14.3f}{current_time:>14.3f}{legacy_time / current_time:>9.1f}x')
+
+    assert float(current_sum()) == float(array.sum())
+    assert np.isclose(float(array.sum()), sum(map(float, legacy)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,334 @@
+"""
+Benchmarks of the code running on every candle and trade, swept over input sizes.
+Results are saved as JSON, a later run can be compared with them to catch slowdowns.
+Run from the project root:
+    python -m benchmarks.suite run --output baseline.json
+    python -m benchmarks.suite run --output current.json --max-size 10000000
+    python -m benchmarks.suite compare baseline.json current.json --threshold 0.1
+"""
+from __future__ import annotations
+
+import argparse
+import datetime
+import json
+import logging
+import platform
+import sys
+import time
+
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+
+from tinkoff.invest import (
+    Instrument,
+    MoneyValue,
+    OrderDirection,
+    OrderExecutionReportStatus,
+    OrderState,
+    OrderType,
+    PostOrderResponse,
+)
+
+import lib.robot_factory  # pylint:disable=unused-import  # has to be imported before lib.trading_robot
+
+from benchmarks.data import market_data, synthetic_candles
+from helpers.money import Money, MoneyArray
+from lib.backtester import Backtester
+from lib.batch_backtest import run_batch_backtest
+from lib.trading_robot import TradingRobot
+from stats.analyzer import BalanceCalculator, BalanceProcessor, TradeStatisticsAnalyzer
+from strategy.base_strategy import TradeStrategyParams
+from strategy.mae_strategy import MAEStrategy
+
+SIZES = (1_000, 10_000, 100_000, 1_000_000, 10_000_000)
+OBJECTS_MAX_SIZE = 1_000_000  # cases keeping a Python object per candle or trade
+FIGI = 'BBG000BENCH1'
+
+
+@dataclass
+class Case:
+    name: str
+    setup: Callable[[int], Callable[[], object]]  # prepares data of given size, returns the measured function
+    max_size: int
+
+
+CASES: list[Case] = []
+
+
+def case(name: str, max_size: int = SIZES[-1]):
+    def register(setup: Callable[[int], Callable[[], object]]):
+        CASES.append(Case(name=name, setup=setup, max_size=max_size))
+        return setup
+    return register
+
+
+def _logger() -> logging.Logger:
+    logger = logging.getLogger('benchmarks')
+    logger.setLevel(logging.WARNING)
+    logger.propagate = False
+    if not logger.handlers:
+        logger.addHandler(logging.NullHandler())
+    return logger
+
+
+def _instrument() -> Instrument:
+    return Instrument(figi=FIGI, ticker='BENCH', class_code='TQBR', lot=1, currency='rub')
+
+
+def _analyzer(trades: int = 0) -> TradeStatisticsAnalyzer:
+    analyzer = TradeStatisticsAnalyzer(positions=0, money=1e12, instrument_info=_instrument(), logger=_logger())
+    if trades:
+        candles = synthetic_candles(trades, datetime.datetime.now(datetime.timezone.utc))
+        quantities = np.where(np.arange(trades) % 2 == 0, 1, -1)
+        analyzer.add_backtest_trades(quantities=quantities, prices=candles.close, times=candles.time)
+    return analyzer
+
+
+def _order_state(order_id: str, status: OrderExecutionReportStatus, lots_executed: int, price: Money,
+                 direction: OrderDirection) -> OrderState:
+    amount = (price * lots_executed).to_money_value('rub')
+    zero = MoneyValue('rub', 0, 0)
+    return OrderState(
+        order_id=order_id, execution_report_status=status, lots_requested=1, lots_executed=lots_executed,
+        initial_order_price=price.to_money_value('rub'), executed_order_price=price.to_money_value('rub'),
+        total_order_amount=amount, average_position_price=price.to_money_value('rub'), initial_commission=zero,
+        executed_commission=zero, figi=FIGI, direction=direction, initial_security_price=price.to_money_value('rub'),
+        stages=[], service_commission=zero, currency='rub', order_type=OrderType.ORDER_TYPE_MARKET,
+        order_date=datetime.datetime.now(datetime.timezone.utc)
+    )
+
+
+class FakeOrders:
+    """
+    Orders and sandbox services of a client, market orders are filled at once at last_price
+    """
+    last_price: Money
+    orders: dict[str, OrderState]
+
+    def __init__(self):
+        self.last_price = Money(100)
+        self.orders = {}
+
+    # pylint:disable=too-many-arguments
+    def post_order(self, figi: str, quantity: int, price, direction: OrderDirection,
+                   account_id: str, order_type: OrderType, order_id: str) -> PostOrderResponse:
+        state = _order_state(order_id, OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL, quantity,
+                             self.last_price, direction)
+        self.orders[order_id] = state
+        return PostOrderResponse(
+            order_id=order_id, execution_report_status=state.execution_report_status, lots_requested=quantity,
+            lots_executed=quantity, initial_order_price=state.initial_order_price,
+            executed_order_price=state.executed_order_price, total_order_amount=state.total_order_amount,
+            initial_commission=state.initial_commission, executed_commission=state.executed_commission,
+            aci_value=state.initial_commission, figi=figi, direction=direction,
+            initial_security_price=state.initial_security_price, order_type=order_type, message=''
+        )
+
+    def get_order_state(self, account_id: str, order_id: str) -> OrderState:
+        return self.orders[order_id]
+
+    def cancel_order(self, account_id: str, order_id: str) -> None:
+        self.orders.pop(order_id, None)
+
+    post_sandbox_order = post_order
+    get_sandbox_order_state = get_order_state
+    cancel_sandbox_order = cancel_order
+
+
+class FakeClient:  # pylint:disable=too-few-public-methods
+    def __init__(self):
+        self.orders = FakeOrders()
+        self.sandbox = self.orders
+
+
+@case('money.add', max_size=OBJECTS_MAX_SIZE)
+def _money_add(size: int):
+    values = [Money(100 + i % 50, i * 7919 % 10 ** 9 or 1) for i in range(size)]
+
+    def run():
+        total = Money(0)
+        for value in values:
+            total = total + value
+        return total
+    return run
+
+
+@case('money.array_sum')
+def _money_array_sum(size: int):
+    array = MoneyArray(synthetic_candles(size, datetime.datetime.now(datetime.timezone.utc)).close)
+    return array.sum
+
+
+@case('mae.decide_by_candle', max_size=OBJECTS_MAX_SIZE)
+def _mae_decide_by_candle(size: int):
+    candles = list(synthetic_candles(size, datetime.datetime.now(datetime.timezone.utc)).candles())
+    strategy = MAEStrategy()
+    strategy.load_instrument_info(_instrument())
+    strategy.load_candles([])
+    params = TradeStrategyParams(instrument_balance=1, currency_balance=1e6, pending_orders=[])
+
+    def run():
+        for candle in candles:
+            strategy.decide_by_candle(candle, params)
+    return run
+
+
+@case('analyzer.add_trade', max_size=OBJECTS_MAX_SIZE)
+def _analyzer_add_trade(size: int):
+    trades = [_order_state(str(i), OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL, 1, Money(100),
+                           OrderDirection.ORDER_DIRECTION_BUY if i % 2 else OrderDirection.ORDER_DIRECTION_SELL)
+              for i in range(size)]
+    analyzer = _analyzer()
+
+    def run():
+        for trade in trades:
+            analyzer.add_trade(trade)
+    return run
+
+
+@case('analyzer.get_pending_orders x1000')
+def _analyzer_get_pending_orders(size: int):
+    analyzer = _analyzer(size)
+    for i in range(100):
+        analyzer.add_trade(_order_state(f'pending-{i}', OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_NEW, 0,
+                                        Money(100), OrderDirection.ORDER_DIRECTION_BUY))
+
+    def run():
+        for _ in range(1000):
+            analyzer.get_pending_orders()
+    return run
+
+
+@case('analyzer.get_report')
+def _analyzer_get_report(size: int):
+    analyzer = _analyzer(size)
+    return lambda: analyzer.get_report(processors=[BalanceProcessor()], calculators=[BalanceCalculator()])
+
+
+@case('backtest.loop', max_size=OBJECTS_MAX_SIZE)
+def _backtest_loop(size: int):
+    candles = list(synthetic_candles(size, datetime.datetime.now(datetime.timezone.utc)).candles())
+
+    def run():
+        strategy = MAEStrategy()
+        strategy.load_candles([])
+        backtester = Backtester(trade_strategy=strategy, instrument_info=_instrument(), logger=_logger())
+        return backtester.run(candles, TradeStrategyParams(instrument_balance=0, currency_balance=1e6,
+                                                           pending_orders=[]))
+    return run
+
+
+@case('backtest.batch')
+def _backtest_batch(size: int):
+    candles = synthetic_candles(size, datetime.datetime.now(datetime.timezone.utc))
+    return lambda: run_batch_backtest(
+        trade_strategy=MAEStrategy(), candles=candles, start=0, instrument_info=_instrument(), logger=_logger(),
+        initial_params=TradeStrategyParams(instrument_balance=0, currency_balance=1e6, pending_orders=[])
+    )
+
+
+@case('robot.on_update', max_size=OBJECTS_MAX_SIZE)
+def _robot_on_update(size: int):
+    messages = market_data(synthetic_candles(size, datetime.datetime.now(datetime.timezone.utc)), FIGI)
+    strategy = MAEStrategy()
+    strategy.load_instrument_info(_instrument())
+    strategy.load_candles([])
+    robot = TradingRobot(token='', account_id='benchmark', sandbox_mode=True, trade_strategy=strategy,
+                         trade_statistics=_analyzer(), instrument_info=_instrument(), logger=_logger())
+    client = FakeClient()
+
+    def run():
+        for message in messages:
+            client.orders.last_price = Money(message.candle.close)
+            robot._on_update(client, message)  # pylint:disable=protected-access
+    return run
+
+
+def measure(benchmark: Case, size: int, repeat: int) -> float:
+    """
+    Best of repeat runs in seconds, every run gets fresh data
+    """
+    best = float('inf')
+    for _ in range(repeat if size < 1_000_000 else 1):
+        function = benchmark.setup(size)
+        start = time.perf_counter()
+        function()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(args: argparse.Namespace) -> None:
+    results = {}
+    for benchmark in CASES:
+        if args.filter and args.filter not in benchmark.name:
+            continue
+        results[benchmark.name] = {}
+        for size in SIZES:
+            if size > min(benchmark.max_size, args.max_size):
+                break
+            seconds = measure(benchmark, size, args.repeat)
+            results[benchmark.name][str(size)] = seconds
+            print(f'{benchmark.name:<36}{size:>10}{seconds:>12.4f} s{seconds / size * 1e9:>12.1f} ns/item',
+                  flush=True)
+
+    report = {
+        'meta': {
+            'time': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'python': sys.version.split()[0],
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as file:
+        json.dump(report, file, indent=2)
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[tuple[str, str, float]]:
+    """
+    Returns (case, size, current / baseline time) of every measurement slower than the baseline by more than threshold
+    """
+    print(f'{"case":<36}{"size":>10}{"baseline, s":>14}{"current, s":>14}{"ratio":>8}')
+    slowdowns = []
+    for name, sizes in current['results'].items():
+        for size, seconds in sizes.items():
+            baseline_seconds = baseline['results'].get(name, {}).get(size)
+            if baseline_seconds is None:
+                continue
+            ratio = seconds / baseline_seconds
+            flag = ' SLOWER' if ratio > 1 + threshold else ''
+            print(f'{name:<36}{size:>10}{baseline_seconds:>14.4f}{seconds:>14.4f}{ratio:>8.2f}{flag}')
+            if flag:
+                slowdowns.append((name, size, ratio))
+    return slowdowns
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run', help='run benchmarks and save results')
+    run_parser.add_argument('--output', default='benchmark_results.json')
+    run_parser.add_argument('--max-size', type=int, default=100_000, help=f'largest size of {SIZES}')
+    run_parser.add_argument('--repeat', type=int, default=3, help='runs per size below 1M, the best one counts')
+    run_parser.add_argument('--filter', help='run only cases containing this substring')
+    compare_parser = commands.add_parser('compare', help='compare results with a baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.1, help='allowed relative slowdown')
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run(args)
+    else:
+        with open(args.baseline, encoding='utf-8') as baseline, open(args.current, encoding='utf-8') as current:
+            slowdowns = compare(json.load(baseline), json.load(current), args.threshold)
+        if slowdowns:
+            print(f'{len(slowdowns)} measurements are slower than the baseline by more than {args.threshold:.0%}')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
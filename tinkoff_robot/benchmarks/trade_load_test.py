@@ -0,0 +1,61 @@
+"""
+Load test of TradingRobot.trade against the local stub of the Invest API, no network or token needed.
+Prints how fast the robot consumed replayed candles and the latency from a candle to the order placed on it.
+Run from the project root:
+    python -m benchmarks.trade_load_test --cert stub.crt --key stub.key --candles 20000
+see benchmarks.invest_stub_server for making the certificate.
+"""
+import argparse
+import json
+import os
+import time
+
+
+def main():
+    from benchmarks.invest_stub_server import add_arguments  # pylint:disable=import-outside-toplevel
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_arguments(parser)
+    parser.add_argument('--async', dest='use_async', action='store_true', help='run AsyncTradingRobot')
+    args = parser.parse_args()
+
+    # must be set before grpc creates its first secure channel
+    os.environ['GRPC_DEFAULT_SSL_ROOTS_FILE_PATH'] = os.path.abspath(args.cert)
+
+    # pylint:disable=import-outside-toplevel
+    import asyncio
+
+    from benchmarks.invest_stub_server import InvestStubServer, load_market
+    from lib.robot_factory import TradingRobotFactory
+    from lib.async_trading_robot import AsyncTradingRobot
+    from lib.metadata_cache import MetadataCache
+    from strategy.mae_strategy import MAEStrategy
+
+    market = load_market(args)
+    with open(args.cert, 'rb') as cert, open(args.key, 'rb') as key:
+        server = InvestStubServer(market, cert=cert.read(), key=key.read(), port=args.port).start()
+    try:
+        factory = TradingRobotFactory(token='stub', account_id=market.account_id, figi=market.figi,
+                                      logger_level='WARNING', candle_store_path=None, target=server.target,
+                                      metadata_cache=MetadataCache(None))
+        robot = factory.create_robot(MAEStrategy(), sandbox_mode=args.sandbox,
+                                     robot_class=AsyncTradingRobot if args.use_async else None)
+        start = time.perf_counter()
+        if args.use_async:
+            asyncio.run(robot.trade())
+        else:
+            robot.trade()
+        elapsed = time.perf_counter() - start
+    finally:
+        server.stop(grace=1)
+
+    report = market.report() | {
+        'robot_seconds': elapsed,
+        'robot_candles_per_second': market.candles_sent / elapsed,
+        'robot_trades': len(robot.trade_statistics.ledger),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import datetime
+
+from dataclasses import dataclass
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from tinkoff.invest import CandleInterval, HistoricCandle, Quotation
+
+from helpers.money import MOD
+
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+INTERVAL_DURATIONS = {
+    CandleInterval.CANDLE_INTERVAL_1_MIN: datetime.timedelta(minutes=1),
+    CandleInterval.CANDLE_INTERVAL_5_MIN: datetime.timedelta(minutes=5),
+    CandleInterval.CANDLE_INTERVAL_15_MIN: datetime.timedelta(minutes=15),
+    CandleInterval.CANDLE_INTERVAL_HOUR: datetime.timedelta(hours=1),
+    CandleInterval.CANDLE_INTERVAL_DAY: datetime.timedelta(days=1),
+}
+
+
+def datetime_to_nanos(time: datetime.datetime) -> int:
+    return (time - EPOCH) // datetime.timedelta(microseconds=1) * 1000
+
+
+def interval_nanos(interval: CandleInterval) -> int:
+    return INTERVAL_DURATIONS[interval] // datetime.timedelta(microseconds=1) * 1000
+
+
+def nanos_to_datetime(nanos: int) -> datetime.datetime:
+    return EPOCH + datetime.timedelta(microseconds=nanos // 1000)
+
+
+def quotation_to_nanos(price: Quotation) -> int:
+    return price.units * MOD + price.nano
+
+
+def nanos_to_quotation(nanos: int) -> Quotation:
+    units, nano = divmod(abs(nanos), MOD)
+    sign = -1 if nanos < 0 else 1
+    return Quotation(units=sign * units, nano=sign * nano)
+
+
+@dataclass
+class CandleArrays:
+    """
+    Candles stored column-wise in contiguous int64 arrays: time in nanoseconds since epoch,
+    prices in billionths (units * 10^9 + nano), volume in lots
+    """
+    PRICE_COLUMNS = ('open', 'high', 'low', 'close')
+    COLUMNS = ('time', 'volume') + PRICE_COLUMNS
+
+    time: np.ndarray
+    volume: np.ndarray
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+
+    @classmethod
+    def empty(cls) -> CandleArrays:
+        return cls(*(np.empty(0, dtype=np.int64) for _ in cls.COLUMNS))
+
+    @classmethod
+    def from_candles(cls, candles: Iterable[HistoricCandle]) -> CandleArrays:
+        rows = [(datetime_to_nanos(candle.time), candle.volume)
+                + tuple(quotation_to_nanos(getattr(candle, column)) for column in cls.PRICE_COLUMNS)
+                for candle in candles]
+        if len(rows) == 0:
+            return cls.empty()
+        table = np.array(rows, dtype=np.int64)
+        return cls(*(np.ascontiguousarray(table[:, i]) for i in range(len(cls.COLUMNS))))
+
+    @classmethod
+    def concatenate(cls, arrays: list[CandleArrays]) -> CandleArrays:
+        if len(arrays) == 0:
+            return cls.empty()
+        return cls(*(np.concatenate([getattr(array, column) for array in arrays]) for column in cls.COLUMNS))
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    def __getitem__(self, item: slice | np.ndarray) -> CandleArrays:
+        return CandleArrays(*(getattr(self, column)[item] for column in self.COLUMNS))
+
+    def prices(self, column: str = 'close') -> np.ndarray:
+        # same arithmetic as units + nano / 10^9, so floats match the ones computed from Quotation
+        nanos = getattr(self, column)
+        return nanos // MOD + (nanos % MOD) / MOD
+
+    def quotation(self, column: str, index: int) -> Quotation:
+        return nanos_to_quotation(int(getattr(self, column)[index]))
+
+    def candle(self, index: int) -> HistoricCandle:
+        return HistoricCandle(
+            open=self.quotation('open', index),
+            high=self.quotation('high', index),
+            low=self.quotation('low', index),
+            close=self.quotation('close', index),
+            volume=int(self.volume[index]),
+            time=nanos_to_datetime(int(self.time[index])),
+            is_complete=True,
+        )
+
+    def candles(self) -> Iterator[HistoricCandle]:
+        for i in range(len(self)):
+            yield self.candle(i)
@@ -0,0 +1,33 @@
+from __future__ import annotations
+
+import time
+
+
+class Clock:
+    """
+    Time source of the robot and its statistics, the system clock unless replaced for replays
+    """
+    def time_ns(self) -> int:
+        return time.time_ns()
+
+    def monotonic_ns(self) -> int:
+        return time.monotonic_ns()
+
+
+SYSTEM_CLOCK = Clock()
+
+
+class SimulatedClock(Clock):
+    """
+    Clock standing still at now, nanoseconds since epoch, until it is set to a later time
+    """
+    now: int
+
+    def __init__(self, now: int = 0):
+        self.now = now
+
+    def time_ns(self) -> int:
+        return self.now
+
+    def monotonic_ns(self) -> int:
+        return self.now
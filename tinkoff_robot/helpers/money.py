@@ -1,39 +1,62 @@
 from __future__ import annotations
 
-import math
+from typing import Iterable
+
+import numpy as np
 
-from dataclasses import dataclass
 from tinkoff.invest import MoneyValue, Quotation
 
+MOD: int = 10 ** 9
+_new = object.__new__
+
 
-@dataclass(init=False, order=True)
 class Money:
-    units: int
-    nano: int
-    MOD: int = 10 ** 9
+    """
+    Fixed-point amount stored as a single integer number of billionths (units * 10^9 + nano)
+    """
+    __slots__ = ('nanos',)
+
+    MOD: int = MOD
+
+    nanos: int
 
     def __init__(self, value: int | float | Quotation | MoneyValue, nano: int = None):
-        if nano:
+        if type(value) is Quotation or type(value) is MoneyValue:  # pylint:disable=unidiomatic-typecheck
+            self.nanos = value.units * MOD + value.nano
+        elif nano:
             assert isinstance(value, int), 'if nano is present, value must be int'
             assert isinstance(nano, int), 'nano must be int'
-            self.units = value
-            self.nano = nano
+            self.nanos = value * MOD + nano
         else:
             match value:
                 case int() as value:
-                    self.units = value
-                    self.nano = 0
+                    self.nanos = value * MOD
                 case float() as value:
-                    self.units = int(math.floor(value))
-                    self.nano = int((value - math.floor(value)) * self.MOD)
+                    self.nanos = round(value * MOD)
                 case Quotation() | MoneyValue() as value:
-                    self.units = value.units
-                    self.nano = value.nano
+                    self.nanos = value.units * MOD + value.nano
                 case _:
                     raise ValueError(f'{type(value)} is not supported as initial value for Money')
 
+    @staticmethod
+    def from_nanos(nanos: int) -> Money:
+        money = _new(Money)
+        money.nanos = nanos
+        return money
+
+    @property
+    def units(self) -> int:
+        # units and nano have the same sign, as in Quotation
+        return -(-self.nanos // MOD) if self.nanos < 0 else self.nanos // MOD
+
+    @property
+    def nano(self) -> int:
+        return -(-self.nanos % MOD) if self.nanos < 0 else self.nanos % MOD
+
     def __float__(self):
-        return self.units + self.nano / self.MOD
+        if self.nanos < 0:
+            return -(-self.nanos // MOD + -self.nanos % MOD / MOD)
+        return self.nanos // MOD + self.nanos % MOD / MOD
 
     def to_float(self):
         return float(self)
@@ -45,21 +68,98 @@ class Money:
         return MoneyValue(currency, self.units, self.nano)
 
     def __add__(self, other: Money) -> Money:
-        print(self.units + other.units + (self.nano + other.nano) // self.MOD)
-        print((self.nano + other.nano) % self.MOD)
-        return Money(
-            self.units + other.units + (self.nano + other.nano) // self.MOD,
-            (self.nano + other.nano) % self.MOD
-        )
+        return Money.from_nanos(self.nanos + other.nanos)
 
     def __neg__(self) -> Money:
-        return Money(-self.units, -self.nano)
+        return Money.from_nanos(-self.nanos)
 
     def __sub__(self, other: Money) -> Money:
-        return self + -other
+        return Money.from_nanos(self.nanos - other.nanos)
 
     def __mul__(self, other: int) -> Money:
-        return Money(self.units * other + (self.nano * other) // self.MOD, (self.nano * other) % self.MOD)
+        return Money.from_nanos(self.nanos * other)
+
+    __rmul__ = __mul__
+
+    def __eq__(self, other: Money) -> bool:
+        return isinstance(other, Money) and self.nanos == other.nanos
+
+    def __lt__(self, other: Money) -> bool:
+        return self.nanos < other.nanos
+
+    def __le__(self, other: Money) -> bool:
+        return self.nanos <= other.nanos
+
+    def __gt__(self, other: Money) -> bool:
+        return self.nanos > other.nanos
+
+    def __ge__(self, other: Money) -> bool:
+        return self.nanos >= other.nanos
+
+    def __hash__(self) -> int:
+        return hash(self.nanos)
 
     def __str__(self) -> str:
         return f'<Money units={self.units} nano={self.nano}>'
+
+    __repr__ = __str__
+
+
+class MoneyArray:
+    """
+    Array of fixed-point amounts backed by an int64 NumPy array of billionths,
+    for exact arithmetic over many prices at once
+    """
+    __slots__ = ('nanos',)
+
+    nanos: np.ndarray
+
+    def __init__(self, nanos: np.ndarray | Iterable[int]):
+        self.nanos = np.asarray(nanos, dtype=np.int64)
+
+    @classmethod
+    def from_quotations(cls, values: Iterable[Quotation | MoneyValue]) -> MoneyArray:
+        return cls([value.units * MOD + value.nano for value in values])
+
+    @classmethod
+    def from_floats(cls, values: np.ndarray | Iterable[float]) -> MoneyArray:
+        return cls(np.rint(np.asarray(values, dtype=np.float64) * MOD))
+
+    def __len__(self) -> int:
+        return len(self.nanos)
+
+    def __getitem__(self, item: int | slice | np.ndarray) -> Money | MoneyArray:
+        if isinstance(item, (int, np.integer)):
+            return Money.from_nanos(int(self.nanos[item]))
+        return MoneyArray(self.nanos[item])
+
+    def __iter__(self):
+        return map(Money.from_nanos, self.nanos.tolist())
+
+    def __add__(self, other: MoneyArray | Money) -> MoneyArray:
+        return MoneyArray(self.nanos + other.nanos)
+
+    def __neg__(self) -> MoneyArray:
+        return MoneyArray(-self.nanos)
+
+    def __sub__(self, other: MoneyArray | Money) -> MoneyArray:
+        return MoneyArray(self.nanos - other.nanos)
+
+    def __mul__(self, other: int | np.ndarray) -> MoneyArray:
+        assert np.issubdtype(np.asarray(other).dtype, np.integer), 'Money can be multiplied only by integers'
+        return MoneyArray(self.nanos * other)
+
+    __rmul__ = __mul__
+
+    def sum(self) -> Money:
+        return Money.from_nanos(int(self.nanos.sum()))
+
+    def cumsum(self) -> MoneyArray:
+        return MoneyArray(np.cumsum(self.nanos))
+
+    def to_float(self) -> np.ndarray:
+        units = np.where(self.nanos < 0, -(-self.nanos // MOD), self.nanos // MOD)
+        return units + (self.nanos - units * MOD) / MOD
+
+    def __str__(self) -> str:
+        return f'<MoneyArray size={len(self)}>'
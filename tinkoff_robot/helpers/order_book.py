@@ -0,0 +1,158 @@
+from __future__ import annotations
+
+import numpy as np
+
+from tinkoff.invest import OrderBook as OrderBookMessage, Trade, TradeDirection
+
+from helpers.candles import datetime_to_nanos, quotation_to_nanos
+
+
+class OrderBook:
+    """
+    L2 order book of fixed depth kept in preallocated int64 arrays: prices in billionths, quantities in lots.
+    Level 0 is the best price. Every stream message is a snapshot of the top levels, it is copied in place,
+    so queries and updates don't allocate.
+    """
+    depth: int
+    bid_prices: np.ndarray
+    bid_quantities: np.ndarray
+    ask_prices: np.ndarray
+    ask_quantities: np.ndarray
+    bid_depth: int  # levels filled in the last snapshot
+    ask_depth: int
+    time: int  # nanoseconds since epoch, 0 before the first snapshot
+    is_consistent: bool
+
+    def __init__(self, depth: int):
+        if depth <= 0:
+            raise ValueError('Order book depth must be positive')
+        self.depth = depth
+        self.bid_prices = np.zeros(depth, dtype=np.int64)
+        self.bid_quantities = np.zeros(depth, dtype=np.int64)
+        self.ask_prices = np.zeros(depth, dtype=np.int64)
+        self.ask_quantities = np.zeros(depth, dtype=np.int64)
+        self.bid_depth = 0
+        self.ask_depth = 0
+        self.time = 0
+        self.is_consistent = False
+
+    def update(self, order_book: OrderBookMessage) -> None:
+        self.bid_depth = self._copy_levels(order_book.bids, self.bid_prices, self.bid_quantities)
+        self.ask_depth = self._copy_levels(order_book.asks, self.ask_prices, self.ask_quantities)
+        self.time = datetime_to_nanos(order_book.time)
+        self.is_consistent = order_book.is_consistent
+
+    def _copy_levels(self, orders: list, prices: np.ndarray, quantities: np.ndarray) -> int:
+        depth = min(len(orders), self.depth)
+        for i in range(depth):
+            order = orders[i]
+            prices[i] = quotation_to_nanos(order.price)
+            quantities[i] = order.quantity
+        quantities[depth:] = 0
+        return depth
+
+    @property
+    def best_bid(self) -> int | None:
+        return int(self.bid_prices[0]) if self.bid_depth else None
+
+    @property
+    def best_ask(self) -> int | None:
+        return int(self.ask_prices[0]) if self.ask_depth else None
+
+    @property
+    def spread(self) -> int | None:
+        if not self.bid_depth or not self.ask_depth:
+            return None
+        return int(self.ask_prices[0] - self.bid_prices[0])
+
+    @property
+    def mid(self) -> float | None:
+        if not self.bid_depth or not self.ask_depth:
+            return None
+        return (int(self.ask_prices[0]) + int(self.bid_prices[0])) / 2
+
+    def imbalance(self, levels: int = 1) -> float | None:
+        """
+        (bid volume - ask volume) / (bid volume + ask volume) over the top levels, from -1 to 1
+        """
+        bids = int(self.bid_quantities[:levels].sum())
+        asks = int(self.ask_quantities[:levels].sum())
+        if bids + asks == 0:
+            return None
+        return (bids - asks) / (bids + asks)
+
+
+class TradesBuffer:
+    """
+    The last trades of the instrument in a ring of preallocated arrays. direction is 1 for buys and -1 for sells,
+    prices are in billionths, quantities in lots.
+    """
+    capacity: int
+    time: np.ndarray
+    price: np.ndarray
+    quantity: np.ndarray
+    direction: np.ndarray
+    _next: int
+    _count: int
+
+    def __init__(self, capacity: int):
+        if capacity <= 0:
+            raise ValueError('Trades buffer capacity must be positive')
+        self.capacity = capacity
+        self.time = np.zeros(capacity, dtype=np.int64)
+        self.price = np.zeros(capacity, dtype=np.int64)
+        self.quantity = np.zeros(capacity, dtype=np.int64)
+        self.direction = np.zeros(capacity, dtype=np.int8)
+        self._next = 0
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def update(self, trade: Trade) -> None:
+        i = self._next
+        self.time[i] = datetime_to_nanos(trade.time)
+        self.price[i] = quotation_to_nanos(trade.price)
+        self.quantity[i] = trade.quantity
+        self.direction[i] = 1 if trade.direction == TradeDirection.TRADE_DIRECTION_BUY \
+            else -1 if trade.direction == TradeDirection.TRADE_DIRECTION_SELL else 0
+        self._next = (i + 1) % self.capacity
+        self._count = min(self._count + 1, self.capacity)
+
+    @property
+    def last_price(self) -> int | None:
+        return int(self.price[self._next - 1]) if self._count else None
+
+    def ordered(self) -> dict[str, np.ndarray]:
+        """
+        Copies of the buffered columns from the oldest trade to the newest one
+        """
+        index = np.arange(self._next - self._count, self._next) % self.capacity
+        return {'time': self.time[index], 'price': self.price[index],
+                'quantity': self.quantity[index], 'direction': self.direction[index]}
+
+    def volume(self, since: int = 0) -> int:
+        """
+        Lots traded at or after since, nanoseconds since epoch
+        """
+        return int(self.quantity[self._valid() & (self.time >= since)].sum())
+
+    def signed_volume(self, since: int = 0) -> int:
+        """
+        Bought minus sold lots at or after since
+        """
+        mask = self._valid() & (self.time >= since)
+        return int((self.quantity[mask] * self.direction[mask]).sum())
+
+    def vwap(self, since: int = 0) -> float | None:
+        mask = self._valid() & (self.time >= since)
+        volume = int(self.quantity[mask].sum())
+        if volume == 0:
+            return None
+        # the sum of billionths times lots doesn't fit int64 for large trades, Python ints are exact
+        return int(np.dot(self.price[mask].astype(object), self.quantity[mask].astype(object))) / volume
+
+    def _valid(self) -> np.ndarray:
+        if self._count == self.capacity:
+            return np.ones(self.capacity, dtype=bool)
+        return np.arange(self.capacity) < self._count
@@ -0,0 +1,206 @@
+from __future__ import annotations
+
+import asyncio
+import datetime
+import time
+
+from typing import Coroutine
+
+from tinkoff.invest import AsyncClient, MarketDataResponse, OrderDirection, OrderState, PostOrderResponse
+from tinkoff.invest.exceptions import InvestError
+from tinkoff.invest.services import AsyncMarketDataStreamManager, AsyncServices
+
+from helpers.money import Money
+from lib.trading_robot import TradingRobot
+from stats.analyzer import TradeStatisticsAnalyzer
+from stats.metrics import Histogram
+from strategy.base_strategy import RobotTradeOrder, TradeStrategyParams
+
+
+class AsyncTradingRobot(TradingRobot):  # pylint:disable=invalid-overridden-method
+    """
+    TradingRobot running on asyncio. Order requests are sent as background tasks,
+    so the market data stream is consumed without waiting for them. Until a post completes, its lots or money
+    are reserved in the strategy params and the risk checks, orders being cancelled are not offered to the
+    strategy again.
+    """
+    _tasks: set[asyncio.Task]
+    _orders_check: asyncio.Task | None
+    _reserved_lots: int  # of sell orders being posted
+    _reserved_money: int  # billionths, cost of buy orders being posted
+    _cancelling: set[str]  # ids of orders being cancelled
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tasks = set()
+        self._orders_check = None
+        self._reserved_lots = 0
+        self._reserved_money = 0
+        self._cancelling = set()
+
+    async def trade(self) -> TradeStatisticsAnalyzer:
+        self.logger.info('Starting trading')
+
+        await asyncio.to_thread(self.warm_up)
+
+        async with AsyncClient(self.token, app_name=self.APP_NAME, target=self.target) as client:
+            trading_status = await client.market_data.get_trading_status(figi=self.instrument_info.figi)
+            if not trading_status.market_order_available_flag:
+                self.logger.warning('Market trading is not available now.')
+
+            market_data_stream: AsyncMarketDataStreamManager = client.create_market_data_stream()
+            self.subscribe(market_data_stream, [self])
+            self.logger.debug(f'Subscribed to MarketDataStream, '
+                              f'interval: {self.trade_strategy.candle_subscription_interval}')
+            order_trades_listener = None if self.sandbox_mode \
+                else self._run_in_background(self._listen_order_trades(client))
+            if self._track_pending_orders():
+                await self._check_trade_orders(client)
+            try:
+                async for market_data in market_data_stream:
+                    self.logger.debug(f'Received market_data {market_data}')
+                    if self.recorder is not None:
+                        self.recorder.write(market_data, self.clock.time_ns())
+                    if market_data.candle or market_data.orderbook or market_data.trade:
+                        self._on_update(client, market_data)
+                    if market_data.trading_status and not market_data.trading_status.market_order_available_flag:
+                        self.logger.info(f'Trading is limited. Current status: {market_data.trading_status}')
+                        break
+            except InvestError as error:
+                self.logger.info(f'Caught exception {error}, stopping trading')
+            finally:
+                market_data_stream.stop()
+                if order_trades_listener:
+                    order_trades_listener.cancel()
+                await asyncio.gather(*self._tasks, return_exceptions=True)
+                if self.recorder is not None:
+                    self.recorder.flush()
+                self.trade_strategy.close()
+            return self.trade_statistics
+
+    def _on_update(self, client: AsyncServices, market_data: MarketDataResponse):
+        # order requests run in background tasks, their stages are timed when they complete
+        metrics = self.metrics
+        start = time.perf_counter()
+        metrics.updates.inc()
+        if (self._orders_check is None or self._orders_check.done()) and self._orders_check_due():
+            self._orders_check = self._run_in_background(self._timed(metrics.check_orders,
+                                                                     self._check_trade_orders(client)))
+
+        trade_statistics = self.trade_statistics
+        params = TradeStrategyParams(
+            instrument_balance=trade_statistics.get_positions() - self._reserved_lots,
+            currency_balance=float(Money.from_nanos(trade_statistics.money_nanos - self._reserved_money)),
+            pending_orders=[order for order in trade_statistics.get_pending_orders()
+                            if order.order_id not in self._cancelling])
+
+        self.logger.debug(f'Received market_data {market_data}. Running strategy with params {params}')
+        with metrics.decide.time():
+            self._apply_market_data(market_data)
+            strategy_decision = self.trade_strategy.decide(market_data, params)
+        self.logger.debug(f'Strategy decision: {strategy_decision}')
+
+        cancel_orders = [order for order in strategy_decision.cancel_orders if order.order_id not in self._cancelling]
+        if len(cancel_orders) > 0:
+            self._cancelling.update(order.order_id for order in cancel_orders)
+            self._run_in_background(self._timed(metrics.cancel_orders,
+                                                self._cancel_orders(client=client, orders=cancel_orders)))
+
+        trade_order = strategy_decision.robot_trade_order
+        if trade_order and self._check_risk(trade_order, self._reserved_lots, self._reserved_money):
+            self._run_in_background(self._timed(metrics.post_order, self._post_reserved(
+                client=client, trade_order=trade_order, tick_time=self._tick_time(market_data))))
+        metrics.on_update.observe(time.perf_counter() - start)
+
+    def _post_reserved(self, client: AsyncServices, trade_order: RobotTradeOrder,
+                       tick_time: datetime.datetime = None) -> Coroutine:
+        # reserved at once, the next update may come before the task starts
+        if trade_order.direction == OrderDirection.ORDER_DIRECTION_BUY:
+            price = trade_order.price.nanos if trade_order.price is not None \
+                else self._market_price(trade_order.direction)
+            lots, money = 0, trade_order.quantity * self.instrument_info.lot * price
+        else:
+            lots, money = trade_order.quantity, 0
+        self._reserved_lots += lots
+        self._reserved_money += money
+
+        async def post():
+            try:
+                return await self._post_trade_order(client=client, trade_order=trade_order, tick_time=tick_time)
+            finally:
+                # a posted order is in the statistics by now
+                self._reserved_lots -= lots
+                self._reserved_money -= money
+        return post()
+
+    @staticmethod
+    async def _timed(histogram: Histogram, coroutine: Coroutine):
+        start = time.perf_counter()
+        try:
+            return await coroutine
+        finally:
+            histogram.observe(time.perf_counter() - start)
+
+    def _run_in_background(self, coroutine: Coroutine) -> asyncio.Task:
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _listen_order_trades(self, client: AsyncServices):
+        self._order_trades_streaming = True
+        try:
+            async for response in client.orders_stream.trades_stream(accounts=[self.account_id]):
+                if response.order_trades and response.order_trades.figi == self.instrument_info.figi:
+                    self._on_order_trades(response.order_trades)
+        except InvestError as error:
+            self.logger.warning(f'Order trades stream stopped, falling back to polling. Error: {error}')
+        finally:
+            self._order_trades_streaming = False
+
+    async def _cancel_orders(self, client: AsyncServices, orders: list[OrderState]):
+        cancel_order = client.sandbox.cancel_sandbox_order if self.sandbox_mode else client.orders.cancel_order
+        try:
+            results = await asyncio.gather(
+                *(cancel_order(account_id=self.account_id, order_id=order.order_id) for order in orders),
+                return_exceptions=True
+            )
+            for order, result in zip(orders, results):
+                if isinstance(result, Exception):
+                    self.logger.error(f'Failed to cancel order {order.order_id}. Error: {result}')
+                else:
+                    self.trade_statistics.cancel_order(order_id=order.order_id)
+        finally:
+            self._cancelling.difference_update(order.order_id for order in orders)
+
+    async def _post_trade_order(self, client: AsyncServices, trade_order: RobotTradeOrder,
+                                tick_time: datetime.datetime = None) -> PostOrderResponse | None:
+        try:
+            if self.sandbox_mode:
+                order = await client.sandbox.post_sandbox_order(**self._order_request(trade_order))
+            else:
+                order = await client.orders.post_order(**self._order_request(trade_order))
+        except InvestError as error:
+            self.logger.error(f'Posting trade order failed :(. Order: {trade_order}; Exception: {error}')
+            self.metrics.orders_failed.inc()
+            self.trade_strategy.on_order_posted(trade_order, None)
+            return
+        self._on_order_posted(trade_order, order, tick_time)
+        return order
+
+    async def _check_trade_orders(self, client: AsyncServices):
+        self.logger.debug(f'Updating trade orders info. Current trade orders num: {len(self.orders_executed)}')
+        get_order_state = client.sandbox.get_sandbox_order_state if self.sandbox_mode \
+            else client.orders.get_order_state
+        order_ids = list(self.orders_executed)
+        order_states = await asyncio.gather(
+            *(get_order_state(account_id=self.account_id, order_id=order_id) for order_id in order_ids),
+            return_exceptions=True
+        )
+        for order_id, order_state in zip(order_ids, order_states):
+            if isinstance(order_state, Exception):
+                self.logger.error(f'Failed to get state of order {order_id}. Error: {order_state}')
+            else:
+                self._update_order_state(order_id, order_state)
+
+        self.logger.debug(f'Successfully updated trade orders. New trade orders num: {len(self.orders_executed)}')
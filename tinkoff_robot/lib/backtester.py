@@ -0,0 +1,77 @@
+import logging
+
+from typing import Iterable
+
+from tinkoff.invest import HistoricCandle, Instrument
+
+from helpers.candles import datetime_to_nanos, quotation_to_nanos
+from helpers.clock import SimulatedClock
+from lib.candle_aggregator import CandleAggregator
+from lib.risk import RiskEngine, RiskLimits
+from lib.simulated_exchange import SimulatedExchange
+from stats.analyzer import TradeStatisticsAnalyzer
+from strategy.base_strategy import TradeStrategyBase, TradeStrategyParams
+from strategy.indicators import InstrumentIndicators
+
+
+class Backtester:
+    """
+    Runs the strategy candle by candle against a SimulatedExchange.
+    Resting orders are matched against a candle before the strategy sees it, so orders placed at the close
+    of one candle can only be filled by the following ones. Trades are stamped with the candle time.
+    """
+    trade_strategy: TradeStrategyBase
+    instrument_info: Instrument
+    logger: logging.Logger
+    volume_share: float
+    risk_limits: RiskLimits | None
+
+    def __init__(self, trade_strategy: TradeStrategyBase, instrument_info: Instrument, logger: logging.Logger,
+                 volume_share: float = 1.0, risk_limits: RiskLimits = None):
+        self.trade_strategy = trade_strategy
+        self.instrument_info = instrument_info
+        self.logger = logger
+        self.volume_share = volume_share
+        self.risk_limits = risk_limits
+
+    def run(self, candles: Iterable[HistoricCandle], initial_params: TradeStrategyParams) -> TradeStatisticsAnalyzer:
+        trade_statistics = TradeStatisticsAnalyzer(
+            positions=initial_params.instrument_balance,
+            money=initial_params.currency_balance,
+            instrument_info=self.instrument_info,
+            logger=self.logger
+        )
+        clock = SimulatedClock()
+        trade_statistics.clock = clock
+        exchange = SimulatedExchange(self.instrument_info, trade_statistics, self.logger, self.volume_share)
+        risk = RiskEngine(trade_statistics, self.risk_limits, logger=self.logger)
+        self.trade_strategy.load_instrument_info(self.instrument_info)
+        self.trade_strategy.load_trade_statistics(trade_statistics)
+        indicators = InstrumentIndicators()
+        self.trade_strategy.load_indicators(indicators)
+        timeframes = self.trade_strategy.timeframes
+        aggregator = CandleAggregator(timeframes) if timeframes else None
+
+        for candle in candles:
+            clock.now = datetime_to_nanos(candle.time)
+            exchange.match(candle)
+            close = quotation_to_nanos(candle.close)
+            risk.mark(close)
+            indicators.update(candle)
+            if aggregator is not None:
+                for interval, bar in aggregator.update(candle):
+                    self.trade_strategy.on_bar(interval, bar)
+            params = TradeStrategyParams(instrument_balance=trade_statistics.get_positions(),
+                                         currency_balance=trade_statistics.get_money(),
+                                         pending_orders=trade_statistics.get_pending_orders())
+            strategy_decision = self.trade_strategy.decide_by_candle(candle, params)
+
+            for order in strategy_decision.cancel_orders:
+                exchange.cancel_order(order.order_id)
+            order = strategy_decision.robot_trade_order
+            if order:
+                state = exchange.post_order(order, candle) \
+                    if risk.check(order, order.price.nanos if order.price is not None else close, clock.now) else None
+                self.trade_strategy.on_order_posted(order, state.order_id if state is not None else None)
+
+        return trade_statistics
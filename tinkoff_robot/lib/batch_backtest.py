@@ -0,0 +1,62 @@
+import logging
+
+import numpy as np
+
+from tinkoff.invest import Instrument
+
+from helpers.candles import CandleArrays
+from stats.analyzer import TradeStatisticsAnalyzer
+from strategy.base_strategy import TradeStrategyBase, TradeStrategyParams
+
+
+def execute_signals(signals: np.ndarray, prices: np.ndarray, lot: int, instrument_balance: int,
+                    currency_balance: int) -> np.ndarray:
+    """
+    Cuts requested lots to the balances available at the moment of every trade. Prices and currency_balance
+    are in billionths, so balances are checked exactly as by the Backtester; unlike there, orders above the
+    balances are cut rather than rejected and risk limits are not applied, use the Backtester for those.
+    Only candles with a signal are visited, so the cost depends on the number of trades rather than on
+    the number of candles. Returns executed signed lots for every candle.
+    """
+    executed = np.zeros(len(signals), dtype=np.int64)
+    for i in np.flatnonzero(signals):
+        quantity, lot_price = int(signals[i]), int(prices[i]) * lot
+        if quantity > 0:
+            quantity = min(quantity, currency_balance // lot_price)
+        else:
+            quantity = -min(-quantity, instrument_balance)
+        if quantity == 0:
+            continue
+        instrument_balance += quantity
+        currency_balance -= quantity * lot_price
+        executed[i] = quantity
+    return executed
+
+
+def run_batch_backtest(trade_strategy: TradeStrategyBase, candles: CandleArrays,  # pylint:disable=too-many-arguments
+                       start: int, initial_params: TradeStrategyParams, instrument_info: Instrument,
+                       logger: logging.Logger) -> TradeStatisticsAnalyzer:
+    """
+    Backtests the strategy on candles[start:], candles before start are used as history.
+    Produces the same statistics as the Backtester for strategies whose decide_batch matches decide_by_candle
+    and which don't ask for more than the balances, risk limits are not applied.
+    """
+    trade_statistics = TradeStatisticsAnalyzer(
+        positions=initial_params.instrument_balance,
+        money=initial_params.currency_balance,
+        instrument_info=instrument_info,
+        logger=logger
+    )
+
+    trade_strategy.load_instrument_info(instrument_info)
+    signals = trade_strategy.decide_batch(candles, start)
+    if signals is None:
+        raise ValueError(f'Strategy {trade_strategy.strategy_id} does not support batch backtests')
+    assert len(signals) == len(candles) - start, 'decide_batch must return a signal for every tested candle'
+
+    test = candles[start:]
+    executed = execute_signals(signals, test.close, instrument_info.lot,
+                               initial_params.instrument_balance, trade_statistics.money_nanos)
+    trade_statistics.add_backtest_trades(quantities=executed, prices=test.close, times=test.time)
+
+    return trade_statistics
@@ -0,0 +1,125 @@
+from __future__ import annotations
+
+import numpy as np
+
+from tinkoff.invest import Candle, CandleInterval, HistoricCandle
+
+from helpers.candles import (
+    CandleArrays,
+    datetime_to_nanos,
+    interval_nanos,
+    nanos_to_datetime,
+    nanos_to_quotation,
+    quotation_to_nanos,
+)
+
+
+def resample(candles: CandleArrays, interval: CandleInterval) -> tuple[CandleArrays, np.ndarray]:
+    """
+    Builds interval bars from sorted shorter candles, bars start at multiples of the interval since epoch.
+    Returns the bars and the index of the first candle of every bar. The bar k is finished, as reported by
+    CandleAggregator, on the candle starts[k + 1]; the last bar may be incomplete.
+    """
+    if len(candles) == 0:
+        return CandleArrays.empty(), np.empty(0, dtype=np.int64)
+    duration = interval_nanos(interval)
+    buckets = candles.time - candles.time % duration
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(candles)] - 1
+    bars = CandleArrays(
+        time=buckets[starts],
+        volume=np.add.reduceat(candles.volume, starts),
+        open=candles.open[starts],
+        high=np.maximum.reduceat(candles.high, starts),
+        low=np.minimum.reduceat(candles.low, starts),
+        close=candles.close[ends],
+    )
+    return bars, starts
+
+
+class _Bar:
+    """
+    Bar being built. The last candle is kept apart from the finished ones, because the stream sends
+    updates of the same candle until the next one starts.
+    """
+    __slots__ = ('start', 'open', 'high', 'low', 'close', 'volume',
+                 'candle_time', 'candle_high', 'candle_low', 'candle_volume')
+
+    def __init__(self, start: int, time: int, open_: int, high: int, low: int, close: int, volume: int):
+        self.start = start
+        self.open = open_
+        self.high = open_  # over the finished candles, the open is within the bar anyway
+        self.low = open_
+        self.volume = 0
+        self.candle_time = time
+        self.candle_high = high
+        self.candle_low = low
+        self.candle_volume = volume
+        self.close = close
+
+    def update(self, time: int, high: int, low: int, close: int, volume: int) -> None:
+        if time > self.candle_time:
+            self.high = max(self.high, self.candle_high)
+            self.low = min(self.low, self.candle_low)
+            self.volume += self.candle_volume
+            self.candle_time = time
+        elif time < self.candle_time:
+            return  # late update of a candle already folded in
+        self.candle_high = high
+        self.candle_low = low
+        self.candle_volume = volume
+        self.close = close
+
+    def candle(self, is_complete: bool) -> HistoricCandle:
+        return HistoricCandle(
+            open=nanos_to_quotation(self.open),
+            high=nanos_to_quotation(max(self.high, self.candle_high)),
+            low=nanos_to_quotation(min(self.low, self.candle_low)),
+            close=nanos_to_quotation(self.close),
+            volume=self.volume + self.candle_volume,
+            time=nanos_to_datetime(self.start),
+            is_complete=is_complete,
+        )
+
+
+class CandleAggregator:
+    """
+    Builds bars of longer intervals from the candles of the market data stream in O(1) per update.
+    A bar is finished when the first candle of the next bar arrives.
+    """
+    intervals: tuple[CandleInterval, ...]
+    _durations: tuple[int, ...]
+    _bars: list[_Bar | None]
+
+    def __init__(self, intervals: tuple[CandleInterval, ...] | list[CandleInterval]):
+        self.intervals = tuple(intervals)
+        self._durations = tuple(interval_nanos(interval) for interval in self.intervals)
+        self._bars = [None] * len(self.intervals)
+
+    def update(self, candle: Candle | HistoricCandle) -> list[tuple[CandleInterval, HistoricCandle]]:
+        """
+        Adds a candle or an update of the last one, returns the bars it finished
+        """
+        time = datetime_to_nanos(candle.time)
+        open_, high, low, close = (quotation_to_nanos(candle.open), quotation_to_nanos(candle.high),
+                                   quotation_to_nanos(candle.low), quotation_to_nanos(candle.close))
+        finished = []
+        for i, duration in enumerate(self._durations):
+            start = time - time % duration
+            bar = self._bars[i]
+            if bar is not None and bar.start == start:
+                bar.update(time, high, low, close, candle.volume)
+                continue
+            if bar is not None:
+                if start < bar.start:
+                    continue  # late update of a finished bar
+                finished.append((self.intervals[i], bar.candle(is_complete=True)))
+            self._bars[i] = _Bar(start, time, open_, high, low, close, candle.volume)
+        return finished
+
+    def current(self, interval: CandleInterval) -> HistoricCandle | None:
+        """
+        The bar being built, not complete
+        """
+        bar = self._bars[self.intervals.index(interval)]
+        return bar.candle(is_complete=False) if bar is not None else None
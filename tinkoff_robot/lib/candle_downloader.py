@@ -0,0 +1,216 @@
+from __future__ import annotations
+
+import datetime
+import logging
+import random
+import threading
+import time
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+import numpy as np
+
+from tinkoff.invest import CandleInterval, HistoricCandle
+from tinkoff.invest.exceptions import InvestError, RequestError
+
+from helpers.candles import CandleArrays, interval_nanos, nanos_to_datetime
+from lib.candle_store import CandleStore
+from lib.connection import InvestConnection
+
+Range = tuple[datetime.datetime, datetime.datetime]
+
+
+class DownloadError(Exception):
+    """
+    Some ranges could not be fetched. candles holds what was downloaded, with the failed ranges missing.
+    """
+    ranges: list[Range]
+    candles: CandleArrays
+
+    def __init__(self, message: str, ranges: list[Range], candles: CandleArrays):
+        super().__init__(message)
+        self.ranges = ranges
+        self.candles = candles
+
+
+class RateLimiter:
+    """
+    Token bucket shared by the download threads: rate requests per second with bursts of up to burst requests
+    """
+    rate: float
+    burst: int
+    _tokens: float
+    _updated: float
+    _paused_until: float
+    _lock: threading.Lock
+
+    def __init__(self, rate: float, burst: int = 1):
+        if rate <= 0 or burst <= 0:
+            raise ValueError('Rate and burst must be positive')
+        self.rate = rate
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait_time = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(wait_time)
+
+    def pause(self, seconds: float) -> None:
+        """
+        Holds all requests for the given time, e.g. until the API limit is reset
+        """
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0
+
+
+class CandleDownloader:  # pylint:disable=too-many-instance-attributes
+    """
+    Downloads historic candles in chunks fetched concurrently under a rate limit. Failed chunks are retried
+    with exponential backoff. With a CandleStore, fetched chunks are checkpointed to it, so an interrupted
+    download resumes from the missing ranges. A series is returned only if every chunk was fetched and it has
+    no gaps: more than max_gap candles missing in a row within a trading day. Candles exist only for intervals
+    with trades, so a day's trading hours are taken from its first and last candles, and days are UTC days,
+    which start during the night break of the exchange.
+    """
+    # the longest range a single GetCandles request accepts for the interval
+    MAX_CHUNKS: dict[CandleInterval, datetime.timedelta] = {
+        CandleInterval.CANDLE_INTERVAL_1_MIN: datetime.timedelta(days=1),
+        CandleInterval.CANDLE_INTERVAL_5_MIN: datetime.timedelta(days=1),
+        CandleInterval.CANDLE_INTERVAL_15_MIN: datetime.timedelta(days=1),
+        CandleInterval.CANDLE_INTERVAL_HOUR: datetime.timedelta(weeks=1),
+        CandleInterval.CANDLE_INTERVAL_DAY: datetime.timedelta(days=365),
+    }
+
+    connection: InvestConnection
+    candle_store: CandleStore | None
+    logger: logging.Logger
+    workers: int
+    rate_limiter: RateLimiter
+    retries: int
+    backoff: float  # seconds before the first retry, doubled for every next one
+    checkpoint_interval: float  # seconds between writes of fetched chunks to the store
+    max_gap: int | None  # candles missing in a row tolerated within a trading day, None to skip the check
+
+    # pylint:disable=too-many-arguments
+    def __init__(self, connection: InvestConnection, candle_store: CandleStore | None,
+                 logger: logging.Logger, workers: int = 4, rate_limiter: RateLimiter = None, retries: int = 5,
+                 backoff: float = 0.5, checkpoint_interval: float = 5.0, max_gap: int | None = 30):
+        self.connection = connection
+        self.candle_store = candle_store
+        self.logger = logger
+        self.workers = workers
+        self.rate_limiter = rate_limiter or RateLimiter(rate=5.0, burst=workers)
+        self.retries = retries
+        self.backoff = backoff
+        self.checkpoint_interval = checkpoint_interval
+        self.max_gap = max_gap
+
+    def download(self, figi: str, interval: CandleInterval, from_time: datetime.datetime,
+                 to_time: datetime.datetime = None) -> CandleArrays:
+        """
+        Candles from [from_time, to_time), raises DownloadError if some of them could not be fetched
+        """
+        to_time = to_time or datetime.datetime.now(datetime.timezone.utc)
+        ranges = self.candle_store.missing_ranges(figi, interval, from_time, to_time) \
+            if self.candle_store else [(from_time, to_time)]
+        chunks = [chunk for start, end in ranges for chunk in self._split(start, end, interval)]
+        if chunks:
+            self.logger.debug(f'Downloading {len(chunks)} chunks of {figi} candles from {from_time} to {to_time}')
+
+        fetched: dict[Range, list[HistoricCandle]] = {}
+        failed: list[Range] = []
+        unsaved: dict[Range, list[HistoricCandle]] = {}
+        last_checkpoint = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='candles') as executor:
+            pending: dict[Future, Range] = {executor.submit(self._fetch_chunk, figi, interval, *chunk): chunk
+                                            for chunk in chunks}
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk = pending.pop(future)
+                    try:
+                        candles = future.result()
+                    except InvestError as error:
+                        self.logger.error(f'Failed to fetch candles from {chunk[0]} to {chunk[1]}. Error: {error}')
+                        failed.append(chunk)
+                        continue
+                    (unsaved if self.candle_store else fetched)[chunk] = candles
+                if unsaved and (not pending or time.monotonic() - last_checkpoint >= self.checkpoint_interval):
+                    self._checkpoint(figi, interval, unsaved)
+                    unsaved = {}
+                    last_checkpoint = time.monotonic()
+
+        if self.candle_store:
+            candles = self.candle_store.load_arrays(figi, interval, from_time, to_time)
+        else:
+            candles = CandleArrays.from_candles(candle for chunk in sorted(fetched) for candle in fetched[chunk])
+        if failed:
+            raise DownloadError(f'{len(failed)} of {len(chunks)} chunks of {figi} candles could not be fetched',
+                                sorted(failed), candles)
+        if len(candles) > 1 and not np.all(candles.time[1:] > candles.time[:-1]):
+            raise DownloadError(f'Candles of {figi} are not strictly ordered by time', [], candles)
+        gaps = self._gaps(candles, interval)
+        if gaps:
+            raise DownloadError(f'{len(gaps)} gaps in {figi} candles', gaps, candles)
+        return candles
+
+    def _gaps(self, candles: CandleArrays, interval: CandleInterval) -> list[Range]:
+        if self.max_gap is None or len(candles) < 2:
+            return []
+        step = interval_nanos(interval)
+        day = 24 * 60 * 60 * 10 ** 9
+        previous, following = candles.time[:-1], candles.time[1:]
+        gapped = np.flatnonzero((following - previous > (self.max_gap + 1) * step)
+                                & (previous // day == following // day))
+        return [(nanos_to_datetime(int(previous[i]) + step), nanos_to_datetime(int(following[i])))
+                for i in gapped.tolist()]
+
+    def _split(self, start: datetime.datetime, end: datetime.datetime, interval: CandleInterval) -> list[Range]:
+        chunk = self.MAX_CHUNKS[interval]
+        chunks = []
+        while start < end:
+            chunks.append((start, min(start + chunk, end)))
+            start += chunk
+        return chunks
+
+    def _fetch_chunk(self, figi: str, interval: CandleInterval, start: datetime.datetime,
+                     end: datetime.datetime) -> list[HistoricCandle]:
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            try:
+                return self.connection.services.market_data.get_candles(
+                    figi=figi, from_=start, to=end, interval=interval).candles
+            except InvestError as error:
+                if attempt == self.retries:
+                    raise
+                if isinstance(error, RequestError) and error.metadata and error.metadata.ratelimit_reset:
+                    self.rate_limiter.pause(error.metadata.ratelimit_reset)
+                delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.0)
+                self.logger.debug(f'Fetching candles from {start} to {end} failed, retrying in {delay:.1f}s. '
+                                  f'Error: {error}')
+                time.sleep(delay)
+                attempt += 1
+
+    def _checkpoint(self, figi: str, interval: CandleInterval, chunks: dict[Range, list[HistoricCandle]]) -> None:
+        # adjacent chunks are stored at once, every merge rewrites the stored columns
+        groups: list[tuple[Range, list[HistoricCandle]]] = []
+        for (start, end), candles in sorted(chunks.items()):
+            if groups and groups[-1][0][1] == start:
+                groups[-1] = ((groups[-1][0][0], end), groups[-1][1] + candles)
+            else:
+                groups.append(((start, end), list(candles)))
+        for (start, end), candles in groups:
+            self.candle_store.merge(figi, interval, candles, start, end)
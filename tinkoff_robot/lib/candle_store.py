@@ -0,0 +1,126 @@
+from __future__ import annotations
+
+import datetime
+import os
+
+from typing import Iterable, Iterator
+
+import numpy as np
+
+from tinkoff.invest import CandleInterval, HistoricCandle
+
+from helpers.candles import INTERVAL_DURATIONS, CandleArrays, datetime_to_nanos, nanos_to_datetime
+
+
+class CandleStore:
+    """
+    On-disk cache of historic candles. Every (figi, interval) pair is kept in its own directory as a set of
+    columnar .npy files which are memory-mapped on read, together with the list of time ranges already fetched.
+    """
+    RANGES_FILE = 'ranges'
+    INTERVAL_DURATIONS = INTERVAL_DURATIONS
+
+    root: str
+
+    def __init__(self, root: str):
+        self.root = root
+
+    def missing_ranges(self, figi: str, interval: CandleInterval, from_time: datetime.datetime,
+                       to_time: datetime.datetime) -> list[tuple[datetime.datetime, datetime.datetime]]:
+        """
+        Parts of [from_time, to_time) which are not cached yet
+        """
+        start, end = datetime_to_nanos(from_time), datetime_to_nanos(to_time)
+        missing = []
+        for covered_start, covered_end in self._read_ranges(figi, interval):
+            if covered_end <= start:
+                continue
+            if covered_start >= end:
+                break
+            if covered_start > start:
+                missing.append((start, covered_start))
+            start = max(start, covered_end)
+        if start < end:
+            missing.append((start, end))
+        return [(nanos_to_datetime(start), nanos_to_datetime(end)) for start, end in missing]
+
+    def merge(self, figi: str, interval: CandleInterval, candles: Iterable[HistoricCandle],
+              from_time: datetime.datetime, to_time: datetime.datetime) -> None:
+        """
+        Stores candles fetched for [from_time, to_time) and marks the range as cached.
+        Incomplete candles are skipped and the range is cut so that they will be fetched again next time.
+        """
+        candles = list(candles)
+        complete_before = min(
+            [datetime_to_nanos(to_time),
+             datetime_to_nanos(datetime.datetime.now(datetime.timezone.utc) - self.INTERVAL_DURATIONS[interval])]
+            + [datetime_to_nanos(candle.time) for candle in candles if not candle.is_complete])
+        new = CandleArrays.from_candles(candle for candle in candles if candle.is_complete)
+        new = new[new.time < complete_before]
+
+        start = datetime_to_nanos(from_time)
+        if complete_before <= start and len(new) == 0:
+            return
+
+        path = self._path(figi, interval)
+        os.makedirs(path, exist_ok=True)
+        if len(new) > 0:
+            merged = CandleArrays.concatenate([new, CandleArrays(**self._read_columns(figi, interval, mmap=False))])
+            # np.unique keeps the first occurrence, so freshly fetched candles override cached ones
+            _, index = np.unique(merged.time, return_index=True)
+            for column in CandleArrays.COLUMNS:
+                self._write_array(os.path.join(path, column), getattr(merged, column)[index])
+
+        if complete_before > start:
+            ranges = self._read_ranges(figi, interval) + [(start, complete_before)]
+            self._write_array(os.path.join(path, self.RANGES_FILE),
+                              np.array(self._join_ranges(ranges), dtype=np.int64).reshape(-1, 2))
+
+    def load(self, figi: str, interval: CandleInterval, from_time: datetime.datetime,
+             to_time: datetime.datetime) -> Iterator[HistoricCandle]:
+        yield from self.load_arrays(figi, interval, from_time, to_time).candles()
+
+    def load_arrays(self, figi: str, interval: CandleInterval, from_time: datetime.datetime,
+                    to_time: datetime.datetime) -> CandleArrays:
+        """
+        Cached candles from [from_time, to_time) as memory-mapped column slices
+        """
+        columns = self._read_columns(figi, interval)
+        left, right = np.searchsorted(columns['time'], [datetime_to_nanos(from_time), datetime_to_nanos(to_time)])
+        return CandleArrays(**{column: array[left:right] for column, array in columns.items()})
+
+    def _path(self, figi: str, interval: CandleInterval) -> str:
+        return os.path.join(self.root, figi, CandleInterval(interval).name)
+
+    def _read_columns(self, figi: str, interval: CandleInterval, mmap: bool = True) -> dict[str, np.ndarray]:
+        path = self._path(figi, interval)
+        return {column: self._read_array(os.path.join(path, column), mmap) for column in CandleArrays.COLUMNS}
+
+    def _read_ranges(self, figi: str, interval: CandleInterval) -> list[tuple[int, int]]:
+        ranges = self._read_array(os.path.join(self._path(figi, interval), self.RANGES_FILE), mmap=False)
+        return [(int(start), int(end)) for start, end in ranges.reshape(-1, 2)]
+
+    @staticmethod
+    def _read_array(filename: str, mmap: bool) -> np.ndarray:
+        try:
+            return np.load(f'{filename}.npy', mmap_mode='r' if mmap else None)
+        except FileNotFoundError:
+            return np.empty(0, dtype=np.int64)
+        except ValueError:  # empty arrays cannot be memory-mapped
+            return np.load(f'{filename}.npy')
+
+    @staticmethod
+    def _write_array(filename: str, array: np.ndarray) -> None:
+        with open(f'{filename}.tmp', 'wb') as file:
+            np.save(file, array)
+        os.replace(f'{filename}.tmp', f'{filename}.npy')
+
+    @staticmethod
+    def _join_ranges(ranges: list[tuple[int, int]]) -> list[tuple[int, int]]:
+        joined = []
+        for start, end in sorted(ranges):
+            if joined and start <= joined[-1][1]:
+                joined[-1] = (joined[-1][0], max(joined[-1][1], end))
+            else:
+                joined.append((start, end))
+        return joined
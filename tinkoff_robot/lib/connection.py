@@ -0,0 +1,63 @@
+from __future__ import annotations
+
+import threading
+
+from tinkoff.invest import Client
+from tinkoff.invest.services import Services
+
+
+class InvestConnection:
+    """
+    Long-lived Invest API channel shared by factories and robots. The channel is opened on first use
+    and kept until close(), gRPC channels are safe to use from several threads.
+    """
+    APP_NAME: str = 'trading_robot'
+    _shared: dict[tuple[str, str | None], InvestConnection] = {}
+    _shared_lock: threading.Lock = threading.Lock()
+
+    token: str
+    target: str | None  # API address, None for the default one
+    _client: Client | None
+    _services: Services | None
+    _lock: threading.Lock
+
+    def __init__(self, token: str, target: str = None):
+        self.token = token
+        self.target = target
+        self._client = None
+        self._services = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, token: str, target: str = None) -> InvestConnection:
+        """
+        The connection used by everything created with the same token and target in this process
+        """
+        with cls._shared_lock:
+            connection = cls._shared.get((token, target))
+            if connection is None:
+                connection = cls._shared[(token, target)] = cls(token, target)
+            return connection
+
+    @property
+    def services(self) -> Services:
+        if self._services is None:
+            with self._lock:
+                if self._services is None:
+                    client = Client(self.token, app_name=self.APP_NAME, target=self.target)
+                    self._services = client.__enter__()  # pylint:disable=unnecessary-dunder-call
+                    self._client = client
+        return self._services
+
+    def close(self) -> None:
+        with self._lock:
+            if self._client is not None:
+                self._client.__exit__(None, None, None)
+            self._client = None
+            self._services = None
+
+    def __enter__(self) -> Services:
+        return self.services
+
+    def __exit__(self, *exc_info):
+        self.close()
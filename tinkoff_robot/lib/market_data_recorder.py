@@ -0,0 +1,275 @@
+from __future__ import annotations
+
+import datetime
+import os
+import struct
+
+from typing import Iterator
+
+import numpy as np
+
+from tinkoff.invest import (
+    Candle,
+    MarketDataResponse,
+    Order,
+    OrderBook,
+    SecurityTradingStatus,
+    SubscriptionInterval,
+    Trade,
+    TradeDirection,
+    TradingStatus,
+)
+
+from helpers.candles import datetime_to_nanos, nanos_to_datetime, nanos_to_quotation, quotation_to_nanos
+
+
+class MarketDataRecorder:  # pylint:disable=too-many-instance-attributes
+    """
+    Append-only binary log of market data stream messages: candles, order books, trades and trading statuses.
+    The file is a fixed-size header followed by fixed-size little-endian records in the order the messages were
+    received. An order book is a record followed by records of LEVELS_PER_RECORD price levels, bids first.
+    The index file keeps the first record of every INDEX_INTERVAL of receive time, so a time range is found by
+    a binary search over it and over the records of a single interval.
+    Writes are buffered and flushed with the index, once per INDEX_INTERVAL, and on flush or close.
+    """
+    MAGIC: bytes = b'MDLG'
+    VERSION: int = 1
+    INDEX_SUFFIX: str = '.index'
+    INDEX_INTERVAL: int = 10 ** 9  # nanoseconds
+    LEVELS_PER_RECORD: int = 3
+    READ_CHUNK: int = 1 << 16  # records decoded at once by messages
+
+    CANDLE, ORDER_BOOK, LEVELS, TRADE, TRADING_STATUS = 1, 2, 3, 4, 5
+
+    HEADER_DTYPE = np.dtype([
+        ('magic', 'S4'),
+        ('version', '<u2'),
+        ('record_size', '<u2'),
+        ('reserved', 'V24'),
+    ])
+    RECORD_DTYPE = np.dtype([
+        ('time', '<i8'),  # nanoseconds since epoch the message was received at, never decreasing
+        ('kind', 'u1'),
+        ('flags', 'u1'),  # order book consistency, trade direction or trading status availability flags
+        ('count', '<u2'),  # bid levels of an order book
+        ('extra', '<u4'),  # ask levels of an order book, candle interval or trading status
+        ('figi', 'S12'),
+        ('event_time', '<i8'),  # exchange time of the message, nanoseconds since epoch
+        ('values', '<i8', (6,)),  # prices in billionths, quantities in lots
+    ])
+    INDEX_DTYPE = np.dtype([
+        ('time', '<i8'),
+        ('record', '<i8'),
+    ])
+    # same layout with scalar values, so that tolist gives flat tuples
+    _ROW_DTYPE = np.dtype(RECORD_DTYPE.descr[:-1] + [(f'value{i}', '<i8') for i in range(6)])
+    _RECORD = struct.Struct('<qBBHI12sq6q')
+    _INDEX = struct.Struct('<qq')
+
+    filename: str
+    fsync: bool
+    _records: int  # written so far
+    _last_time: int
+    _last_interval: int  # of the last index entry
+
+    def __init__(self, filename: str, fsync: bool = False):
+        """
+        Creates the log or reopens an existing one to append to it
+        """
+        assert self._RECORD.size == self.RECORD_DTYPE.itemsize and self._INDEX.size == self.INDEX_DTYPE.itemsize
+        self.filename = filename
+        self.fsync = fsync
+        index_filename = filename + self.INDEX_SUFFIX
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            self.read_header(filename)
+            records = self._memmap(filename)
+            self._records = self._complete_records(records)
+            self._last_time = int(records['time'][self._records - 1]) if self._records else 0
+            index = self._read_index(index_filename, self._records)
+            self._last_interval = int(index['time'][-1]) // self.INDEX_INTERVAL if len(index) else -1
+            del records
+            self._file = open(filename, 'r+b')  # pylint:disable=consider-using-with
+            self._file.truncate(self.HEADER_DTYPE.itemsize + self._records * self.RECORD_DTYPE.itemsize)
+            self._file.seek(0, os.SEEK_END)
+            self._index_file = open(index_filename, 'wb')  # pylint:disable=consider-using-with
+            self._index_file.write(index.tobytes())
+        else:
+            self._file = open(filename, 'wb')  # pylint:disable=consider-using-with
+            header = np.zeros(1, dtype=self.HEADER_DTYPE)
+            header[0] = (self.MAGIC, self.VERSION, self.RECORD_DTYPE.itemsize, b'')
+            self._file.write(header.tobytes())
+            self._index_file = open(index_filename, 'wb')  # pylint:disable=consider-using-with
+            self._records = 0
+            self._last_time = 0
+            self._last_interval = -1
+        self.flush()
+
+    def write(self, market_data: MarketDataResponse, time: int) -> None:
+        """
+        Appends the message received at time, nanoseconds since epoch. Messages of other kinds are skipped.
+        """
+        time = max(time, self._last_time)
+        pack = self._RECORD.pack
+        if candle := market_data.candle:
+            data = pack(time, self.CANDLE, 0, 0, candle.interval, candle.figi.encode(), datetime_to_nanos(candle.time),
+                        quotation_to_nanos(candle.open), quotation_to_nanos(candle.high),
+                        quotation_to_nanos(candle.low), quotation_to_nanos(candle.close), candle.volume,
+                        datetime_to_nanos(candle.last_trade_ts) if candle.last_trade_ts else 0)
+            records = 1
+        elif order_book := market_data.orderbook:
+            figi, event_time = order_book.figi.encode(), datetime_to_nanos(order_book.time)
+            parts = [pack(time, self.ORDER_BOOK, bool(order_book.is_consistent), len(order_book.bids),
+                          len(order_book.asks), figi, event_time, order_book.depth,
+                          quotation_to_nanos(order_book.limit_up) if order_book.limit_up else 0,
+                          quotation_to_nanos(order_book.limit_down) if order_book.limit_down else 0, 0, 0, 0)]
+            values = []
+            for order in order_book.bids + order_book.asks:
+                values += (quotation_to_nanos(order.price), order.quantity)
+                if len(values) == 2 * self.LEVELS_PER_RECORD:
+                    parts.append(pack(time, self.LEVELS, 0, 0, 0, figi, event_time, *values))
+                    values = []
+            if values:
+                values += [0] * (2 * self.LEVELS_PER_RECORD - len(values))
+                parts.append(pack(time, self.LEVELS, 0, 0, 0, figi, event_time, *values))
+            data = b''.join(parts)
+            records = len(parts)
+        elif trade := market_data.trade:
+            data = pack(time, self.TRADE, trade.direction, 0, 0, trade.figi.encode(), datetime_to_nanos(trade.time),
+                        quotation_to_nanos(trade.price), trade.quantity, 0, 0, 0, 0)
+            records = 1
+        elif status := market_data.trading_status:
+            flags = bool(status.limit_order_available_flag) | bool(status.market_order_available_flag) << 1
+            data = pack(time, self.TRADING_STATUS, flags, 0, status.trading_status, status.figi.encode(),
+                        datetime_to_nanos(status.time) if status.time else 0, 0, 0, 0, 0, 0, 0)
+            records = 1
+        else:
+            return
+
+        interval = time // self.INDEX_INTERVAL
+        if interval != self._last_interval:
+            self.flush()
+            self._index_file.write(self._INDEX.pack(time, self._records))
+            self._last_interval = interval
+        self._file.write(data)
+        self._records += records
+        self._last_time = time
+
+    def flush(self) -> None:
+        # records go first, so the index never points past them
+        for file in (self._file, self._index_file):
+            file.flush()
+            if self.fsync:
+                os.fsync(file.fileno())
+
+    def close(self) -> None:
+        self.flush()
+        self._file.close()
+        self._index_file.close()
+
+    @classmethod
+    def read_header(cls, filename: str) -> np.void:
+        header = np.fromfile(filename, dtype=cls.HEADER_DTYPE, count=1)
+        if len(header) == 0 or header[0]['magic'] != cls.MAGIC:
+            raise ValueError(f'{filename} is not a market data log')
+        if header[0]['version'] > cls.VERSION:
+            raise ValueError(f'Market data log version {header[0]["version"]} is not supported, '
+                             f'latest supported is {cls.VERSION}')
+        if header[0]['record_size'] != cls.RECORD_DTYPE.itemsize:
+            raise ValueError(f'Unexpected market data log record size {header[0]["record_size"]}')
+        return header[0]
+
+    @classmethod
+    def read(cls, filename: str, start: datetime.datetime = None, end: datetime.datetime = None) -> np.ndarray:
+        """
+        Memory-mapped records of the messages received in [start, end)
+        """
+        cls.read_header(filename)
+        records = cls._memmap(filename)
+        records = records[:cls._complete_records(records)]
+        index = cls._read_index(filename + cls.INDEX_SUFFIX, len(records))
+        first = 0 if start is None else cls._position(records, index, datetime_to_nanos(start))
+        last = len(records) if end is None else cls._position(records, index, datetime_to_nanos(end))
+        return records[first:last]
+
+    @classmethod
+    def messages(cls, filename: str, start: datetime.datetime = None, end: datetime.datetime = None,
+                 figi: str = None) -> Iterator[tuple[int, MarketDataResponse]]:
+        """
+        Messages received in [start, end), optionally of one instrument only, with their receive times
+        """
+        figi = figi.encode() if figi is not None else None
+        rows = cls._rows(cls.read(filename, start, end))
+        for time, kind, flags, count, extra, record_figi, event_time, *values in rows:
+            if kind == cls.ORDER_BOOK:
+                levels = []
+                for _ in range(-(-(count + extra) // cls.LEVELS_PER_RECORD)):
+                    levels += next(rows)[7:]
+            if figi is not None and record_figi != figi:
+                continue
+            record_figi = record_figi.decode()
+            if kind == cls.CANDLE:
+                market_data = MarketDataResponse(candle=Candle(
+                    figi=record_figi, interval=SubscriptionInterval(extra), open=nanos_to_quotation(values[0]),
+                    high=nanos_to_quotation(values[1]), low=nanos_to_quotation(values[2]),
+                    close=nanos_to_quotation(values[3]), volume=values[4], time=nanos_to_datetime(event_time),
+                    last_trade_ts=nanos_to_datetime(values[5]) if values[5] else None))
+            elif kind == cls.ORDER_BOOK:
+                orders = [Order(price=nanos_to_quotation(levels[i]), quantity=levels[i + 1])
+                          for i in range(0, 2 * (count + extra), 2)]
+                market_data = MarketDataResponse(orderbook=OrderBook(
+                    figi=record_figi, depth=values[0], is_consistent=bool(flags), bids=orders[:count],
+                    asks=orders[count:], time=nanos_to_datetime(event_time),
+                    limit_up=nanos_to_quotation(values[1]), limit_down=nanos_to_quotation(values[2])))
+            elif kind == cls.TRADE:
+                market_data = MarketDataResponse(trade=Trade(
+                    figi=record_figi, direction=TradeDirection(flags), price=nanos_to_quotation(values[0]),
+                    quantity=values[1], time=nanos_to_datetime(event_time)))
+            elif kind == cls.TRADING_STATUS:
+                market_data = MarketDataResponse(trading_status=TradingStatus(
+                    figi=record_figi, trading_status=SecurityTradingStatus(extra),
+                    time=nanos_to_datetime(event_time) if event_time else None,
+                    limit_order_available_flag=bool(flags & 1), market_order_available_flag=bool(flags & 2)))
+            else:
+                continue
+            yield time, market_data
+
+    @classmethod
+    def _rows(cls, records: np.ndarray) -> Iterator[tuple]:
+        # records are converted to Python objects in chunks, tolist is much faster than indexing them one by one
+        for first in range(0, len(records), cls.READ_CHUNK):
+            yield from records[first:first + cls.READ_CHUNK].view(cls._ROW_DTYPE).tolist()
+
+    @classmethod
+    def _memmap(cls, filename: str) -> np.ndarray:
+        records_num = max(0, os.path.getsize(filename) - cls.HEADER_DTYPE.itemsize) // cls.RECORD_DTYPE.itemsize
+        if records_num == 0:
+            return np.zeros(0, dtype=cls.RECORD_DTYPE)
+        return np.memmap(filename, dtype=cls.RECORD_DTYPE, mode='r', offset=cls.HEADER_DTYPE.itemsize,
+                         shape=(records_num,))
+
+    @classmethod
+    def _complete_records(cls, records: np.ndarray) -> int:
+        # an order book torn by a crash is dropped with its levels
+        last = len(records) - 1
+        while last >= 0 and records['kind'][last] == cls.LEVELS:
+            last -= 1
+        if last >= 0 and records['kind'][last] == cls.ORDER_BOOK:
+            levels = int(records['count'][last]) + int(records['extra'][last])
+            if last + 1 + -(-levels // cls.LEVELS_PER_RECORD) > len(records):
+                return last
+        return len(records)
+
+    @classmethod
+    def _read_index(cls, filename: str, records_num: int) -> np.ndarray:
+        if not os.path.exists(filename):
+            return np.zeros(0, dtype=cls.INDEX_DTYPE)
+        index = np.fromfile(filename, dtype=cls.INDEX_DTYPE)
+        return index[index['record'] < records_num]
+
+    @staticmethod
+    def _position(records: np.ndarray, index: np.ndarray, time: int) -> int:
+        # records of the index entries before and after time bound the search to a single interval
+        entry = int(np.searchsorted(index['time'], time, side='right'))
+        low = int(index['record'][entry - 1]) if entry > 0 else 0
+        high = int(index['record'][entry]) if entry < len(index) else len(records)
+        return low + int(np.searchsorted(records['time'][low:high], time))
@@ -0,0 +1,62 @@
+import os
+import pickle
+import threading
+import time
+
+from typing import Any, Callable, TypeVar
+
+T = TypeVar('T')
+
+
+class MetadataCache:
+    """
+    Instrument metadata kept in memory and in a pickle file, entries expire after ttl seconds.
+    Only values that are fetched successfully are cached.
+    """
+    path: str | None  # None for a cache living in memory only
+    ttl: float
+    _entries: dict[str, tuple[float, Any]]  # key -> (expiration time, value)
+    _lock: threading.Lock
+
+    def __init__(self, path: str | None, ttl: float = 24 * 60 * 60):
+        self.path = path
+        self.ttl = ttl
+        self._entries = self._read()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Any | None:
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time.time():
+            return None
+        return entry[1]
+
+    def put(self, key: str, value: Any) -> None:
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._write()
+
+    def get_or_fetch(self, key: str, fetch: Callable[[], T]) -> T:
+        value = self.get(key)
+        if value is None:
+            value = fetch()
+            self.put(key, value)
+        return value
+
+    def _read(self) -> dict[str, tuple[float, Any]]:
+        if self.path is None or not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, 'rb') as file:
+                entries = pickle.load(file)
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return {}  # unreadable caches are refetched
+        now = time.time()
+        return {key: entry for key, entry in entries.items() if entry[0] >= now}
+
+    def _write(self) -> None:
+        if self.path is None:
+            return
+        temp_path = f'{self.path}.tmp'
+        with open(temp_path, 'wb') as file:
+            pickle.dump(self._entries, file)
+        os.replace(temp_path, self.path)
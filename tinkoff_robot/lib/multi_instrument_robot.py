@@ -0,0 +1,87 @@
+import logging
+
+from tinkoff.invest import MarketDataResponse
+from tinkoff.invest.exceptions import InvestError
+from tinkoff.invest.services import MarketDataStreamManager
+
+from lib.connection import InvestConnection
+from lib.market_data_recorder import MarketDataRecorder
+from lib.trading_robot import TradingRobot
+from stats.analyzer import TradeStatisticsAnalyzer
+from helpers.clock import SYSTEM_CLOCK, Clock
+
+
+class MultiInstrumentTradingRobot:
+    """
+    Trades several instruments over a single connection and a single market data stream.
+    Every message is routed to the robot of its instrument.
+    """
+    APP_NAME: str = 'trading_robot'
+
+    token: str
+    robots: dict[str, TradingRobot]  # figi -> robot
+    logger: logging.Logger
+    target: str | None  # API address, None for the default one
+    connection: InvestConnection
+    clock: Clock
+    recorder: MarketDataRecorder | None  # logs the messages of all instruments
+
+    def __init__(self, token: str, robots: list[TradingRobot], logger: logging.Logger, target: str = None,
+                 connection: InvestConnection = None, clock: Clock = None, recorder: MarketDataRecorder = None):
+        self.token = token
+        self.target = target
+        self.connection = connection or InvestConnection.shared(token, target)
+        self.robots = {robot.instrument_info.figi: robot for robot in robots}
+        self.logger = logger
+        self.clock = clock or SYSTEM_CLOCK
+        self.recorder = recorder
+        assert len(self.robots) == len(robots), 'only one robot per instrument is supported'
+
+    def trade(self) -> dict[str, TradeStatisticsAnalyzer]:
+        self.logger.info(f'Starting trading {len(self.robots)} instruments')
+        for robot in self.robots.values():
+            robot.warm_up()
+
+        active = dict(self.robots)
+        client = self.connection.services
+        market_data_stream: MarketDataStreamManager = client.create_market_data_stream()
+        TradingRobot.subscribe(market_data_stream, list(self.robots.values()))
+        self.logger.debug(f'Subscribed to MarketDataStream for {list(self.robots)}')
+        streamed = [robot for robot in self.robots.values() if not robot.sandbox_mode]
+        order_trades_stopped = TradingRobot.start_order_trades_stream(client, streamed, self.logger) \
+            if streamed else None
+        try:
+            for robot in self.robots.values():
+                if robot._track_pending_orders():  # pylint:disable=protected-access
+                    robot._check_trade_orders(client)  # pylint:disable=protected-access
+            for market_data in market_data_stream:
+                if self.recorder is not None:
+                    self.recorder.write(market_data, self.clock.time_ns())
+                robot = active.get(self._get_figi(market_data))
+                if robot is None:
+                    continue
+                if market_data.candle or market_data.orderbook or market_data.trade:
+                    robot._on_update(client, market_data)  # pylint:disable=protected-access
+                if market_data.trading_status and not market_data.trading_status.market_order_available_flag:
+                    robot.logger.info(f'Trading is limited. Current status: {market_data.trading_status}')
+                    active.pop(robot.instrument_info.figi)
+                    if len(active) == 0:
+                        break
+        except InvestError as error:
+            self.logger.info(f'Caught exception {error}, stopping trading')
+        finally:
+            market_data_stream.stop()
+            if order_trades_stopped:
+                order_trades_stopped.set()
+            if self.recorder is not None:
+                self.recorder.flush()
+            for robot in self.robots.values():
+                robot.trade_strategy.close()
+        return {figi: robot.trade_statistics for figi, robot in self.robots.items()}
+
+    @staticmethod
+    def _get_figi(market_data: MarketDataResponse) -> str | None:
+        for payload in (market_data.candle, market_data.orderbook, market_data.trade, market_data.trading_status):
+            if payload:
+                return payload.figi
+        return None
@@ -0,0 +1,96 @@
+from __future__ import annotations
+
+import datetime
+import itertools
+import logging
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from tinkoff.invest import Instrument
+
+from helpers.candles import CandleArrays
+from lib.batch_backtest import run_batch_backtest
+from lib.shared_candles import attach_candles, share_candles, shared_candles
+from lib.trading_robot import TradingRobot
+from stats.analyzer import BalanceCalculator, BalanceProcessor
+from strategy.base_strategy import TradeStrategyBase, TradeStrategyParams
+
+def _run_point(strategy_class: type[TradeStrategyBase], params: dict[str, any],  # pylint:disable=too-many-arguments
+               start: int, initial_params: TradeStrategyParams, instrument_info: Instrument,
+               logger: logging.Logger) -> dict[str, any]:
+    trade_statistics = run_batch_backtest(
+        trade_strategy=strategy_class(**params),
+        candles=shared_candles(),
+        start=start,
+        initial_params=TradeStrategyParams(instrument_balance=initial_params.instrument_balance,
+                                           currency_balance=initial_params.currency_balance,
+                                           pending_orders=[]),
+        instrument_info=instrument_info,
+        logger=logger
+    )
+    if len(trade_statistics.ledger) == 0:
+        return params
+    stats, _ = trade_statistics.get_report(processors=[BalanceProcessor()], calculators=[BalanceCalculator()])
+    return params | stats
+
+
+class ParameterSweep:
+    """
+    Backtests a strategy for every combination of constructor parameters from the grid.
+    Candles are loaded once and shared with worker processes through shared memory.
+    """
+    robot: TradingRobot
+    strategy_class: type[TradeStrategyBase]
+    grid: dict[str, list[any]]
+    processes: int
+
+    def __init__(self, robot: TradingRobot, strategy_class: type[TradeStrategyBase], grid: dict[str, list[any]],
+                 processes: int = None):
+        self.robot = robot
+        self.strategy_class = strategy_class
+        self.grid = grid
+        self.processes = processes or os.cpu_count()
+
+    def points(self) -> list[dict[str, any]]:
+        return [dict(zip(self.grid.keys(), values)) for values in itertools.product(*self.grid.values())]
+
+    def run(self, initial_params: TradeStrategyParams, test_duration: datetime.timedelta,
+            train_duration: datetime.timedelta = None, sort_by: str = 'income') -> pd.DataFrame:
+        candles, start = self.robot.load_backtest_candles(test_duration, train_duration)
+        return self.run_on_candles(candles, start, initial_params, sort_by=sort_by)
+
+    def run_on_candles(self, candles: CandleArrays, start: int, initial_params: TradeStrategyParams,
+                       sort_by: str = 'income') -> pd.DataFrame:
+        """
+        Results are sorted by sort_by in descending order, use e.g. '-max_loss' for ascending one
+        """
+        points = self.points()
+        self.robot.logger.info(f'Running parameter sweep of {len(points)} points on {len(candles)} candles '
+                               f'with {self.processes} processes')
+        shared_memory = share_candles(candles)
+        try:
+            with ProcessPoolExecutor(max_workers=self.processes, initializer=attach_candles,
+                                     initargs=(shared_memory.name, len(candles))) as executor:
+                results = list(executor.map(
+                    _run_point,
+                    itertools.repeat(self.strategy_class),
+                    points,
+                    itertools.repeat(start),
+                    itertools.repeat(initial_params),
+                    itertools.repeat(self.robot.instrument_info),
+                    itertools.repeat(self.robot.logger),
+                    chunksize=max(1, len(points) // (self.processes * 4))
+                ))
+        finally:
+            shared_memory.close()
+            shared_memory.unlink()
+
+        report = pd.DataFrame(results)
+        column = sort_by.removeprefix('-')
+        if column in report:
+            report = report.sort_values(column, ascending=sort_by.startswith('-'), na_position='last',
+                                        ignore_index=True)
+        return report
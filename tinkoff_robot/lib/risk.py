@@ -0,0 +1,215 @@
+from __future__ import annotations
+
+import collections
+import logging
+
+from dataclasses import dataclass
+
+from tinkoff.invest import OrderDirection
+
+from helpers.money import Money
+from stats.analyzer import TradeStatisticsAnalyzer
+from strategy.base_strategy import RobotTradeOrder
+
+
+@dataclass
+class RiskLimits:
+    """
+    Limits checked before every order, None for no limit. Money amounts are in the instrument currency.
+    Orders reducing the position or the exposure pass position and notional limits even above them.
+    """
+    max_position: int | None = None  # lots held after the order, long or short
+    max_notional: float | None = None  # value of the position after the order
+    max_order_quantity: int | None = None  # lots of a single order
+    max_orders: int | None = None  # orders per orders_interval
+    orders_interval: float = 1.0  # seconds
+    max_drawdown: float | None = None  # loss from the highest PnL which halts trading
+
+
+class RiskState:
+    """
+    Exposure, PnL and recent orders of one instrument, or of the whole account when shared by the engines
+    of several instruments. max_position is applied per instrument only.
+    """
+    limits: RiskLimits
+    notional: int  # billionths, value of the positions at the last market prices
+    pnl: int  # billionths, since the first market price
+    peak_pnl: int
+    halted: str | None  # the reason trading is halted for
+    _max_notional: int | None
+    _max_drawdown: int | None
+    _interval: int  # nanoseconds
+    _order_times: collections.deque | None
+
+    def __init__(self, limits: RiskLimits = None):
+        self.limits = limits or RiskLimits()
+        self.notional = 0
+        self.pnl = 0
+        self.peak_pnl = 0
+        self.halted = None
+        self._max_notional = Money(float(self.limits.max_notional)).nanos \
+            if self.limits.max_notional is not None else None
+        self._max_drawdown = Money(float(self.limits.max_drawdown)).nanos \
+            if self.limits.max_drawdown is not None else None
+        self._interval = round(self.limits.orders_interval * 10 ** 9)
+        self._order_times = collections.deque(maxlen=self.limits.max_orders) if self.limits.max_orders else None
+
+    def halt(self, reason: str) -> None:
+        self.halted = reason
+
+    def resume(self) -> None:
+        """
+        Lifts the halt, the drawdown is counted from the current PnL again
+        """
+        self.halted = None
+        self.peak_pnl = self.pnl
+
+    def update(self, notional_delta: int, pnl_delta: int) -> bool:
+        """
+        Adds changes of the exposure and PnL, returns True if the drawdown limit is hit
+        """
+        self.notional += notional_delta
+        self.pnl += pnl_delta
+        if self.pnl > self.peak_pnl:
+            self.peak_pnl = self.pnl
+        return self._max_drawdown is not None and self.peak_pnl - self.pnl >= self._max_drawdown
+
+    def reject_reason(self, quantity: int, notional_delta: int, now: int, reduces: bool) -> str | None:
+        """
+        reduces is True for orders reducing the absolute position, they are allowed while trading is halted
+        """
+        if self.halted and not reduces:
+            return f'trading is halted: {self.halted}'
+        if self.limits.max_order_quantity is not None and quantity > self.limits.max_order_quantity:
+            return f'quantity {quantity} exceeds the limit of {self.limits.max_order_quantity} lots'
+        if self._max_notional is not None and notional_delta > 0 \
+                and self.notional + notional_delta > self._max_notional:
+            return f'notional {Money.from_nanos(self.notional + notional_delta)} exceeds the limit of ' \
+                   f'{Money.from_nanos(self._max_notional)}'
+        times = self._order_times
+        if times is not None and len(times) == times.maxlen and now - times[0] < self._interval:
+            return f'more than {times.maxlen} orders in {self.limits.orders_interval}s'
+        return None
+
+    def add_order(self, now: int) -> None:
+        if self._order_times is not None:
+            self._order_times.append(now)
+
+
+class RiskEngine:  # pylint:disable=too-many-instance-attributes
+    """
+    Pre-trade checks of the orders of one instrument: balances of the TradeStatisticsAnalyzer less the lots of
+    pending sell orders, limits of the instrument and, with a shared account state, limits of the whole account.
+    Exposure and PnL are updated on every market price given to mark, so checks don't depend on the history.
+    Trading is halted once the loss from the highest PnL reaches max_drawdown, until resume is called;
+    orders reducing the position are still allowed, so that it can be closed.
+    """
+    trade_statistics: TradeStatisticsAnalyzer
+    limits: RiskLimits
+    state: RiskState
+    account: RiskState | None
+    logger: logging.Logger
+    _states: tuple[RiskState, ...]
+    _initial_equity: int | None
+    _notional: int  # contribution of the instrument to the states
+    _pnl: int
+
+    def __init__(self, trade_statistics: TradeStatisticsAnalyzer, limits: RiskLimits = None,
+                 account: RiskState = None, logger: logging.Logger = None):
+        self.trade_statistics = trade_statistics
+        self.limits = limits or RiskLimits()
+        self.state = RiskState(self.limits)
+        self.account = account
+        self.logger = logger or logging.getLogger(__name__)
+        self._states = (self.state, account) if account is not None else (self.state,)
+        self._initial_equity = None
+        self._notional = 0
+        self._pnl = 0
+
+    @property
+    def halted(self) -> str | None:
+        for state in self._states:
+            if state.halted:
+                return state.halted
+        return None
+
+    def halt(self, reason: str) -> None:
+        """
+        Kill switch: rejects all orders of the instrument but the ones reducing the position until resume
+        """
+        self.logger.error(f'Trading is halted: {reason}')
+        self.state.halt(reason)
+
+    def resume(self) -> None:
+        for state in self._states:
+            state.resume()
+
+    def mark(self, price: int) -> None:
+        """
+        Revalues the position at the market price in billionths
+        """
+        position_value = self.trade_statistics.positions * self.trade_statistics.instrument_info.lot * price
+        equity = self.trade_statistics.money_nanos + position_value
+        if self._initial_equity is None:
+            self._initial_equity = equity
+        notional, pnl = abs(position_value), equity - self._initial_equity
+        notional_delta, pnl_delta = notional - self._notional, pnl - self._pnl
+        self._notional, self._pnl = notional, pnl
+        for state in self._states:
+            if state.update(notional_delta, pnl_delta) and not state.halted:
+                state.halt(f'drawdown {Money.from_nanos(state.peak_pnl - state.pnl)} reached the limit of '
+                           f'{Money(float(state.limits.max_drawdown))}')
+                self.logger.error(f'Trading is halted: {state.halted}')
+
+    def check(self, order: RobotTradeOrder, price: int | None, now: int,  # pylint:disable=too-many-arguments
+              reserved_lots: int = 0, reserved_money: int = 0) -> bool:
+        """
+        Checks the order at the price in billionths it is expected to be filled at, now is a time in nanoseconds
+        for the order rate limits. Accepted orders count towards them.
+        reserved_lots and reserved_money, in billionths, are held by orders the statistics don't know of yet,
+        e.g. ones still being posted.
+        """
+        reason = self._reject_reason(order, price, now, reserved_lots, reserved_money)
+        if reason is not None:
+            self.logger.warning(f'Strategy decision cannot be executed, {reason}. Order: {order}')
+            return False
+        for state in self._states:
+            state.add_order(now)
+        return True
+
+    def _reject_reason(self, order: RobotTradeOrder, price: int | None, now: int,  # pylint:disable=too-many-arguments
+                       reserved_lots: int, reserved_money: int) -> str | None:
+        quantity = order.quantity
+        if quantity <= 0:
+            return 'quantity must be positive'
+        if price is None:
+            return 'no market price is known yet'
+        statistics = self.trade_statistics
+        lot = statistics.instrument_info.lot
+        if order.direction == OrderDirection.ORDER_DIRECTION_BUY:
+            cost = quantity * lot * price
+            money = statistics.money_nanos - reserved_money
+            if cost > money:
+                return f'buy cost {Money.from_nanos(cost)} exceeds the balance {Money.from_nanos(money)}'
+            position = statistics.positions + quantity
+        else:
+            available = statistics.positions - reserved_lots - self._pending_sells()
+            if quantity > available:
+                return f'sell quantity {quantity} exceeds the balance {available}'
+            position = statistics.positions - quantity
+
+        max_position = self.limits.max_position
+        if max_position is not None and abs(position) > max_position and abs(position) > abs(statistics.positions):
+            return f'position {position} exceeds the limit of {max_position} lots'
+        notional_delta = abs(position) * lot * price - self._notional
+        reduces = abs(position) < abs(statistics.positions)
+        for state in self._states:
+            reason = state.reject_reason(quantity, notional_delta, now, reduces)
+            if reason is not None:
+                return reason
+        return None
+
+    def _pending_sells(self) -> int:
+        # lots of the resting sell orders are held by the broker until they are filled or cancelled
+        return sum(order.lots_requested - order.lots_executed for order in self.trade_statistics.pending_orders.values()
+                   if order.direction == OrderDirection.ORDER_DIRECTION_SELL)
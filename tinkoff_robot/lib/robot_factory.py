@@ -3,9 +3,9 @@ import sys
 
 from tinkoff.invest import (
     AccessLevel,
+    Account,
     AccountStatus,
     AccountType,
-    Client,
     InstrumentIdType,
 )
 
@@ -14,24 +14,38 @@ from tinkoff.invest.exceptions import InvestError
 from strategy.base_strategy import *
 from stats.analyzer import TradeStatisticsAnalyzer
 from helpers.money import Money
+from lib.candle_store import CandleStore
+from lib.connection import InvestConnection
+from lib.metadata_cache import MetadataCache
+from lib.risk import RiskLimits, RiskState
 from lib.trading_robot import TradingRobot
 
 
-class TradingRobotFactory:
+class TradingRobotFactory:  # pylint:disable=too-many-instance-attributes
     APP_NAME = 'trading_robot'
     instrument_info: Instrument
     token: str
     account_id: str
     logger: logging.Logger
     sandbox_mode: bool
+    candle_store: CandleStore | None
+    target: str | None  # API address, None for the default one
+    connection: InvestConnection
+    metadata_cache: MetadataCache
 
     def __init__(self, token: str, account_id: str, figi: str = None,  # pylint:disable=too-many-arguments
-                 ticker: str = None, class_code: str = None, logger_level: int | str = 'INFO'):
-        self.instrument_info = self._get_instrument_info(token, figi, ticker, class_code).instrument
+                 ticker: str = None, class_code: str = None, logger_level: int | str = 'INFO',
+                 candle_store_path: str | None = '.candles', target: str = None,
+                 connection: InvestConnection = None, metadata_cache: MetadataCache = None):
+        self.target = target
         self.token = token
         self.account_id = account_id
+        self.connection = connection or InvestConnection.shared(token, target)
+        self.metadata_cache = metadata_cache or MetadataCache('.metadata')
+        self.instrument_info = self._get_instrument_info(figi, ticker, class_code)
         self.logger = self.setup_logger(logger_level)
-        self.sandbox_mode = self._validate_account(token, account_id, self.logger)
+        self.sandbox_mode = self._validate_account(self.logger)
+        self.candle_store = CandleStore(candle_store_path) if candle_store_path else None
 
     def setup_logger(self, logger_level: int | str):
         logger = logging.getLogger(f'robot.{self.instrument_info.ticker}')
@@ -42,7 +56,12 @@ class TradingRobotFactory:
         logger.addHandler(handler)
         return logger
 
-    def create_robot(self, trade_strategy: TradeStrategyBase, sandbox_mode: bool = True) -> TradingRobot:
+    def create_robot(self, trade_strategy: TradeStrategyBase, sandbox_mode: bool = True,
+                     robot_class: type[TradingRobot] = None, risk_limits: RiskLimits = None,
+                     account_risk: RiskState = None) -> TradingRobot:
+        """
+        account_risk is the state of account-wide limits, shared by robots of all instruments
+        """
         money, positions = self._get_current_postitions()
         trade_strategy.load_instrument_info(self.instrument_info)
         stats = TradeStatisticsAnalyzer(
@@ -51,71 +70,88 @@ class TradingRobotFactory:
             instrument_info=self.instrument_info,
             logger=self.logger.getChild(trade_strategy.strategy_id).getChild('stats')
         )
-        return TradingRobot(token=self.token, account_id=self.account_id, sandbox_mode=sandbox_mode,
-                            trade_strategy=trade_strategy, trade_statistics=stats, instrument_info=self.instrument_info,
-                            logger=self.logger.getChild(trade_strategy.strategy_id))
+        robot_class = robot_class or TradingRobot
+        return robot_class(token=self.token, account_id=self.account_id, sandbox_mode=sandbox_mode,
+                           trade_strategy=trade_strategy, trade_statistics=stats, instrument_info=self.instrument_info,
+                           logger=self.logger.getChild(trade_strategy.strategy_id), candle_store=self.candle_store,
+                           target=self.target, connection=self.connection, risk_limits=risk_limits,
+                           account_risk=account_risk)
 
     def _get_current_postitions(self) -> tuple[Money, int]:
         # amount of money and instrument balance
-        with Client(self.token, app_name=self.APP_NAME) as client:
-            positions = client.operations.get_positions(account_id=self.account_id)
+        positions = self.connection.services.operations.get_positions(account_id=self.account_id)
 
-            instruments = [sec for sec in positions.securities if sec.figi == self.instrument_info.figi]
-            if len(instruments) > 0:
-                instrument = instruments[0].balance
-            else:
-                instrument = 0
+        instruments = [sec for sec in positions.securities if sec.figi == self.instrument_info.figi]
+        if len(instruments) > 0:
+            instrument = instruments[0].balance
+        else:
+            instrument = 0
 
-            moneys = [m for m in positions.money if m.currency == self.instrument_info.currency]
-            if len(moneys) > 0:
-                money = Money(moneys[0].units, moneys[0].nano)
-            else:
-                money = Money(0, 0)
+        moneys = [m for m in positions.money if m.currency == self.instrument_info.currency]
+        if len(moneys) > 0:
+            money = Money(moneys[0].units, moneys[0].nano)
+        else:
+            money = Money(0, 0)
 
-            return money, instrument
+        return money, instrument
 
-    @staticmethod
-    def _validate_account(token: str, account_id: str, logger: logging.Logger) -> bool:
-        try:
-            with Client(token, app_name=TradingRobotFactory.APP_NAME) as client:
-                accounts = [acc for acc in client.users.get_accounts().accounts if acc.id == account_id]
-                sandbox_mode = False
-                if len(accounts) == 0:
-                    sandbox_mode = True
-                    accounts = [acc for acc in client.sandbox.get_sandbox_accounts().accounts if acc.id == account_id]
-                    if len(accounts) == 0:
-                        logger.error(f'Account {account_id} not found.')
-                        raise ValueError('Account not found')
-
-                account = accounts[0]
-                if account.type not in [AccountType.ACCOUNT_TYPE_TINKOFF, AccountType.ACCOUNT_TYPE_INVEST_BOX]:
-                    logger.error(f'Account type {account.type} is not supported')
-                    raise ValueError('Unsupported account type')
-                if account.status != AccountStatus.ACCOUNT_STATUS_OPEN:
-                    logger.error(f'Account status {account.status} is not supported')
-                    raise ValueError('Unsupported account status')
-                if account.access_level != AccessLevel.ACCOUNT_ACCESS_LEVEL_FULL_ACCESS:
-                    logger.error(f'No access to account. Current level is {account.access_level}')
-                    raise ValueError('Insufficient access level')
-                return sandbox_mode
+    def _cache_key(self, *parts: str) -> str:
+        return ':'.join((self.target or 'default',) + parts)
 
+    def _validate_account(self, logger: logging.Logger) -> bool:
+        # the account is not cached: its access level depends on the token and may change at any time
+        try:
+            account, sandbox_mode = self._fetch_account(logger)
         except InvestError as error:
             logger.error(f'Failed to validate account. Exception: {error}')
             raise error
 
-    @staticmethod
-    def _get_instrument_info(token: str, figi: str = None, ticker: str = None, class_code: str = None):
-        with Client(token, app_name=TradingRobotFactory.APP_NAME) as client:
-            if figi is None:
-                if ticker is None or class_code is None:
-                    raise ValueError('figi or both ticker and class_code must be not None')
-                return client.instruments.get_instrument_by(id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_TICKER,
-                                                            class_code=class_code, id=ticker)
-            return client.instruments.get_instrument_by(id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_FIGI, id=figi)
+        if account.type not in [AccountType.ACCOUNT_TYPE_TINKOFF, AccountType.ACCOUNT_TYPE_INVEST_BOX]:
+            logger.error(f'Account type {account.type} is not supported')
+            raise ValueError('Unsupported account type')
+        if account.status != AccountStatus.ACCOUNT_STATUS_OPEN:
+            logger.error(f'Account status {account.status} is not supported')
+            raise ValueError('Unsupported account status')
+        if account.access_level != AccessLevel.ACCOUNT_ACCESS_LEVEL_FULL_ACCESS:
+            logger.error(f'No access to account. Current level is {account.access_level}')
+            raise ValueError('Insufficient access level')
+        return sandbox_mode
+
+    def _fetch_account(self, logger: logging.Logger) -> tuple[Account, bool]:
+        client = self.connection.services
+        accounts = [acc for acc in client.users.get_accounts().accounts if acc.id == self.account_id]
+        if len(accounts) > 0:
+            return accounts[0], False
+        accounts = [acc for acc in client.sandbox.get_sandbox_accounts().accounts if acc.id == self.account_id]
+        if len(accounts) == 0:
+            logger.error(f'Account {self.account_id} not found.')
+            raise ValueError('Account not found')
+        return accounts[0], True
+
+    def _get_instrument_info(self, figi: str = None, ticker: str = None, class_code: str = None) -> Instrument:
+        if figi is None:
+            if ticker is None or class_code is None:
+                raise ValueError('figi or both ticker and class_code must be not None')
+            key = self._cache_key('instrument', class_code, ticker)
+        else:
+            key = self._cache_key('instrument', figi)
+        instrument = self.metadata_cache.get(key)
+        if instrument is None:
+            instrument = self._fetch_instrument_info(figi, ticker, class_code)
+            self.metadata_cache.put(self._cache_key('instrument', instrument.figi), instrument)
+            self.metadata_cache.put(self._cache_key('instrument', instrument.class_code, instrument.ticker), instrument)
+        return instrument
+
+    def _fetch_instrument_info(self, figi: str = None, ticker: str = None, class_code: str = None) -> Instrument:
+        instruments = self.connection.services.instruments
+        if figi is None:
+            return instruments.get_instrument_by(id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_TICKER,
+                                                 class_code=class_code, id=ticker).instrument
+        return instruments.get_instrument_by(id_type=InstrumentIdType.INSTRUMENT_ID_TYPE_FIGI, id=figi).instrument
 
     def get_account_info(self):
-        with Client(self.token, app_name=TradingRobotFactory.APP_NAME) as client:
-            info = client.users.get_info()
-            print(info)
-            portfolio = client.operations.get_positions(account_id=self.account_id)
-            print(portfolio)
+        client = self.connection.services
+        info = client.users.get_info()
+        print(info)
+        portfolio = client.operations.get_positions(account_id=self.account_id)
+        print(portfolio)
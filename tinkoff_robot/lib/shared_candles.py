@@ -0,0 +1,37 @@
+from __future__ import annotations
+
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+
+from helpers.candles import CandleArrays
+
+# candles shared with the current worker process, set up by attach_candles
+_shared_memory: SharedMemory | None = None
+_candles: CandleArrays | None = None
+
+
+def share_candles(candles: CandleArrays) -> SharedMemory:
+    """
+    Copies candles to a new shared memory block, the caller closes and unlinks it
+    """
+    columns = len(CandleArrays.COLUMNS)
+    shared_memory = SharedMemory(create=True, size=max(1, columns * len(candles) * 8))
+    table = np.ndarray((columns, len(candles)), dtype=np.int64, buffer=shared_memory.buf)
+    for i, column in enumerate(CandleArrays.COLUMNS):
+        table[i] = getattr(candles, column)
+    return shared_memory
+
+
+def attach_candles(name: str, length: int) -> None:
+    """
+    Worker process initializer mapping the candles shared by share_candles
+    """
+    global _shared_memory, _candles  # pylint:disable=global-statement
+    _shared_memory = SharedMemory(name=name)
+    table = np.ndarray((len(CandleArrays.COLUMNS), length), dtype=np.int64, buffer=_shared_memory.buf)
+    _candles = CandleArrays(*table)
+
+
+def shared_candles() -> CandleArrays:
+    return _candles
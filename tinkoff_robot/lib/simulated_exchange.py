@@ -0,0 +1,227 @@
+from __future__ import annotations
+
+import datetime
+import heapq
+import logging
+import uuid
+
+from dataclasses import dataclass
+
+from tinkoff.invest import (
+    Candle,
+    HistoricCandle,
+    Instrument,
+    MoneyValue,
+    OrderDirection,
+    OrderExecutionReportStatus,
+    OrderState,
+    OrderType,
+    Quotation,
+)
+
+from helpers.candles import quotation_to_nanos
+from helpers.money import Money
+from stats.analyzer import TradeStatisticsAnalyzer
+from strategy.base_strategy import RobotTradeOrder
+
+
+@dataclass
+class SimulatedOrder:
+    order_id: str
+    direction: OrderDirection
+    order_type: OrderType
+    price: int  # billionths per instrument unit, limit price of limit orders
+    lots_requested: int
+    lots_executed: int = 0
+    amount: int = 0  # billionths paid or received for executed lots
+    time: datetime.datetime | None = None
+
+    @property
+    def lots_left(self) -> int:
+        return self.lots_requested - self.lots_executed
+
+
+class SimulatedExchange:
+    """
+    Executes orders of a single instrument in backtests. Market orders are filled at the candle close,
+    limit orders rest in price-priority heaps and are matched against the range of following candles or trades.
+    Fills are limited by the traded volume and reported to the TradeStatisticsAnalyzer as order states.
+    """
+    instrument_info: Instrument
+    trade_statistics: TradeStatisticsAnalyzer
+    logger: logging.Logger
+    volume_share: float  # share of candle volume available to the robot orders
+
+    orders: dict[str, SimulatedOrder]  # resting orders, cancelled ones are removed from heaps lazily
+    reserved_money: int  # billionths held by resting buy orders
+    reserved_lots: int  # lots held by resting sell orders
+
+    def __init__(self, instrument_info: Instrument, trade_statistics: TradeStatisticsAnalyzer, logger: logging.Logger,
+                 volume_share: float = 1.0):
+        self.instrument_info = instrument_info
+        self.trade_statistics = trade_statistics
+        self.logger = logger
+        self.volume_share = volume_share
+        self.orders = {}
+        self.reserved_money = 0
+        self.reserved_lots = 0
+        self._buys: list[tuple[int, int, str]] = []  # (-price, sequence number, order_id)
+        self._sells: list[tuple[int, int, str]] = []  # (price, sequence number, order_id)
+        self._sequence = 0
+        self._stale = 0  # heap entries of orders which are not resting anymore
+
+    def post_order(self, trade_order: RobotTradeOrder, candle: Candle | HistoricCandle) -> OrderState | None:
+        """
+        Places the order at the moment of candle close. Returns None if the order is rejected.
+        """
+        close = quotation_to_nanos(candle.close)
+        limit = trade_order.order_type == OrderType.ORDER_TYPE_LIMIT and trade_order.price is not None
+        price = trade_order.price.nanos if limit else close
+        if not self._validate(trade_order, price):
+            return None
+
+        order = SimulatedOrder(order_id=str(uuid.uuid4()), direction=trade_order.direction,
+                               order_type=trade_order.order_type, price=price, lots_requested=trade_order.quantity,
+                               time=candle.time)
+        buy = order.direction == OrderDirection.ORDER_DIRECTION_BUY
+        if not limit or (price >= close if buy else price <= close):  # marketable, taken at the close price
+            self._fill(order, order.lots_requested, close, candle.time)
+            return self._order_state(order, OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL)
+
+        new_order = self._order_state(order, OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_NEW)
+        self.trade_statistics.add_trade(new_order)
+        self.orders[order.order_id] = order
+        self._sequence += 1
+        if buy:
+            self.reserved_money += order.lots_left * self.instrument_info.lot * order.price
+            heapq.heappush(self._buys, (-order.price, self._sequence, order.order_id))
+        else:
+            self.reserved_lots += order.lots_left
+            heapq.heappush(self._sells, (order.price, self._sequence, order.order_id))
+        return new_order
+
+    def cancel_order(self, order_id: str) -> bool:
+        order = self.orders.pop(order_id, None)
+        if order is None:
+            return False
+        self._release(order, order.lots_left)
+        self._stale += 1
+        if self._stale > len(self.orders):
+            self._compact()
+        self.trade_statistics.cancel_order(order_id)
+        return True
+
+    def match(self, candle: Candle | HistoricCandle) -> None:
+        """
+        Matches resting orders against the price range of the candle
+        """
+        self._match(open_price=quotation_to_nanos(candle.open), low=quotation_to_nanos(candle.low),
+                    high=quotation_to_nanos(candle.high), volume=int(candle.volume * self.volume_share),
+                    time=candle.time)
+
+    def match_trade(self, price: Quotation, quantity: int, time: datetime.datetime) -> None:
+        """
+        Matches resting orders against a single trade of quantity lots
+        """
+        price = quotation_to_nanos(price)
+        self._match(open_price=price, low=price, high=price, volume=quantity, time=time)
+
+    def _match(self, open_price: int, low: int, high: int, volume: int,  # pylint:disable=too-many-arguments
+               time: datetime.datetime) -> None:
+        # buy orders are filled at their limit price or at the open if the price gapped below it, sells are symmetric
+        buy_volume = volume
+        while self._buys and buy_volume > 0 and -self._buys[0][0] >= low:
+            order = self._top(self._buys)
+            if order is not None:
+                lots = min(order.lots_left, buy_volume)
+                buy_volume -= lots
+                self._fill(order, lots, min(order.price, open_price), time)
+
+        sell_volume = volume
+        while self._sells and sell_volume > 0 and self._sells[0][0] <= high:
+            order = self._top(self._sells)
+            if order is not None:
+                lots = min(order.lots_left, sell_volume)
+                sell_volume -= lots
+                self._fill(order, lots, max(order.price, open_price), time)
+
+    def _top(self, heap: list[tuple[int, int, str]]) -> SimulatedOrder | None:
+        order = self.orders.get(heap[0][2])
+        if order is None:
+            heapq.heappop(heap)
+            self._stale -= 1
+        return order
+
+    def _fill(self, order: SimulatedOrder, lots: int, price: int, time: datetime.datetime) -> None:
+        resting = order.order_id in self.orders
+        if resting:
+            self._release(order, lots)
+        order.lots_executed += lots
+        order.amount += lots * self.instrument_info.lot * price
+        if order.lots_left > 0:
+            status = OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL
+        else:
+            status = OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL
+            if resting:
+                self.orders.pop(order.order_id)
+                heapq.heappop(self._buys if order.direction == OrderDirection.ORDER_DIRECTION_BUY else self._sells)
+        self.logger.debug(f'Order {order.order_id} filled {lots} lots at {Money.from_nanos(price)} on {time}')
+        self.trade_statistics.add_trade(self._order_state(order, status))
+
+    def _release(self, order: SimulatedOrder, lots: int) -> None:
+        if order.direction == OrderDirection.ORDER_DIRECTION_BUY:
+            self.reserved_money -= lots * self.instrument_info.lot * order.price
+        else:
+            self.reserved_lots -= lots
+
+    def _compact(self) -> None:
+        self._buys = [entry for entry in self._buys if entry[2] in self.orders]
+        self._sells = [entry for entry in self._sells if entry[2] in self.orders]
+        heapq.heapify(self._buys)
+        heapq.heapify(self._sells)
+        self._stale = 0
+
+    def _validate(self, trade_order: RobotTradeOrder, price: int) -> bool:
+        if trade_order.quantity <= 0:
+            self.logger.warning(f'Order rejected, quantity must be positive: {trade_order}')
+            return False
+        if trade_order.direction == OrderDirection.ORDER_DIRECTION_BUY:
+            cost = trade_order.quantity * self.instrument_info.lot * price
+            available = self.trade_statistics.money_nanos - self.reserved_money
+            if cost > available:
+                self.logger.warning(f'Order rejected. Requested buy cost: {Money.from_nanos(cost)}, '
+                                    f'available: {Money.from_nanos(available)}')
+                return False
+        else:
+            available = self.trade_statistics.get_positions() - self.reserved_lots
+            if trade_order.quantity > available:
+                self.logger.warning(f'Order rejected. Requested sell quantity: {trade_order.quantity}, '
+                                    f'available: {available}')
+                return False
+        return True
+
+    def _order_state(self, order: SimulatedOrder, status: OrderExecutionReportStatus) -> OrderState:
+        currency = self.instrument_info.currency
+        units = order.lots_executed * self.instrument_info.lot
+        average_price = order.amount // units if units else 0
+        return OrderState(
+            order_id=order.order_id,
+            execution_report_status=status,
+            lots_requested=order.lots_requested,
+            lots_executed=order.lots_executed,
+            initial_order_price=Money.from_nanos(order.price * order.lots_requested * self.instrument_info.lot)
+            .to_money_value(currency),
+            executed_order_price=Money.from_nanos(average_price).to_money_value(currency),
+            total_order_amount=Money.from_nanos(order.amount).to_money_value(currency),
+            average_position_price=Money.from_nanos(average_price).to_money_value(currency),
+            initial_commission=MoneyValue(currency, 0, 0),
+            executed_commission=MoneyValue(currency, 0, 0),
+            figi=self.instrument_info.figi,
+            direction=order.direction,
+            initial_security_price=Money.from_nanos(order.price).to_money_value(currency),
+            stages=[],
+            service_commission=MoneyValue(currency, 0, 0),
+            currency=currency,
+            order_type=order.order_type,
+            order_date=order.time
+        )
@@ -0,0 +1,184 @@
+from __future__ import annotations
+
+import dataclasses
+import datetime
+import logging
+
+from grpc import StatusCode
+from tinkoff.invest import (
+    HistoricCandle,
+    Instrument,
+    MarketDataResponse,
+    OrderDirection,
+    OrderExecutionReportStatus,
+    OrderState,
+    OrderType,
+    Quotation,
+)
+from tinkoff.invest.exceptions import RequestError
+
+from helpers.candles import nanos_to_datetime, nanos_to_quotation, quotation_to_nanos
+from helpers.clock import SimulatedClock
+from helpers.money import Money
+from lib.market_data_recorder import MarketDataRecorder
+from lib.simulated_exchange import SimulatedExchange
+from lib.trading_robot import TradingRobot
+from stats.analyzer import TradeStatisticsAnalyzer
+from strategy.base_strategy import RobotTradeOrder, TradeStrategyParams
+
+
+class _BrokerAccount(TradeStatisticsAnalyzer):
+    """
+    Balances of the simulated broker, keeps the last state of every order for the robot to poll
+    """
+    order_states: dict[str, OrderState]
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.order_states = {}
+
+    def add_trade(self, trade: OrderState) -> None:
+        self.order_states[trade.order_id] = trade
+        super().add_trade(trade)
+
+    def cancel_order(self, order_id: str):
+        if order_id in self.order_states:
+            self.order_states[order_id] = dataclasses.replace(
+                self.order_states[order_id],
+                execution_report_status=OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_CANCELLED)
+        super().cancel_order(order_id)
+
+
+class SimulatedBroker:
+    """
+    Stands in for the orders and sandbox services of the API in replays. Orders are executed by a SimulatedExchange:
+    market orders at the best opposite price of the order book or at the last price, resting limit orders against
+    recorded trades, or against candles if the log has no trades. Candle updates of the stream are cumulative,
+    only the volume added since the previous update of the same candle is matched.
+    """
+    instrument_info: Instrument
+    clock: SimulatedClock
+    logger: logging.Logger
+    account: _BrokerAccount
+    exchange: SimulatedExchange
+    _last_price: int | None  # billionths
+    _best_bid: int | None
+    _best_ask: int | None
+    _has_trades: bool
+    _candle: tuple[datetime.datetime, int] | None  # time and volume of the last candle update
+
+    def __init__(self, instrument_info: Instrument, initial_params: TradeStrategyParams, clock: SimulatedClock,
+                 logger: logging.Logger, volume_share: float = 1.0):
+        self.instrument_info = instrument_info
+        self.clock = clock
+        self.logger = logger
+        self.account = _BrokerAccount(positions=initial_params.instrument_balance,
+                                      money=initial_params.currency_balance, instrument_info=instrument_info,
+                                      logger=logger.getChild('broker'))
+        self.account.clock = clock
+        self.exchange = SimulatedExchange(instrument_info, self.account, logger, volume_share)
+        self.orders = self.sandbox = self  # the robot calls client.orders or client.sandbox
+        self._last_price = None
+        self._best_bid = None
+        self._best_ask = None
+        self._has_trades = False
+        self._candle = None
+
+    def update(self, market_data: MarketDataResponse) -> None:
+        if candle := market_data.candle:
+            self._last_price = quotation_to_nanos(candle.close)
+            volume = candle.volume
+            if self._candle is not None and self._candle[0] == candle.time:
+                volume -= self._candle[1]
+            self._candle = (candle.time, candle.volume)
+            if not self._has_trades and volume > 0:
+                self.exchange.match(dataclasses.replace(candle, volume=volume))
+        if order_book := market_data.orderbook:
+            self._best_bid = quotation_to_nanos(order_book.bids[0].price) if order_book.bids else None
+            self._best_ask = quotation_to_nanos(order_book.asks[0].price) if order_book.asks else None
+        if trade := market_data.trade:
+            self._has_trades = True
+            self._last_price = quotation_to_nanos(trade.price)
+            self.exchange.match_trade(trade.price, trade.quantity, trade.time)
+
+    def post_order(self, figi: str, quantity: int, price: Quotation | None,  # pylint:disable=too-many-arguments
+                   direction: OrderDirection, account_id: str, order_type: OrderType, order_id: str) -> OrderState:
+        # pylint:disable=unused-argument
+        buy = direction == OrderDirection.ORDER_DIRECTION_BUY
+        market_price = (self._best_ask if buy else self._best_bid) or self._last_price
+        if market_price is None:
+            raise RequestError(StatusCode.FAILED_PRECONDITION, 'No market price to execute the order at', None)
+        market = nanos_to_quotation(market_price)
+        time = nanos_to_datetime(self.clock.time_ns())
+        order = RobotTradeOrder(quantity=quantity, direction=direction, order_type=order_type,
+                                price=Money(price) if price is not None else None)
+        state = self.exchange.post_order(order, HistoricCandle(open=market, high=market, low=market, close=market,
+                                                               volume=0, time=time, is_complete=True))
+        if state is None:
+            raise RequestError(StatusCode.INVALID_ARGUMENT, f'Order rejected: {order}', None)
+        return state
+
+    post_sandbox_order = post_order
+
+    def get_order_state(self, account_id: str, order_id: str) -> OrderState:  # pylint:disable=unused-argument
+        if order_id not in self.account.order_states:
+            raise RequestError(StatusCode.NOT_FOUND, f'Order {order_id} not found', None)
+        return self.account.order_states[order_id]
+
+    get_sandbox_order_state = get_order_state
+
+    def cancel_order(self, account_id: str, order_id: str) -> None:  # pylint:disable=unused-argument
+        if not self.exchange.cancel_order(order_id):
+            raise RequestError(StatusCode.NOT_FOUND, f'Order {order_id} is not active', None)
+
+    cancel_sandbox_order = cancel_order
+
+
+class TickReplay:
+    """
+    Feeds a MarketDataRecorder log of one instrument through TradingRobot._on_update as fast as it is read.
+    The robot, its statistics and risk checks see a clock set to the receive time of every message and trade
+    against a SimulatedBroker, so the replay exercises the same code as the live robot on the recorded ticks.
+    """
+    robot: TradingRobot
+    filename: str
+    volume_share: float  # share of the recorded volume available to the robot orders
+
+    def __init__(self, robot: TradingRobot, filename: str, volume_share: float = 1.0):
+        self.robot = robot
+        self.filename = filename
+        self.volume_share = volume_share
+
+    def run(self, initial_params: TradeStrategyParams, start: datetime.datetime = None,
+            end: datetime.datetime = None, history: list[HistoricCandle] = None) -> TradeStatisticsAnalyzer:
+        """
+        Replays the messages received in [start, end) after warming up on the history candles.
+        The robot is reset to the replay statistics and clock and keeps them afterwards.
+        """
+        robot = self.robot
+        clock = SimulatedClock()
+        trade_statistics = TradeStatisticsAnalyzer(positions=initial_params.instrument_balance,
+                                                   money=initial_params.currency_balance,
+                                                   instrument_info=robot.instrument_info,
+                                                   logger=robot.logger.getChild('replay'))
+        trade_statistics.clock = clock
+        broker = SimulatedBroker(robot.instrument_info, initial_params, clock, robot.logger, self.volume_share)
+        robot.reset(trade_statistics, clock)
+        robot.load_history(history or [])
+        # the broker sees every message, the strategy only the data it subscribes to, as in the live stream
+        strategy = robot.trade_strategy
+        candles = strategy.candle_subscription_interval is not None
+        order_books = bool(strategy.order_book_subscription_depth)
+        trades = strategy.trades_subscription
+
+        updates = 0
+        for received, market_data in MarketDataRecorder.messages(self.filename, start, end,
+                                                                 figi=robot.instrument_info.figi):
+            clock.now = received
+            broker.update(market_data)
+            if candles and market_data.candle or order_books and market_data.orderbook \
+                    or trades and market_data.trade:
+                robot._on_update(broker, market_data)  # pylint:disable=protected-access
+                updates += 1
+        robot.logger.info(f'Replayed {updates} updates of {self.filename}')
+        return trade_statistics
@@ -1,6 +1,10 @@
+from __future__ import annotations
+
+import dataclasses
 import datetime
+import threading
 import uuid
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 
 from tinkoff.invest import (
     CandleInstrument,
@@ -9,6 +13,7 @@ from tinkoff.invest import (
     MoneyValue,
     OrderBookInstrument,
     OrderExecutionReportStatus,
+    OrderTrades,
     PostOrderResponse,
     Quotation,
     TradeInstrument,
@@ -17,17 +22,34 @@ from tinkoff.invest import (
 from tinkoff.invest.services import MarketDataStreamManager, Services
 
 from lib.robot_factory import *
+from lib.backtester import Backtester
+from lib.batch_backtest import run_batch_backtest
+from lib.candle_aggregator import CandleAggregator
+from lib.candle_downloader import CandleDownloader, DownloadError
+from lib.candle_store import CandleStore
+from lib.connection import InvestConnection
+from lib.market_data_recorder import MarketDataRecorder
+from lib.risk import RiskEngine, RiskLimits, RiskState
+from stats.metrics import RobotMetrics
+from strategy.indicators import INDICATORS, InstrumentIndicators
+from helpers.candles import CandleArrays, datetime_to_nanos, quotation_to_nanos
+from helpers.clock import SYSTEM_CLOCK, Clock
+from helpers.order_book import OrderBook, TradesBuffer
 
 
 @dataclass
 class OrderExecutionInfo:
     direction: OrderDirection
-    lots: int = 0
-    amount: float = 0.0
+    lots: int = 0  # executed according to the trades stream
+    amount: int = 0  # billionths
+    trade_ids: set[str] = field(default_factory=set)  # of the trades already counted
 
 
-class TradingRobot:  # pylint:disable=too-many-instance-attributes
+class TradingRobot:  # pylint:disable=too-many-instance-attributes,too-many-public-methods
     APP_NAME: str = 'trading_robot'
+    ORDERS_POLL_INTERVAL: float = 5.0  # seconds between order state polls, keeps them within the API limits
+    ORDERS_RECONCILIATION_INTERVAL: float = 300.0  # seconds between order state polls when fills are streamed
+    TRADES_BUFFER_SIZE: int = 4096
 
     token: str
     account_id: str
@@ -37,9 +59,30 @@ class TradingRobot:  # pylint:disable=too-many-instance-attributes
     logger: logging.Logger
     instrument_info: Instrument
     sandbox_mode: bool
-
-    def __init__(self, token: str, account_id: str, sandbox_mode: bool, trade_strategy: TradeStrategyBase,
-                 trade_statistics: TradeStatisticsAnalyzer, instrument_info: Instrument, logger: logging.Logger):
+    candle_store: CandleStore | None
+    target: str | None  # API address, None for the default one
+    metrics: RobotMetrics
+    connection: InvestConnection
+    indicators: InstrumentIndicators
+    downloader: CandleDownloader
+    order_book: OrderBook | None  # kept if the strategy subscribes to the order book
+    trades: TradesBuffer | None  # kept if the strategy subscribes to trades
+    risk: RiskEngine
+    clock: Clock
+    recorder: MarketDataRecorder | None  # logs every message of the market data stream
+    _last_price: int | None  # billionths, of the last candle or trade
+    _aggregator: CandleAggregator | None  # builds bars of the strategy timeframes
+    _orders_lock: threading.RLock
+    _order_trades_streaming: bool
+    _last_orders_check: int  # monotonic nanoseconds
+
+    def __init__(self, token: str, account_id: str, sandbox_mode: bool,  # pylint:disable=too-many-arguments
+                 trade_strategy: TradeStrategyBase, trade_statistics: TradeStatisticsAnalyzer,
+                 instrument_info: Instrument, logger: logging.Logger, candle_store: CandleStore = None,
+                 target: str = None, metrics: RobotMetrics = None, connection: InvestConnection = None,
+                 indicators: InstrumentIndicators = None, downloader: CandleDownloader = None,
+                 risk_limits: RiskLimits = None, account_risk: RiskState = None, clock: Clock = None,
+                 recorder: MarketDataRecorder = None):
         self.token = token
         self.account_id = account_id
         self.trade_strategy = trade_strategy
@@ -48,92 +91,223 @@ class TradingRobot:  # pylint:disable=too-many-instance-attributes
         self.logger = logger
         self.instrument_info = instrument_info
         self.sandbox_mode = sandbox_mode
+        self.candle_store = candle_store
+        self.target = target
+        self.metrics = metrics or RobotMetrics(instrument_info.figi)
+        self.connection = connection or InvestConnection.shared(token, target)
+        self.indicators = indicators or INDICATORS.for_instrument(instrument_info.figi)
+        self.trade_strategy.load_indicators(self.indicators)
+        self.downloader = downloader or CandleDownloader(self.connection, candle_store, logger)
+        depth = self.trade_strategy.order_book_subscription_depth
+        self.order_book = OrderBook(depth) if depth else None
+        self.trades = TradesBuffer(self.TRADES_BUFFER_SIZE) if self.trade_strategy.trades_subscription else None
+        self.trade_strategy.load_order_book(self.order_book, self.trades)
+        self.risk = RiskEngine(trade_statistics, risk_limits, account=account_risk, logger=logger)
+        self.clock = clock or SYSTEM_CLOCK
+        self.recorder = recorder
+        self._last_price = None
+        self._aggregator = None
+        self._orders_lock = threading.RLock()
+        self._order_trades_streaming = False
+        self._last_orders_check = 0
 
     def trade(self) -> TradeStatisticsAnalyzer:
         self.logger.info('Starting trading')
 
-        self.trade_strategy.load_candles(
-            list(self._load_historic_data(datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(hours=1))))
-
-        with Client(self.token, app_name=self.APP_NAME) as client:
-            trading_status = client.market_data.get_trading_status(figi=self.instrument_info.figi)
-            if not trading_status.market_order_available_flag:
-                self.logger.warning('Market trading is not available now.')
-
-            market_data_stream: MarketDataStreamManager = client.create_market_data_stream()
-            if self.trade_strategy.candle_subscription_interval:
-                market_data_stream.candles.subscribe([
-                    CandleInstrument(
-                        figi=self.instrument_info.figi,
-                        interval=self.trade_strategy.candle_subscription_interval)
-                ])
-            if self.trade_strategy.order_book_subscription_depth:
-                market_data_stream.order_book.subscribe([
-                    OrderBookInstrument(
-                        figi=self.instrument_info.figi,
-                        depth=self.trade_strategy.order_book_subscription_depth)
-                ])
-            if self.trade_strategy.trades_subscription:
-                market_data_stream.trades.subscribe([
-                    TradeInstrument(figi=self.instrument_info.figi)
-                ])
-            market_data_stream.info.subscribe([
-                InfoInstrument(figi=self.instrument_info.figi)
-            ])
-            self.logger.debug(f'Subscribed to MarketDataStream, '
-                              f'interval: {self.trade_strategy.candle_subscription_interval}')
-            try:
-                for market_data in market_data_stream:
-                    self.logger.debug(f'Received market_data {market_data}')
-                    if market_data.candle:
-                        self._on_update(client, market_data)
-                    if market_data.trading_status and market_data.trading_status.market_order_available_flag:
-                        self.logger.info(f'Trading is limited. Current status: {market_data.trading_status}')
-                        break
-            except InvestError as error:
-                self.logger.info(f'Caught exception {error}, stopping trading')
-                market_data_stream.stop()
-            return self.trade_statistics
+        self.warm_up()
+
+        client = self.connection.services
+        trading_status = client.market_data.get_trading_status(figi=self.instrument_info.figi)
+        if not trading_status.market_order_available_flag:
+            self.logger.warning('Market trading is not available now.')
+
+        market_data_stream: MarketDataStreamManager = client.create_market_data_stream()
+        self.subscribe(market_data_stream, [self])
+        self.logger.debug(f'Subscribed to MarketDataStream, '
+                          f'interval: {self.trade_strategy.candle_subscription_interval}')
+        order_trades_stopped = None if self.sandbox_mode \
+            else self.start_order_trades_stream(client, [self], self.logger)
+        try:
+            if self._track_pending_orders():
+                self._check_trade_orders(client)
+            for market_data in market_data_stream:
+                self.logger.debug(f'Received market_data {market_data}')
+                if self.recorder is not None:
+                    self.recorder.write(market_data, self.clock.time_ns())
+                if market_data.candle or market_data.orderbook or market_data.trade:
+                    self._on_update(client, market_data)
+                if market_data.trading_status and not market_data.trading_status.market_order_available_flag:
+                    self.logger.info(f'Trading is limited. Current status: {market_data.trading_status}')
+                    break
+        except InvestError as error:
+            self.logger.info(f'Caught exception {error}, stopping trading')
+        finally:
+            # the connection outlives trading, so the streams are stopped explicitly
+            market_data_stream.stop()
+            if order_trades_stopped:
+                order_trades_stopped.set()
+            if self.recorder is not None:
+                self.recorder.flush()
+            self.trade_strategy.close()
+        return self.trade_statistics
+
+    def warm_up(self) -> None:
+        try:
+            candles = list(self._load_historic_data(datetime.datetime.now(datetime.timezone.utc)
+                                                    - datetime.timedelta(hours=1)))
+        except DownloadError as error:
+            self.logger.error(f'Warming up on incomplete history. Error: {error}')
+            candles = list(error.candles.candles())
+        self.load_history(candles)
+
+    def load_history(self, candles: list[HistoricCandle]) -> None:
+        """
+        Prepares the strategy, indicators and bars to trade after the candles
+        """
+        self.trade_strategy.load_trade_statistics(self.trade_statistics)
+        self.trade_strategy.load_candles(candles)
+        self.indicators.load(candles)
+        if candles:
+            self._mark(quotation_to_nanos(candles[-1].close))
+        timeframes = self.trade_strategy.timeframes
+        self._aggregator = CandleAggregator(timeframes) if timeframes else None
+        for candle in candles:
+            self._aggregate(candle)
+
+    def reset(self, trade_statistics: TradeStatisticsAnalyzer, clock: Clock = None,
+              indicators: InstrumentIndicators = None) -> None:
+        """
+        Starts the robot over on other statistics and clock, e.g. for a replay. Pending orders, prices,
+        the order book, trades and the instrument risk state are dropped, account risk state is not used.
+        """
+        self.trade_statistics = trade_statistics
+        self.clock = clock or SYSTEM_CLOCK
+        self.indicators = indicators or InstrumentIndicators()
+        self.trade_strategy.load_indicators(self.indicators)
+        if self.order_book is not None:
+            self.order_book = OrderBook(self.order_book.depth)
+        if self.trades is not None:
+            self.trades = TradesBuffer(self.TRADES_BUFFER_SIZE)
+        self.trade_strategy.load_order_book(self.order_book, self.trades)
+        self.risk = RiskEngine(trade_statistics, self.risk.limits, logger=self.logger)
+        self.orders_executed = {}
+        self._last_price = None
+        self._last_orders_check = 0
+
+    def _apply_market_data(self, market_data: MarketDataResponse) -> None:
+        # indicators, bars and the order book are brought up to date before the strategy decides
+        if market_data.candle:
+            self.indicators.update(market_data.candle)
+            self._aggregate(market_data.candle)
+            self._mark(quotation_to_nanos(market_data.candle.close))
+        if market_data.orderbook and self.order_book is not None:
+            self.order_book.update(market_data.orderbook)
+        if market_data.trade and self.trades is not None:
+            self.trades.update(market_data.trade)
+            self._mark(quotation_to_nanos(market_data.trade.price))
+
+    def _mark(self, price: int) -> None:
+        self._last_price = price
+        self.risk.mark(price)
+
+    def _aggregate(self, candle: Candle | HistoricCandle) -> None:
+        if self._aggregator is not None:
+            for interval, bar in self._aggregator.update(candle):
+                self.trade_strategy.on_bar(interval, bar)
+
+    @staticmethod
+    def subscribe(market_data_stream: MarketDataStreamManager, robots: list[TradingRobot]) -> None:
+        """
+        Subscribes the stream to the data requested by strategies of all robots, one request per data kind
+        """
+        candles = [CandleInstrument(figi=robot.instrument_info.figi,
+                                    interval=robot.trade_strategy.candle_subscription_interval)
+                   for robot in robots if robot.trade_strategy.candle_subscription_interval]
+        order_books = [OrderBookInstrument(figi=robot.instrument_info.figi,
+                                           depth=robot.trade_strategy.order_book_subscription_depth)
+                       for robot in robots if robot.trade_strategy.order_book_subscription_depth]
+        trades = [TradeInstrument(figi=robot.instrument_info.figi)
+                  for robot in robots if robot.trade_strategy.trades_subscription]
+        if candles:
+            market_data_stream.candles.subscribe(candles)
+        if order_books:
+            market_data_stream.order_book.subscribe(order_books)
+        if trades:
+            market_data_stream.trades.subscribe(trades)
+        market_data_stream.info.subscribe([InfoInstrument(figi=robot.instrument_info.figi) for robot in robots])
+
+    @staticmethod
+    def start_order_trades_stream(client: Services, robots: list[TradingRobot],
+                                  logger: logging.Logger) -> threading.Event:
+        """
+        Starts a thread applying fills from the order trades stream to the robots as they arrive.
+        While it runs, robots poll order states only to reconcile missed updates.
+        Set the returned event to stop the thread, it exits on the next message of the stream.
+        """
+        stopped = threading.Event()
+        thread = threading.Thread(target=TradingRobot._listen_order_trades, args=(client, robots, logger, stopped),
+                                  name='order-trades', daemon=True)
+        thread.start()
+        return stopped
+
+    @staticmethod
+    def _listen_order_trades(client: Services, robots: list[TradingRobot], logger: logging.Logger,
+                             stopped: threading.Event) -> None:
+        robots_by_figi = {robot.instrument_info.figi: robot for robot in robots}
+        for robot in robots:
+            robot._order_trades_streaming = True  # pylint:disable=protected-access
+        try:
+            for response in client.orders_stream.trades_stream(accounts=list({robot.account_id for robot in robots})):
+                if stopped.is_set():
+                    break
+                if response.order_trades and response.order_trades.figi in robots_by_figi:
+                    robots_by_figi[response.order_trades.figi]._on_order_trades(  # pylint:disable=protected-access
+                        response.order_trades)
+        except InvestError as error:
+            logger.warning(f'Order trades stream stopped, falling back to polling. Error: {error}')
+        finally:
+            for robot in robots:
+                robot._order_trades_streaming = False  # pylint:disable=protected-access
 
     def backtest(self, initial_params: TradeStrategyParams, test_duration: datetime.timedelta,
                  train_duration: datetime.timedelta = None) -> TradeStatisticsAnalyzer:
 
-        trade_statistics = TradeStatisticsAnalyzer(
-            positions=initial_params.instrument_balance,
-            money=initial_params.currency_balance,
-            instrument_info=self.instrument_info,
-            logger=self.logger
-        )
-
         now = datetime.datetime.now(datetime.timezone.utc)
         if train_duration:
             train = self._load_historic_data(now - test_duration - train_duration, now - test_duration)
             self.trade_strategy.load_candles(list(train))
         test = self._load_historic_data(now - test_duration)
 
-        params = initial_params
-        for candle in test:
-            price = self.convert_from_quotation(candle.close)
-            robot_decision = self.trade_strategy.decide_by_candle(candle, params)
-
-            trade_order = robot_decision.robot_trade_order
-            if trade_order:
-                assert trade_order.quantity > 0
-                if trade_order.direction == OrderDirection.ORDER_DIRECTION_SELL:
-                    assert trade_order.quantity >= params.instrument_balance, \
-                        f'Cannot execute order {trade_order}. Params are {params}'  # TODO: better logging
-                    params.instrument_balance -= trade_order.quantity
-                    params.currency_balance += trade_order.quantity * price * self.instrument_info.lot
-                else:
-                    assert trade_order.quantity * self.instrument_info.lot * price <= params.currency_balance, \
-                        f'Cannot execute order {trade_order}. Params are {params}'  # TODO: better logging
-                    params.instrument_balance += trade_order.quantity
-                    params.currency_balance -= trade_order.quantity * price * self.instrument_info.lot
-
-                trade_statistics.add_backtest_trade(
-                    quantity=trade_order.quantity, price=candle.close, direction=trade_order.direction)
+        backtester = Backtester(trade_strategy=self.trade_strategy, instrument_info=self.instrument_info,
+                                logger=self.logger, risk_limits=self.risk.limits)
+        return backtester.run(test, initial_params)
+
+    def backtest_batch(self, initial_params: TradeStrategyParams, test_duration: datetime.timedelta,
+                       train_duration: datetime.timedelta = None) -> TradeStatisticsAnalyzer:
+        """
+        Same as backtest, but runs the strategy over NumPy arrays using TradeStrategyBase.decide_batch.
+        Only balances are checked, risk limits are not applied.
+        """
+        candles, start = self.load_backtest_candles(test_duration, train_duration)
+        return run_batch_backtest(
+            trade_strategy=self.trade_strategy,
+            candles=candles,
+            start=start,
+            initial_params=initial_params,
+            instrument_info=self.instrument_info,
+            logger=self.logger
+        )
 
-        return trade_statistics
+    def load_backtest_candles(self, test_duration: datetime.timedelta,
+                              train_duration: datetime.timedelta = None) -> tuple[CandleArrays, int]:
+        """
+        Returns train candles followed by test candles and the index of the first test candle
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        train = self._load_historic_arrays(now - test_duration - train_duration, now - test_duration) \
+            if train_duration else CandleArrays.empty()
+        test = self._load_historic_arrays(now - test_duration)
+        return CandleArrays.concatenate([train, test]), len(train)
 
     @staticmethod
     def convert_from_quotation(amount: Quotation | MoneyValue) -> float | None:
@@ -142,93 +316,138 @@ class TradingRobot:  # pylint:disable=too-many-instance-attributes
         return amount.units + amount.nano / (10 ** 9)
 
     def _on_update(self, client: Services, market_data: MarketDataResponse):
-        self._check_trade_orders(client)
-        params = TradeStrategyParams(instrument_balance=self.trade_statistics.get_positions(),
-                                     currency_balance=self.trade_statistics.get_money(),
-                                     pending_orders=self.trade_statistics.get_pending_orders())
-
-        self.logger.debug(f'Received market_data {market_data}. Running strategy with params {params}')
-        strategy_decision = self.trade_strategy.decide(market_data, params)
-        self.logger.debug(f'Strategy decision: {strategy_decision}')
-
-        if len(strategy_decision.cancel_orders) > 0:
-            self._cancel_orders(client=client, orders=strategy_decision.cancel_orders)
-
-        trade_order = strategy_decision.robot_trade_order
-        if trade_order and self._validate_strategy_order(order=trade_order, candle=market_data.candle):
-            self._post_trade_order(client=client, trade_order=trade_order)
-
-    def _validate_strategy_order(self, order: RobotTradeOrder, candle: Candle):
-        if order.direction == OrderDirection.ORDER_DIRECTION_BUY:
-            price = order.price or Money(candle.close)
-            total_cost = price * self.instrument_info.lot * order.quantity
-            balance = self.trade_statistics.get_money()
-            if total_cost.to_float() > self.trade_statistics.get_money():
-                self.logger.warning(f'Strategy decision cannot be executed. '
-                                    f'Requested buy cost: {total_cost}, balance: {balance}')
-                return False
-        else:
-            instrument_balance = self.trade_statistics.get_positions()
-            if order.quantity > instrument_balance:
-                self.logger.warning(f'Strategy decision cannot be executed. '
-                                    f'Requested sell quantity: {order.quantity}, balance: {instrument_balance}')
-                return False
+        metrics = self.metrics
+        with metrics.on_update.time(), self._orders_lock:
+            metrics.updates.inc()
+            if self._orders_check_due():
+                with metrics.check_orders.time():
+                    self._check_trade_orders(client)
+            params = TradeStrategyParams(instrument_balance=self.trade_statistics.get_positions(),
+                                         currency_balance=self.trade_statistics.get_money(),
+                                         pending_orders=self.trade_statistics.get_pending_orders())
+
+            debug = self.logger.isEnabledFor(logging.DEBUG)  # messages are formatted only if logged, replays are fast
+            if debug:
+                self.logger.debug(f'Received market_data {market_data}. Running strategy with params {params}')
+            with metrics.decide.time():
+                self._apply_market_data(market_data)
+                strategy_decision = self.trade_strategy.decide(market_data, params)
+            if debug:
+                self.logger.debug(f'Strategy decision: {strategy_decision}')
+
+            if len(strategy_decision.cancel_orders) > 0:
+                with metrics.cancel_orders.time():
+                    self._cancel_orders(client=client, orders=strategy_decision.cancel_orders)
+
+            trade_order = strategy_decision.robot_trade_order
+            if trade_order and self._check_risk(trade_order):
+                with metrics.post_order.time():
+                    self._post_trade_order(client=client, trade_order=trade_order,
+                                           tick_time=self._tick_time(market_data))
+
+    def _orders_check_due(self) -> bool:
+        # order books and trades come many times a second, polling on each of them would exceed the API limits
+        now = self.clock.monotonic_ns()
+        interval = self.ORDERS_RECONCILIATION_INTERVAL if self._order_trades_streaming else self.ORDERS_POLL_INTERVAL
+        if now - self._last_orders_check < interval * 10 ** 9:
+            return False
+        self._last_orders_check = now
         return True
 
+    def _market_price(self, direction: OrderDirection) -> int | None:
+        # market orders are filled from the opposite side of the book, without the book at the last price
+        if self.order_book is not None:
+            best = self.order_book.best_ask if direction == OrderDirection.ORDER_DIRECTION_BUY \
+                else self.order_book.best_bid
+            if best is not None:
+                return best
+        return self._last_price
+
+    def _check_risk(self, order: RobotTradeOrder, reserved_lots: int = 0, reserved_money: int = 0) -> bool:
+        price = order.price.nanos if order.price is not None else self._market_price(order.direction)
+        if self.risk.check(order, price, self.clock.monotonic_ns(), reserved_lots, reserved_money):
+            return True
+        self.metrics.orders_rejected.inc()
+        self.trade_strategy.on_order_posted(order, None)
+        return False
+
     def _load_historic_data(self, from_time: datetime.datetime, to_time: datetime.datetime = None):
-        try:
-            with Client(self.token, app_name=self.APP_NAME) as client:
-                yield from client.get_all_candles(
-                    from_=from_time,
-                    to=to_time,
-                    interval=CandleInterval.CANDLE_INTERVAL_1_MIN,
-                    figi=self.instrument_info.figi,
-                )
-        except InvestError as error:
-            self.logger.error(f'Failed to load historical data. Error: {error}')
+        yield from self._load_historic_arrays(from_time, to_time).candles()
+
+    def _load_historic_arrays(self, from_time: datetime.datetime, to_time: datetime.datetime = None) -> CandleArrays:
+        return self.downloader.download(self.instrument_info.figi, CandleInterval.CANDLE_INTERVAL_1_MIN,
+                                        from_time, to_time)
 
     def _cancel_orders(self, client: Services, orders: list[OrderState]):
         for order in orders:
             try:
-                client.orders.cancel_order(account_id=self.account_id, order_id=order.order_id)
+                if self.sandbox_mode:
+                    client.sandbox.cancel_sandbox_order(account_id=self.account_id, order_id=order.order_id)
+                else:
+                    client.orders.cancel_order(account_id=self.account_id, order_id=order.order_id)
                 self.trade_statistics.cancel_order(order_id=order.order_id)
             except InvestError as error:
                 self.logger.error(f'Failed to cancel order {order.order_id}. Error: {error}')
 
-    def _post_trade_order(self, client: Services, trade_order: RobotTradeOrder) -> PostOrderResponse | None:
+    def _post_trade_order(self, client: Services, trade_order: RobotTradeOrder,
+                          tick_time: datetime.datetime = None) -> PostOrderResponse | None:
         try:
             if self.sandbox_mode:
-                order = client.sandbox.post_sandbox_order(
-                    figi=self.instrument_info.figi,
-                    quantity=trade_order.quantity,
-                    price=trade_order.price.to_quotation() if trade_order.price is not None else None,
-                    direction=trade_order.direction,
-                    account_id=self.account_id,
-                    order_type=trade_order.order_type,
-                    order_id=str(uuid.uuid4())
-                )
+                order = client.sandbox.post_sandbox_order(**self._order_request(trade_order))
             else:
-                order = client.orders.post_order(
-                    figi=self.instrument_info.figi,
-                    quantity=trade_order.quantity,
-                    price=trade_order.price.to_quotation() if trade_order.price is not None else None,
-                    direction=trade_order.direction,
-                    account_id=self.account_id,
-                    order_type=trade_order.order_type,
-                    order_id=str(uuid.uuid4())
-                )
+                order = client.orders.post_order(**self._order_request(trade_order))
         except InvestError as error:
             self.logger.error(f'Posting trade order failed :(. Order: {trade_order}; Exception: {error}')
+            self.metrics.orders_failed.inc()
+            self.trade_strategy.on_order_posted(trade_order, None)
             return
+        self._on_order_posted(trade_order, order, tick_time)
+        return order
+
+    def _order_request(self, trade_order: RobotTradeOrder) -> dict[str, any]:
+        return {
+            'figi': self.instrument_info.figi,
+            'quantity': trade_order.quantity,
+            'price': trade_order.price.to_quotation() if trade_order.price is not None else None,
+            'direction': trade_order.direction,
+            'account_id': self.account_id,
+            'order_type': trade_order.order_type,
+            'order_id': str(uuid.uuid4())
+        }
+
+    @staticmethod
+    def _tick_time(market_data: MarketDataResponse) -> datetime.datetime | None:
+        if market_data.candle:
+            # time of the last trade in the candle, the candle time is the start of its interval
+            return market_data.candle.last_trade_ts or market_data.candle.time
+        if market_data.orderbook:
+            return market_data.orderbook.time
+        if market_data.trade:
+            return market_data.trade.time
+        return None
+
+    def _on_order_posted(self, trade_order: RobotTradeOrder, order: PostOrderResponse,
+                         tick_time: datetime.datetime = None):
+        self.metrics.orders_posted.inc()
+        if tick_time is not None:
+            self.metrics.tick_to_order.observe((self.clock.time_ns() - datetime_to_nanos(tick_time)) / 10 ** 9)
         self.logger.info(f'Placed trade order {order}')
         self.orders_executed[order.order_id] = OrderExecutionInfo(direction=trade_order.direction)
         self.trade_statistics.add_trade(order)
-        return order
+        self.trade_strategy.on_order_posted(trade_order, order.order_id)
+
+    def _track_pending_orders(self) -> bool:
+        """
+        Polls the orders left pending by a previous run, e.g. ones restored from the journal, until they finish.
+        Returns True if there are any.
+        """
+        for order in self.trade_statistics.get_pending_orders():
+            self.orders_executed.setdefault(order.order_id, OrderExecutionInfo(direction=order.direction))
+        return len(self.orders_executed) > 0
 
     def _check_trade_orders(self, client: Services):
         self.logger.debug(f'Updating trade orders info. Current trade orders num: {len(self.orders_executed)}')
-        orders_executed = list(self.orders_executed.items())
-        for order_id, execution_info in orders_executed:
+        for order_id in list(self.orders_executed):
             if self.sandbox_mode:
                 order_state = client.sandbox.get_sandbox_order_state(
                     account_id=self.account_id, order_id=order_id
@@ -237,24 +456,52 @@ class TradingRobot:  # pylint:disable=too-many-instance-attributes
                 order_state = client.orders.get_order_state(
                     account_id=self.account_id, order_id=order_id
                 )
-
-            self.trade_statistics.add_trade(trade=order_state)
-            match order_state.execution_report_status:
-                case OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL:
-                    self.logger.info(f'Trade order {order_id} has been FULLY FILLED')
-                    self.orders_executed.pop(order_id)
-                case OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_REJECTED:
-                    self.logger.warning(f'Trade order {order_id} has been REJECTED')
-                    self.orders_executed.pop(order_id)
-                case OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_CANCELLED:
-                    self.logger.warning(f'Trade order {order_id} has been CANCELLED')
-                    self.orders_executed.pop(order_id)
-                case OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL:
-                    self.logger.info(f'Trade order {order_id} has been PARTIALLY FILLED')
-                    self.orders_executed[order_id] = OrderExecutionInfo(lots=order_state.lots_executed,
-                                                                        amount=order_state.total_order_amount,
-                                                                        direction=order_state.direction)
-                case _:
-                    self.logger.debug(f'No updates on order {order_id}')
+            self._update_order_state(order_id, order_state)
 
         self.logger.debug(f'Successfully updated trade orders. New trade orders num: {len(self.orders_executed)}')
+
+    def _update_order_state(self, order_id: str, order_state: OrderState):
+        self.trade_statistics.add_trade(trade=order_state)
+        match order_state.execution_report_status:
+            case OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL:
+                self.logger.info(f'Trade order {order_id} has been FULLY FILLED')
+                self.orders_executed.pop(order_id, None)
+            case OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_REJECTED:
+                self.logger.warning(f'Trade order {order_id} has been REJECTED')
+                self.orders_executed.pop(order_id, None)
+            case OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_CANCELLED:
+                self.logger.warning(f'Trade order {order_id} has been CANCELLED')
+                self.orders_executed.pop(order_id, None)
+            case OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL:
+                self.logger.info(f'Trade order {order_id} has been PARTIALLY FILLED')
+                # streamed trades are kept apart from the polled state, which may already include them
+                self.orders_executed.setdefault(order_id, OrderExecutionInfo(direction=order_state.direction))
+            case _:
+                self.logger.debug(f'No updates on order {order_id}')
+
+    def _on_order_trades(self, order_trades: OrderTrades):
+        with self._orders_lock:
+            execution_info = self.orders_executed.get(order_trades.order_id)
+            order_state = self.trade_statistics.get_trade(order_trades.order_id)
+            if execution_info is None or order_state is None:
+                return
+
+            # the stream may deliver a trade again after reconnecting
+            trades = [trade for trade in order_trades.trades if trade.trade_id not in execution_info.trade_ids]
+            execution_info.trade_ids.update(trade.trade_id for trade in trades)
+            # trade quantities are in instrument units, not lots
+            execution_info.lots += sum(trade.quantity for trade in trades) // self.instrument_info.lot
+            execution_info.amount += sum(quotation_to_nanos(trade.price) * trade.quantity for trade in trades)
+            if execution_info.lots <= order_state.lots_executed:  # already known from the order state
+                return
+
+            self.logger.debug(f'Received trades for order {order_trades.order_id}: {order_trades.trades}')
+            self._update_order_state(order_trades.order_id, dataclasses.replace(
+                order_state,
+                lots_executed=execution_info.lots,
+                total_order_amount=Money.from_nanos(execution_info.amount).to_money_value(
+                    order_state.total_order_amount.currency),
+                execution_report_status=OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL
+                if execution_info.lots >= order_state.lots_requested
+                else OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL
+            ))
@@ -0,0 +1,149 @@
+from __future__ import annotations
+
+import datetime
+import itertools
+import logging
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from tinkoff.invest import Instrument
+
+from helpers.candles import CandleArrays, nanos_to_datetime
+from lib.backtester import Backtester
+from lib.batch_backtest import run_batch_backtest
+from lib.risk import RiskLimits
+from lib.shared_candles import attach_candles, share_candles, shared_candles
+from lib.trading_robot import TradingRobot
+from stats.analyzer import BalanceCalculator, BalanceProcessor, TradeStatisticsAnalyzer
+from strategy.base_strategy import TradeStrategyBase, TradeStrategyParams
+
+
+@dataclass
+class WalkForwardWindow:
+    # indices of candles: train on [train_start, test_start), test on [test_start, test_end)
+    train_start: int
+    test_start: int
+    test_end: int
+
+
+def walk_forward_windows(times: np.ndarray, train_duration: datetime.timedelta,  # pylint:disable=too-many-arguments
+                         test_duration: datetime.timedelta, step: datetime.timedelta = None,
+                         anchored: bool = False) -> list[WalkForwardWindow]:
+    """
+    Splits sorted candle times into train/test windows. Test periods start train_duration after the first
+    candle and move by step, test_duration by default. Rolling windows train on the train_duration before
+    the test period, anchored ones on everything from the first candle.
+    """
+    if len(times) == 0:
+        return []
+    train, test, step = (duration // datetime.timedelta(microseconds=1) * 1000
+                         for duration in (train_duration, test_duration, step or test_duration))
+    if test <= 0 or step <= 0:
+        raise ValueError('Test duration and step must be positive')
+
+    windows = []
+    for test_start_time in range(int(times[0]) + train, int(times[-1]) + 1, step):
+        train_start, test_start, test_end = np.searchsorted(
+            times, [times[0] if anchored else test_start_time - train, test_start_time, test_start_time + test])
+        if test_start < test_end:
+            windows.append(WalkForwardWindow(int(train_start), int(test_start), int(test_end)))
+    return windows
+
+
+def _run_window(trade_strategy: TradeStrategyBase, window: WalkForwardWindow,  # pylint:disable=too-many-arguments
+                initial_params: TradeStrategyParams, instrument_info: Instrument, logger: logging.Logger,
+                batch: bool, risk_limits: RiskLimits) -> TradeStatisticsAnalyzer:
+    # trade_strategy is a copy made by pickling, so every window starts from a fresh strategy
+    candles = shared_candles()
+    initial_params = TradeStrategyParams(instrument_balance=initial_params.instrument_balance,
+                                         currency_balance=initial_params.currency_balance, pending_orders=[])
+    if batch:
+        return run_batch_backtest(trade_strategy=trade_strategy,
+                                  candles=candles[window.train_start:window.test_end],
+                                  start=window.test_start - window.train_start, initial_params=initial_params,
+                                  instrument_info=instrument_info, logger=logger)
+    trade_strategy.load_instrument_info(instrument_info)
+    trade_strategy.load_candles(list(candles[window.train_start:window.test_start].candles()))
+    backtester = Backtester(trade_strategy=trade_strategy, instrument_info=instrument_info, logger=logger,
+                            risk_limits=risk_limits)
+    return backtester.run(candles[window.test_start:window.test_end].candles(), initial_params)
+
+
+class WalkForward:  # pylint:disable=too-many-instance-attributes
+    """
+    Walk-forward backtest of the robot strategy: loads history on every train period and trades the following
+    test period. Windows run in parallel worker processes sharing the candles through shared memory,
+    every window starts with the initial balances.
+    """
+    robot: TradingRobot
+    train_duration: datetime.timedelta
+    test_duration: datetime.timedelta
+    step: datetime.timedelta | None
+    anchored: bool
+    batch: bool  # use decide_batch instead of the per-candle loop, risk limits are not applied then
+    processes: int
+
+    def __init__(self, robot: TradingRobot, train_duration: datetime.timedelta,  # pylint:disable=too-many-arguments
+                 test_duration: datetime.timedelta, step: datetime.timedelta = None, anchored: bool = False,
+                 batch: bool = False, processes: int = None):
+        self.robot = robot
+        self.train_duration = train_duration
+        self.test_duration = test_duration
+        self.step = step
+        self.anchored = anchored
+        self.batch = batch
+        self.processes = processes or os.cpu_count()
+
+    def run(self, initial_params: TradeStrategyParams,
+            history_duration: datetime.timedelta) -> tuple[TradeStatisticsAnalyzer, pd.DataFrame]:
+        candles, _ = self.robot.load_backtest_candles(history_duration)
+        return self.run_on_candles(candles, initial_params)
+
+    def run_on_candles(self, candles: CandleArrays,
+                       initial_params: TradeStrategyParams) -> tuple[TradeStatisticsAnalyzer, pd.DataFrame]:
+        """
+        Returns trades of all windows merged in the order of windows and a report with a row per window
+        """
+        windows = walk_forward_windows(candles.time, self.train_duration, self.test_duration, self.step,
+                                       self.anchored)
+        if len(windows) == 0:
+            raise ValueError('History is too short for a single walk-forward window')
+        self.robot.logger.info(f'Running walk-forward backtest of {len(windows)} windows on {len(candles)} candles '
+                               f'with {self.processes} processes')
+        shared_memory = share_candles(candles)
+        try:
+            with ProcessPoolExecutor(max_workers=min(self.processes, len(windows)), initializer=attach_candles,
+                                     initargs=(shared_memory.name, len(candles))) as executor:
+                results = list(executor.map(
+                    _run_window,
+                    itertools.repeat(self.robot.trade_strategy),
+                    windows,
+                    itertools.repeat(initial_params),
+                    itertools.repeat(self.robot.instrument_info),
+                    itertools.repeat(self.robot.logger),
+                    itertools.repeat(self.batch),
+                    itertools.repeat(self.robot.risk.limits)
+                ))
+        finally:
+            shared_memory.close()
+            shared_memory.unlink()
+
+        rows = []
+        for window, trade_statistics in zip(windows, results):
+            row = {
+                'train_start': nanos_to_datetime(int(candles.time[window.train_start])),
+                'test_start': nanos_to_datetime(int(candles.time[window.test_start])),
+                'test_end': nanos_to_datetime(int(candles.time[window.test_end - 1])),
+                'events': len(trade_statistics.ledger),
+            }
+            if len(trade_statistics.ledger) > 0:
+                stats, _ = trade_statistics.get_report(processors=[BalanceProcessor()],
+                                                       calculators=[BalanceCalculator()])
+                row |= stats
+            rows.append(row)
+        return TradeStatisticsAnalyzer.merge(results), pd.DataFrame(rows)
@@ -1,29 +1,39 @@
 import datetime
+import os
 
 from lib.robot_factory import TradingRobotFactory
 from strategy.base_strategy import TradeStrategyParams
 from strategy.mae_strategy import MAEStrategy
+from stats.metrics import REGISTRY
 from stats.visualization import Visualizer
 
-token = "t.79UrkCV6A20DjSJ40yep3S_BTgbmmuXrPJoiH4udJ1UdMORlCVi6GxzvdDHtGVsSaMLQiblyqXaYOat6bYkzCA"
-account_id = "2063742726"
+token = os.environ.get('INVEST_TOKEN')
+account_id = os.environ.get('INVEST_ACCOUNT_ID')
+target = os.environ.get('INVEST_TARGET')  # e.g. localhost:50051 for benchmarks.invest_stub_server
+metrics_port = os.environ.get('INVEST_METRICS_PORT')  # Prometheus endpoint with robot stage timings
 
 
 def backtest(robot):
     stats = robot.backtest(
         TradeStrategyParams(instrument_balance=0, currency_balance=15000, pending_orders=[]),
         train_duration=datetime.timedelta(days=5), test_duration=datetime.timedelta(days=30))
-    stats.save_to_file('backtest_stats.pickle')
+    stats.save_to_file('backtest_stats.journal')
 
 
 def trade(robot):
+    if metrics_port:
+        REGISTRY.serve(int(metrics_port))
+    robot.trade_statistics.open_journal('stats.journal')
     stats = robot.trade()
-    stats.save_to_file('stats.pickle')
+    stats.close_journal()
+    REGISTRY.dump('metrics.prom')
 
 
 def main():
+    if not token or not account_id:
+        raise ValueError('INVEST_TOKEN and INVEST_ACCOUNT_ID environment variables must be set')
     robot_factory = TradingRobotFactory(token=token, account_id=account_id, ticker='YNDX', class_code='TQBR',
-                                        logger_level='INFO')
+                                        logger_level='INFO', target=target)
     robot_factory.get_account_info()
     robot = robot_factory.create_robot(MAEStrategy(visualizer=Visualizer('YNDX', 'RUB')), sandbox_mode=True)
 
@@ -2,18 +2,22 @@ from __future__ import annotations
 
 import datetime
 import logging
-import pickle
+import os
 import uuid
 
 from abc import ABC, abstractmethod
-from dataclasses import asdict
 
+import numpy as np
 import pandas as pd
 
 from tinkoff.invest import OrderState, Instrument, OrderDirection, Quotation, MoneyValue, OrderExecutionReportStatus, \
-    OrderType
+    PostOrderResponse
 
+from helpers.candles import datetime_to_nanos
+from helpers.clock import SYSTEM_CLOCK, Clock
 from helpers.money import Money
+from stats.journal import TradeJournal
+from stats.ledger import TradeLedger
 
 class TradeStatisticsAnalyzer:
     PENDING_ORDER_STATUSES = [
@@ -21,39 +25,92 @@ class TradeStatisticsAnalyzer:
             OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL
         ]
 
-    trades: dict[str, OrderState]
+    ledger: TradeLedger
+    pending_orders: dict[str, OrderState]  # last known state of orders waiting for execution
     positions: int
-    money: float
+    money_nanos: int
     instrument_info: Instrument
     logger: logging.Logger
+    sub_analyzers: dict[str, TradeStatisticsAnalyzer]  # virtual ledgers of ensemble members by name
+    clock: Clock  # stamps trades reported without time
 
     def __init__(self, positions: int, money: float, instrument_info: Instrument, logger: logging.Logger):
-        self.trades = {}
+        self.ledger = TradeLedger()
+        self.pending_orders = {}
         self.positions = positions
-        self.money = money
+        self.money_nanos = Money(money).nanos
         self.instrument_info = instrument_info
         self.logger = logger
-
-    def add_trade(self, trade: OrderState) -> None:
-        self.logger.debug(f'Updating balance. Current state: [positions={self.positions} money={self.money}]. '
-                          f'trade: {trade}')
-
-        if trade.order_id in self.trades:
-            trade.direction = self.trades[trade.order_id].direction
-            sign = 1 if trade.direction == OrderDirection.ORDER_DIRECTION_BUY else -1
-            self.positions += (trade.lots_executed - self.trades[trade.order_id].lots_executed) * sign
-            self.money -= (self.convert_from_quotation(trade.total_order_amount)
-                           - self.convert_from_quotation(self.trades[trade.order_id].total_order_amount)) * sign
+        self.sub_analyzers = {}
+        self.clock = SYSTEM_CLOCK
+
+    @property
+    def money(self) -> float:
+        return float(Money.from_nanos(self.money_nanos))
+
+    def add_sub_analyzer(self, name: str, positions: int, money: float) -> TradeStatisticsAnalyzer:
+        """
+        Virtual ledger of a part of the balances, trades booked there don't change this analyzer.
+        Returns the existing one if the name is taken.
+        """
+        if name not in self.sub_analyzers:
+            self.sub_analyzers[name] = TradeStatisticsAnalyzer(positions=positions, money=money,
+                                                               instrument_info=self.instrument_info,
+                                                               logger=self.logger.getChild(name))
+            self.sub_analyzers[name].clock = self.clock
+        return self.sub_analyzers[name]
+
+    def add_trade(self, trade: OrderState | PostOrderResponse) -> None:
+        debug = self.logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            self.logger.debug(f'Updating balance. Current state: [positions={self.positions} money={self.money}]. '
+                              f'trade: {trade}')
+
+        pending_order = self.pending_orders.get(trade.order_id)
+        if pending_order is not None:
+            trade.direction = pending_order.direction
+        price = getattr(trade, 'average_position_price', None) or trade.executed_order_price
+        self._record(
+            order_id=trade.order_id,
+            time=self.clock.time_ns(),
+            direction=trade.direction,
+            status=trade.execution_report_status,
+            lots_executed=trade.lots_executed,
+            total_order_amount=Money(trade.total_order_amount).nanos if trade.total_order_amount else 0,
+            price=Money(price).nanos if price else 0
+        )
+
+        if trade.execution_report_status in self.PENDING_ORDER_STATUSES:
+            self.pending_orders[trade.order_id] = trade
         else:
-            sign = 1 if trade.direction == OrderDirection.ORDER_DIRECTION_BUY else -1
-            self.positions += trade.lots_executed * sign
-            self.money -= self.convert_from_quotation(trade.total_order_amount) * sign
+            self.pending_orders.pop(trade.order_id, None)
+        if debug:
+            self.logger.debug(f'Updating balance. New state: [positions={self.positions} money={self.money}]')
 
-        self.trades[trade.order_id] = trade
-        self.logger.debug(f'Updating balance. New state: [positions={self.positions} money={self.money}]')
+    def _record(self, **event) -> None:
+        positions, money_nanos = self.ledger.record(**event)
+        self.positions += positions
+        self.money_nanos += money_nanos
 
     def cancel_order(self, order_id: str):
-        self.trades.pop(order_id)
+        order = self.pending_orders.pop(order_id, None)
+        if order is None:
+            return
+        self._record(
+            order_id=order_id,
+            time=self.clock.time_ns(),
+            direction=order.direction,
+            status=OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_CANCELLED,
+            lots_executed=order.lots_executed,
+            total_order_amount=Money(order.total_order_amount).nanos if order.total_order_amount else 0,
+            price=0
+        )
+
+    def get_trade(self, order_id: str) -> OrderState | None:
+        """
+        Last known state of a pending order, states of finished orders are kept in the ledger only
+        """
+        return self.pending_orders.get(order_id)
 
     def get_positions(self) -> int:
         return self.positions
@@ -62,16 +119,80 @@ class TradeStatisticsAnalyzer:
         return self.money
 
     def get_pending_orders(self) -> list[OrderState]:
-        return [trade for trade in self.trades.values() if trade.execution_report_status in self.PENDING_ORDER_STATUSES]
+        return list(self.pending_orders.values())
+
+    def open_journal(self, filename: str, fsync: bool = False) -> None:
+        """
+        Writes every following trade to the journal as soon as it is added.
+        An existing journal of the instrument is continued: its trades are loaded first, so the analyzer must be empty.
+        Orders left pending in it become pending again with the lots and amount executed so far, their other
+        fields aren't journaled, so they should be polled for the current states.
+        Trades already added to the analyzer are written to a new journal.
+        """
+        self.close_journal()
+        resume = os.path.exists(filename) and os.path.getsize(filename) > 0
+        if resume:
+            if len(self.ledger) > 0:
+                raise ValueError(f'Cannot continue journal {filename}, the analyzer already has trades')
+            _, records = TradeJournal.read(filename)
+            self.ledger = TradeLedger.from_records(records)
+            self.pending_orders = self._journaled_pending_orders()
+
+        journal = TradeJournal(filename, figi=self.instrument_info.figi,
+                               positions=self.positions - self.ledger.instrument_balance,
+                               money=self.money_nanos - self.ledger.balance, fsync=fsync)
+        if not resume and len(self.ledger) > 0:
+            journal.write(self.ledger.to_records())
+        self.ledger.journal = journal
+
+    def _journaled_pending_orders(self) -> dict[str, OrderState]:
+        orders = self.ledger.orders
+        pending = np.flatnonzero(np.isin(orders['execution_report_status'], self.PENDING_ORDER_STATUSES))
+        currency = self.instrument_info.currency
+        return {
+            self.ledger.order_ids[order]: OrderState(
+                order_id=self.ledger.order_ids[order],
+                execution_report_status=OrderExecutionReportStatus(int(orders['execution_report_status'][order])),
+                lots_executed=int(orders['lots_executed'][order]),
+                total_order_amount=Money.from_nanos(int(orders['total_order_amount'][order])).to_money_value(currency),
+                direction=OrderDirection(int(orders['direction'][order])),
+                figi=self.instrument_info.figi)
+            for order in pending.tolist()
+        }
+
+    def close_journal(self) -> None:
+        if self.ledger.journal:
+            self.ledger.journal.close()
+            self.ledger.journal = None
 
     def save_to_file(self, filename: str) -> None:
-        with open(filename, 'wb') as file:
-            pickle.dump(obj=self, file=file, protocol=pickle.HIGHEST_PROTOCOL)
+        """
+        Writes all trades to a new journal
+        """
+        if os.path.exists(filename):
+            os.remove(filename)
+        journal = TradeJournal(filename, figi=self.instrument_info.figi,
+                               positions=self.positions - self.ledger.instrument_balance,
+                               money=self.money_nanos - self.ledger.balance)
+        journal.write(self.ledger.to_records())
+        journal.close()
 
     @staticmethod
-    def load_from_file(filename: str) -> TradeStatisticsAnalyzer:
-        with open(filename, 'rb') as file:
-            return pickle.load(file)
+    def load_from_file(filename: str, instrument_info: Instrument, logger: logging.Logger,
+                       start: datetime.datetime = None, end: datetime.datetime = None) -> TradeStatisticsAnalyzer:
+        """
+        Loads trades from the journal, optionally only those in [start, end).
+        Balances are the ones after the last loaded trade.
+        """
+        header, records = TradeJournal.read(filename, start=start, end=end)
+        trade_statistics = TradeStatisticsAnalyzer(positions=int(header['positions']), money=0,
+                                                   instrument_info=instrument_info, logger=logger)
+        trade_statistics.ledger = TradeLedger.from_records(records)
+        trade_statistics.money_nanos = int(header['money'])
+        if len(records) > 0:
+            trade_statistics.positions += int(records['instrument_balance'][-1])
+            trade_statistics.money_nanos += int(records['balance'][-1])
+        return trade_statistics
 
     @staticmethod
     def convert_from_quotation(amount: Quotation | MoneyValue) -> float | None:
@@ -79,39 +200,61 @@ class TradeStatisticsAnalyzer:
             return None
         return amount.units + amount.nano / (10 ** 9)
 
-    def add_backtest_trade(self, quantity: int, price: Quotation, direction: OrderDirection):
+    def add_backtest_trade(self, quantity: int, price: Quotation, direction: OrderDirection,
+                           trade_time: datetime.datetime = None):
         if quantity == 0:
             return
-        price_money = MoneyValue('RUB', price.units, price.nano)
-        zero_money = MoneyValue('RUB', 0, 0)
-        self.add_trade(OrderState(
+        price = Money(price).nanos
+        self._record(
             order_id=str(uuid.uuid4()),
-            execution_report_status=OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL,
-            lots_requested=quantity,
-            lots_executed=quantity,
-            initial_order_price=price_money,
-            executed_order_price=price_money,
-            total_order_amount=(Money(price) * quantity).to_money_value('RUB'),
-            average_position_price=price_money,
-            initial_commission=zero_money,
-            executed_commission=zero_money,
-            figi=self.instrument_info.figi,
+            time=datetime_to_nanos(trade_time) if trade_time else self.clock.time_ns(),
             direction=direction,
-            initial_security_price=price_money,
-            stages=[],
-            service_commission=zero_money,
-            currency=price_money.currency,
-            order_type=OrderType.ORDER_TYPE_MARKET,
-            order_date=datetime.datetime.now()
-        ))
+            status=OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL,
+            lots_executed=quantity,
+            total_order_amount=price * quantity * self.instrument_info.lot,
+            price=price
+        )
+
+    def add_backtest_trades(self, quantities: np.ndarray, prices: np.ndarray, times: np.ndarray) -> None:
+        """
+        Adds filled market orders at once. quantities are signed lots, positive for buys,
+        prices are in billionths and times are in nanoseconds since epoch.
+        """
+        executed = np.flatnonzero(quantities)
+        quantities = np.asarray(quantities, dtype=np.int64)[executed]
+        prices = np.asarray(prices, dtype=np.int64)[executed]
+        self.ledger.record_fills(
+            order_ids=[str(uuid.uuid4()) for _ in range(len(executed))],
+            time=np.asarray(times, dtype=np.int64)[executed],
+            direction=np.where(quantities > 0, OrderDirection.ORDER_DIRECTION_BUY, OrderDirection.ORDER_DIRECTION_SELL),
+            status=OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL,
+            lots=np.abs(quantities),
+            amount=np.abs(quantities) * prices * self.instrument_info.lot,
+            price=prices
+        )
+        self.positions += int(quantities.sum())
+        self.money_nanos -= int((quantities * prices).sum()) * self.instrument_info.lot
+
+    @classmethod
+    def merge(cls, analyzers: list[TradeStatisticsAnalyzer]) -> TradeStatisticsAnalyzer:
+        """
+        Trades of the analyzers one after another, as if they were made from one account
+        starting with the balances of the first analyzer
+        """
+        first = analyzers[0]
+        merged = cls(positions=first.positions - first.ledger.instrument_balance, money=0.0,
+                     instrument_info=first.instrument_info, logger=first.logger)
+        merged.ledger = TradeLedger.concatenate([analyzer.ledger for analyzer in analyzers])
+        merged.positions += merged.ledger.instrument_balance
+        merged.money_nanos = first.money_nanos - first.ledger.balance + merged.ledger.balance
+        for analyzer in analyzers:
+            merged.pending_orders |= analyzer.pending_orders
+        return merged
 
     def get_report(self, processors: list[TradeStatisticsProcessorBase] = None,
                    calculators: list[TradeStatisticsCalculatorBase] = None)\
             -> tuple[dict[str, any], pd.DataFrame]:
-        df = pd.DataFrame(map(asdict, self.trades.values()))  # pylint:disable=invalid-name
-        df['average_position_price'] = df['average_position_price'].apply(lambda x: x['units'] + x['nano'] / (10 ** 9))
-        df['total_order_amount'] = df['total_order_amount'].apply(lambda x: x['units'] + x['nano'] / (10 ** 9))
-        df['sign'] = 3 - df['direction'] * 2
+        df = self.ledger.to_frame()  # pylint:disable=invalid-name
 
         for processor in processors or []:
             df = processor.process(df)  # pylint:disable=invalid-name
@@ -137,6 +280,8 @@ class TradeStatisticsCalculatorBase(ABC):  # pylint:disable=too-few-public-metho
 
 class BalanceProcessor(TradeStatisticsProcessorBase):  # pylint:disable=too-few-public-methods
     def process(self, df: pd.DataFrame) -> pd.DataFrame:
+        if 'balance' in df and 'instrument_balance' in df:  # maintained by TradeLedger as trades arrive
+            return df
         df['balance'] = -(df['total_order_amount'] * df['sign']).cumsum()
         df['instrument_balance'] = (df['lots_executed'] * df['sign']).cumsum()
         return df
@@ -146,7 +291,8 @@ class BalanceCalculator(TradeStatisticsCalculatorBase):  # pylint:disable=too-fe
     def calculate(self, df: pd.DataFrame) -> dict[str, any]:
         final_balance = df['balance'][len(df) - 1]
         final_instrument_balance = df['instrument_balance'][len(df) - 1]
-        final_price = df['average_position_price'][len(df) - 1]
+        executed = df['average_position_price'][df['lots_executed'] > 0]
+        final_price = executed.iloc[-1] if len(executed) else 0
         return {
             'final_balance': final_balance,
             'max_loss': -df['balance'].min(),
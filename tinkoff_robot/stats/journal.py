@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import bisect
+import datetime
+import os
+
+import numpy as np
+
+from helpers.candles import datetime_to_nanos
+
+
+class TradeJournal:
+    """
+    Append-only binary journal of trade ledger events. The file is a fixed-size header followed by
+    fixed-size little-endian records, every record is flushed as soon as it is written.
+    A record torn by a crash is ignored on loading and cut off when the journal is reopened for writing.
+    """
+    MAGIC: bytes = b'TRJL'
+    VERSION: int = 1
+
+    HEADER_DTYPE = np.dtype([
+        ('magic', 'S4'),
+        ('version', '<u2'),
+        ('record_size', '<u2'),
+        ('positions', '<i8'),  # balances before the first record
+        ('money', '<i8'),  # billionths
+        ('figi', 'S24'),
+        ('reserved', 'V16'),
+    ])
+    RECORD_DTYPE = np.dtype([
+        ('order_id', 'S36'),
+        ('time', '<i8'),  # nanoseconds since epoch
+        ('direction', 'i1'),
+        ('execution_report_status', 'i1'),
+        ('lots_executed', '<i8'),
+        ('total_order_amount', '<i8'),  # billionths
+        ('average_position_price', '<i8'),  # billionths
+        ('instrument_balance', '<i8'),
+        ('balance', '<i8'),  # billionths
+    ])
+
+    filename: str
+    fsync: bool
+
+    def __init__(self, filename: str, figi: str, positions: int, money: int, fsync: bool = False):
+        """
+        Creates the journal or reopens an existing one of the same instrument to append to it
+        """
+        self.filename = filename
+        self.fsync = fsync
+        if os.path.exists(filename) and os.path.getsize(filename) > 0:
+            header = self.read_header(filename)
+            if header['figi'].decode() != figi:
+                raise ValueError(f'Journal {filename} belongs to {header["figi"].decode()}, not to {figi}')
+            self._file = open(filename, 'r+b')  # pylint:disable=consider-using-with
+            self._file.truncate(self.HEADER_DTYPE.itemsize + self._records_num(filename) * self.RECORD_DTYPE.itemsize)
+            self._file.seek(0, os.SEEK_END)
+        else:
+            self._file = open(filename, 'wb')  # pylint:disable=consider-using-with
+            header = np.zeros(1, dtype=self.HEADER_DTYPE)
+            header[0] = (self.MAGIC, self.VERSION, self.RECORD_DTYPE.itemsize, positions, money, figi.encode(), b'')
+            self._write(header)
+
+    def write(self, records: np.ndarray) -> None:
+        assert records.dtype == self.RECORD_DTYPE, 'records must have TradeJournal.RECORD_DTYPE'
+        self._write(records)
+
+    def close(self) -> None:
+        self._file.close()
+
+    def _write(self, data: np.ndarray) -> None:
+        self._file.write(data.tobytes())
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    @classmethod
+    def read_header(cls, filename: str) -> np.void:
+        header = np.fromfile(filename, dtype=cls.HEADER_DTYPE, count=1)
+        if len(header) == 0 or header[0]['magic'] != cls.MAGIC:
+            raise ValueError(f'{filename} is not a trade journal')
+        if header[0]['version'] > cls.VERSION:
+            raise ValueError(f'Journal version {header[0]["version"]} is not supported, '
+                             f'latest supported is {cls.VERSION}')
+        if header[0]['record_size'] != cls.RECORD_DTYPE.itemsize:
+            raise ValueError(f'Unexpected journal record size {header[0]["record_size"]}')
+        return header[0]
+
+    @classmethod
+    def read(cls, filename: str, start: datetime.datetime = None,
+             end: datetime.datetime = None) -> tuple[np.void, np.ndarray]:
+        """
+        Returns the header and memory-mapped records with time in [start, end).
+        Records are written in time order, so the range is found by binary search
+        and only the pages of the selected records are read.
+        """
+        header = cls.read_header(filename)
+        records_num = cls._records_num(filename)
+        if records_num == 0:
+            return header, np.zeros(0, dtype=cls.RECORD_DTYPE)
+
+        records = np.memmap(filename, dtype=cls.RECORD_DTYPE, mode='r', offset=cls.HEADER_DTYPE.itemsize,
+                            shape=(records_num,))
+        # bisect reads single elements, np.searchsorted would copy the whole strided column
+        times = records['time']
+        first = 0 if start is None else bisect.bisect_left(times, datetime_to_nanos(start))
+        last = records_num if end is None else bisect.bisect_left(times, datetime_to_nanos(end))
+        return header, records[first:last]
+
+    @classmethod
+    def _records_num(cls, filename: str) -> int:
+        return max(0, os.path.getsize(filename) - cls.HEADER_DTYPE.itemsize) // cls.RECORD_DTYPE.itemsize
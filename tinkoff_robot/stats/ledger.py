@@ -0,0 +1,245 @@
+from __future__ import annotations
+
+import numpy as np
+import pandas as pd
+
+from tinkoff.invest import OrderDirection
+
+from helpers.money import MOD
+from stats.journal import TradeJournal
+
+
+class GrowableColumns:
+    """
+    Preallocated NumPy columns of equal length. Capacity is doubled when full, so appending a row is amortized O(1)
+    """
+    capacity: int
+    size: int
+    columns: dict[str, np.ndarray]
+
+    def __init__(self, dtypes: dict[str, np.dtype], capacity: int = 1024):
+        self.capacity = capacity
+        self.size = 0
+        self.columns = {name: np.zeros(capacity, dtype=dtype) for name, dtype in dtypes.items()}
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name][:self.size]
+
+    def append(self, **values) -> int:
+        if self.size == self.capacity:
+            self._grow(self.capacity * 2)
+        row = self.size
+        for name, value in values.items():
+            self.columns[name][row] = value
+        self.size += 1
+        return row
+
+    def extend(self, columns: dict[str, np.ndarray]) -> None:
+        length = len(next(iter(columns.values())))
+        if self.size + length > self.capacity:
+            self._grow(max(self.capacity * 2, self.size + length))
+        for name, values in columns.items():
+            self.columns[name][self.size:self.size + length] = values
+        self.size += length
+
+    def _grow(self, capacity: int) -> None:
+        for name, column in self.columns.items():
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[name] = grown
+        self.capacity = capacity
+
+
+class TradeLedger:
+    """
+    Append-only columnar log of executions. Every change of an order (placement, partial fill, fill)
+    is appended as one event holding the executed lots and amount added by it, so running balances are
+    computed once per event and never revisited.
+    Amounts and prices are stored as integer billionths.
+    Events are also written to the journal, if one is attached.
+    """
+    EVENT_COLUMNS: dict[str, np.dtype] = {
+        'order': np.int64,  # index in order_ids
+        'time': np.int64,  # nanoseconds since epoch
+        'direction': np.int8,
+        'execution_report_status': np.int8,
+        'lots_executed': np.int64,
+        'total_order_amount': np.int64,
+        'average_position_price': np.int64,
+        'instrument_balance': np.int64,
+        'balance': np.int64,
+    }
+    ORDER_COLUMNS: dict[str, np.dtype] = {
+        'direction': np.int8,
+        'execution_report_status': np.int8,
+        'lots_executed': np.int64,
+        'total_order_amount': np.int64,
+    }
+
+    events: GrowableColumns
+    orders: GrowableColumns
+    order_ids: list[str]
+    order_index: dict[str, int]  # order_id -> row in orders
+    instrument_balance: int  # running balances after the last event
+    balance: int
+    journal: TradeJournal | None
+
+    def __init__(self):
+        self.events = GrowableColumns(self.EVENT_COLUMNS)
+        self.orders = GrowableColumns(self.ORDER_COLUMNS)
+        self.order_ids = []
+        self.order_index = {}
+        self.instrument_balance = 0
+        self.balance = 0
+        self.journal = None
+
+    def __len__(self) -> int:
+        return len(self.events)
+
+    def __getstate__(self):
+        return self.__dict__ | {'journal': None}
+
+    def record(self, order_id: str, time: int, direction: int,  # pylint:disable=too-many-arguments
+               status: int, lots_executed: int, total_order_amount: int, price: int) -> tuple[int, int]:
+        """
+        Records the current state of the order.
+        lots_executed and total_order_amount are the order totals, the event keeps their change.
+        Returns the change of instrument and money balances.
+        """
+        order = self.order_index.get(order_id)
+        if order is None:
+            order = self.orders.append(direction=direction, execution_report_status=status,
+                                       lots_executed=lots_executed, total_order_amount=total_order_amount)
+            self.order_index[order_id] = order
+            self.order_ids.append(order_id)
+            lots, amount = lots_executed, total_order_amount
+        else:
+            columns = self.orders.columns
+            direction = int(columns['direction'][order])
+            lots = lots_executed - int(columns['lots_executed'][order])
+            amount = total_order_amount - int(columns['total_order_amount'][order])
+            columns['execution_report_status'][order] = status
+            columns['lots_executed'][order] = lots_executed
+            columns['total_order_amount'][order] = total_order_amount
+
+        sign = 1 if direction == OrderDirection.ORDER_DIRECTION_BUY else -1
+        self.instrument_balance += lots * sign
+        self.balance -= amount * sign
+        row = self.events.append(order=order, time=time, direction=direction, execution_report_status=status,
+                                 lots_executed=lots, total_order_amount=amount, average_position_price=price,
+                                 instrument_balance=self.instrument_balance, balance=self.balance)
+        if self.journal:
+            self.journal.write(self.to_records(row, row + 1))
+        return lots * sign, -amount * sign
+
+    def record_fills(self, order_ids: list[str], time: np.ndarray,  # pylint:disable=too-many-arguments
+                     direction: np.ndarray, status: int, lots: np.ndarray, amount: np.ndarray,
+                     price: np.ndarray) -> None:
+        """
+        Records new orders executed in full at once, running balances are computed with cumsum
+        """
+        if len(order_ids) == 0:
+            return
+        sign = np.where(direction == OrderDirection.ORDER_DIRECTION_BUY, 1, -1)
+        first = len(self.orders)
+        self.orders.extend({'direction': direction, 'execution_report_status': np.full(len(lots), status),
+                            'lots_executed': lots, 'total_order_amount': amount})
+        self.order_index.update(zip(order_ids, range(first, first + len(order_ids))))
+        self.order_ids.extend(order_ids)
+        instrument_balance = self.instrument_balance + np.cumsum(lots * sign)
+        balance = self.balance - np.cumsum(amount * sign)
+        self.instrument_balance, self.balance = int(instrument_balance[-1]), int(balance[-1])
+        row = len(self.events)
+        self.events.extend({
+            'order': np.arange(first, first + len(order_ids)),
+            'time': time,
+            'direction': direction,
+            'execution_report_status': np.full(len(lots), status),
+            'lots_executed': lots,
+            'total_order_amount': amount,
+            'average_position_price': price,
+            'instrument_balance': instrument_balance,
+            'balance': balance,
+        })
+        if self.journal:
+            self.journal.write(self.to_records(row, len(self.events)))
+
+    def to_records(self, start: int = 0, stop: int = None) -> np.ndarray:
+        """
+        Events in [start, stop) as journal records
+        """
+        stop = len(self.events) if stop is None else stop
+        records = np.zeros(stop - start, dtype=TradeJournal.RECORD_DTYPE)
+        orders = self.events['order'][start:stop]
+        records['order_id'] = [self.order_ids[order] for order in orders.tolist()]
+        for name in self.EVENT_COLUMNS.keys() - {'order'}:
+            records[name] = self.events[name][start:stop]
+        return records
+
+    @classmethod
+    def from_records(cls, records: np.ndarray) -> TradeLedger:
+        ledger = cls()
+        if len(records) == 0:
+            return ledger
+        order_ids, first, orders = np.unique(records['order_id'], return_index=True, return_inverse=True)
+        # number orders in the order of their first events
+        order_by_first = np.argsort(first)
+        renumber = np.empty_like(order_by_first)
+        renumber[order_by_first] = np.arange(len(order_by_first))
+        orders = renumber[orders.reshape(-1)]
+        ledger.order_ids = [order_id.decode() for order_id in order_ids[order_by_first].tolist()]
+        ledger.order_index = {order_id: order for order, order_id in enumerate(ledger.order_ids)}
+
+        ledger.events.extend({'order': orders} | {name: records[name] for name in cls.EVENT_COLUMNS.keys() - {'order'}})
+        last = np.zeros(len(ledger.order_ids), dtype=np.int64)  # last event of every order
+        np.maximum.at(last, orders, np.arange(len(orders)))
+        lots_executed = np.zeros(len(ledger.order_ids), dtype=np.int64)
+        total_order_amount = np.zeros(len(ledger.order_ids), dtype=np.int64)
+        np.add.at(lots_executed, orders, records['lots_executed'])
+        np.add.at(total_order_amount, orders, records['total_order_amount'])
+        ledger.orders.extend({'direction': records['direction'][last],
+                              'execution_report_status': records['execution_report_status'][last],
+                              'lots_executed': lots_executed, 'total_order_amount': total_order_amount})
+        ledger.instrument_balance = int(records['instrument_balance'][-1])
+        ledger.balance = int(records['balance'][-1])
+        return ledger
+
+    @classmethod
+    def concatenate(cls, ledgers: list[TradeLedger]) -> TradeLedger:
+        """
+        Events of the ledgers one after another, running balances of every ledger continue from the end
+        of the previous one
+        """
+        ledger = cls()
+        for part in ledgers:
+            if len(part) == 0:
+                continue
+            events = {name: part.events[name] for name in cls.EVENT_COLUMNS}
+            events['order'] = events['order'] + len(ledger.order_ids)
+            events['instrument_balance'] = events['instrument_balance'] + ledger.instrument_balance
+            events['balance'] = events['balance'] + ledger.balance
+            ledger.order_index.update(zip(part.order_ids, range(len(ledger.order_ids),
+                                                                len(ledger.order_ids) + len(part.order_ids))))
+            ledger.order_ids.extend(part.order_ids)
+            ledger.orders.extend({name: part.orders[name] for name in cls.ORDER_COLUMNS})
+            ledger.events.extend(events)
+            ledger.instrument_balance += part.instrument_balance
+            ledger.balance += part.balance
+        return ledger
+
+    def to_frame(self) -> pd.DataFrame:
+        """
+        One row per event. Amounts are converted to floats, running balances are included as
+        balance and instrument_balance columns.
+        """
+        events = self.events
+        data = {name: events[name].copy() for name in self.EVENT_COLUMNS}
+        data['order_id'] = np.array(self.order_ids, dtype=object)[data.pop('order')]
+        data['time'] = pd.to_datetime(data['time'], utc=True)
+        for name in ('total_order_amount', 'average_position_price', 'balance'):
+            data[name] = data[name] // MOD + data[name] % MOD / MOD
+        data['sign'] = 3 - data['direction'].astype(np.int64) * 2
+        return pd.DataFrame(data)
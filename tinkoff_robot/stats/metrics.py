@@ -0,0 +1,225 @@
+import bisect
+import http.server
+import os
+import threading
+import time
+
+from typing import Iterable
+
+LATENCY_BUCKETS: tuple[float, ...] = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                                      0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)  # seconds
+TICK_TO_ORDER_BUCKETS: tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0,
+                                            60.0)  # seconds
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    pairs = [f'{name}="{value}"' for name, value in labels.items()]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    """
+    Monotonic counter. Updates are not locked: a lost increment under thread contention is acceptable for monitoring.
+    """
+    name: str
+    help: str
+    labels: dict[str, str]
+    value: float
+
+    def __init__(self, name: str, help_text: str, labels: dict[str, str] = None):
+        self.name = name
+        self.help = help_text
+        self.labels = labels or {}
+        self.value = 0
+
+    def inc(self, amount: float = 1) -> None:
+        self.value += amount
+
+    def samples(self) -> Iterable[str]:
+        yield f'{self.name}{_format_labels(self.labels)} {self.value}'
+
+
+class _Timer:
+    __slots__ = ('histogram', 'start')
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+        self.start = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.start)
+
+
+class Histogram:
+    """
+    Histogram with fixed bucket bounds. An observation is a binary search and two additions,
+    cumulative counts are computed only when rendering.
+    """
+    name: str
+    help: str
+    labels: dict[str, str]
+    buckets: tuple[float, ...]
+    counts: list[int]  # per bucket, the last one counts observations above all bounds
+    sum: float
+    count: int
+
+    def __init__(self, name: str, help_text: str, buckets: tuple[float, ...] = LATENCY_BUCKETS,
+                 labels: dict[str, str] = None):
+        if list(buckets) != sorted(set(buckets)):
+            raise ValueError('Histogram buckets must be strictly increasing')
+        self.name = name
+        self.help = help_text
+        self.labels = labels or {}
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def time(self) -> _Timer:
+        """
+        Context manager observing the time spent in its block
+        """
+        return _Timer(self)
+
+    def samples(self) -> Iterable[str]:
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            yield f'{self.name}_bucket{_format_labels(self.labels | {"le": le})} {cumulative}'
+        yield f'{self.name}_sum{_format_labels(self.labels)} {self.sum}'
+        yield f'{self.name}_count{_format_labels(self.labels)} {cumulative}'
+
+
+class MetricsRegistry:
+    """
+    Collection of metrics rendered together in the Prometheus text format.
+    Metrics are created once and then updated directly, the registry is not involved in updates.
+    """
+    _metrics: dict[tuple[str, tuple[tuple[str, str], ...]], Counter | Histogram]
+    _lock: threading.Lock
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str, labels: dict[str, str] = None) -> Counter:
+        return self._get_or_create(Counter, name, help_text, labels)
+
+    def histogram(self, name: str, help_text: str, buckets: tuple[float, ...] = LATENCY_BUCKETS,
+                  labels: dict[str, str] = None) -> Histogram:
+        return self._get_or_create(Histogram, name, help_text, labels, buckets=buckets)
+
+    def _get_or_create(self, metric_class: type, name: str, help_text: str, labels: dict[str, str] | None, **kwargs):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            metric = self._metrics.get(key)
+            if metric is None:
+                metric = self._metrics[key] = metric_class(name, help_text, labels=labels, **kwargs)
+            elif not isinstance(metric, metric_class):
+                raise ValueError(f'Metric {name} is already registered as {type(metric).__name__}')
+            return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = sorted(self._metrics.items(), key=lambda item: item[0])
+        lines = []
+        last_name = None
+        for (name, _), metric in metrics:
+            if name != last_name:
+                lines.append(f'# HELP {name} {metric.help}')
+                lines.append(f'# TYPE {name} {type(metric).__name__.lower()}')
+                last_name = name
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, filename: str) -> None:
+        """
+        Writes the metrics to the file atomically, so it can be read by the node exporter textfile collector
+        """
+        temp_filename = f'{filename}.tmp'
+        with open(temp_filename, 'w', encoding='utf-8') as file:
+            file.write(self.render())
+        os.replace(temp_filename, filename)
+
+    def start_dumping(self, filename: str, interval: float = 15.0) -> threading.Event:
+        """
+        Dumps the metrics to the file every interval seconds in a daemon thread. Set the returned event to stop it.
+        """
+        stopped = threading.Event()
+
+        def loop():
+            while not stopped.wait(interval):
+                self.dump(filename)
+            self.dump(filename)
+
+        threading.Thread(target=loop, name='metrics-dump', daemon=True).start()
+        return stopped
+
+    def serve(self, port: int, host: str = '') -> http.server.ThreadingHTTPServer:
+        """
+        Serves the metrics over HTTP in a daemon thread, call shutdown() on the returned server to stop it
+        """
+        registry = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):  # pylint:disable=invalid-name
+                body = registry.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):  # pylint:disable=redefined-builtin
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+        return server
+
+
+REGISTRY = MetricsRegistry()
+
+
+class RobotMetrics:
+    """
+    Stage timings and counters of a trading robot, labeled with the instrument figi
+    """
+    on_update: Histogram
+    check_orders: Histogram
+    decide: Histogram
+    cancel_orders: Histogram
+    post_order: Histogram
+    tick_to_order: Histogram
+    updates: Counter
+    orders_posted: Counter
+    orders_failed: Counter
+    orders_rejected: Counter
+
+    def __init__(self, figi: str, registry: MetricsRegistry = REGISTRY):
+        labels = {'figi': figi}
+        stage = 'robot_stage_seconds'
+        stage_help = 'Time spent in a stage of processing a market data update'
+        self.on_update = registry.histogram(stage, stage_help, labels=labels | {'stage': 'on_update'})
+        self.check_orders = registry.histogram(stage, stage_help, labels=labels | {'stage': 'check_orders'})
+        self.decide = registry.histogram(stage, stage_help, labels=labels | {'stage': 'decide'})
+        self.cancel_orders = registry.histogram(stage, stage_help, labels=labels | {'stage': 'cancel_orders'})
+        self.post_order = registry.histogram(stage, stage_help, labels=labels | {'stage': 'post_order'})
+        self.tick_to_order = registry.histogram(
+            'robot_tick_to_order_seconds', 'Time from the last trade of a candle to the acknowledgement of an order '
+                                           'placed on it, by the local clock', TICK_TO_ORDER_BUCKETS, labels)
+        self.updates = registry.counter('robot_updates_total', 'Market data updates processed', labels)
+        self.orders_posted = registry.counter('robot_orders_posted_total', 'Orders acknowledged by the API', labels)
+        self.orders_failed = registry.counter('robot_orders_failed_total', 'Orders the API failed to accept', labels)
+        self.orders_rejected = registry.counter('robot_orders_rejected_total',
+                                                'Strategy orders rejected by validation', labels)
@@ -0,0 +1,200 @@
+from __future__ import annotations
+
+import itertools
+import os
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from numpy.lib.stride_tricks import sliding_window_view
+
+from stats.analyzer import TradeStatisticsCalculatorBase
+
+BATCH_ELEMENTS: int = 1 << 17  # samples processed at once, arrays of this size stay in the CPU cache
+
+# data of the current worker process, set up by _attach
+_pnl: np.ndarray | None = None
+_blocks: np.ndarray | None = None
+_tail: np.ndarray | None = None
+
+
+def pnl_from_report(df: pd.DataFrame, lot: int = 1) -> np.ndarray:  # pylint:disable=invalid-name
+    """
+    Changes of the trading equity, one per event of a report processed by BalanceProcessor.
+    Positions are valued at the last execution price.
+    """
+    executed = df['lots_executed'].to_numpy() > 0
+    prices = pd.Series(np.where(executed, df['average_position_price'].to_numpy(dtype=float), np.nan))
+    prices = prices.ffill().fillna(0.0).to_numpy()
+    equity = df['balance'].to_numpy(dtype=float) + df['instrument_balance'].to_numpy(dtype=float) * lot * prices
+    return np.diff(equity, prepend=0.0)
+
+
+def block_stats(pnl: np.ndarray, length: int) -> np.ndarray:
+    """
+    Rows of total, highest and lowest equity change and max drawdown of every block of length consecutive changes,
+    columns are block starts
+    """
+    equity = np.concatenate(([0.0], np.cumsum(pnl)))
+    windows = sliding_window_view(equity, length + 1)
+    stats = np.empty((4, len(windows)))
+    rows = max(1, BATCH_ELEMENTS // (length + 1))
+    for first in range(0, len(windows), rows):
+        block = windows[first:first + rows] - windows[first:first + rows, :1]
+        stats[0, first:first + rows] = block[:, -1]
+        stats[1, first:first + rows] = block.max(axis=1)
+        stats[2, first:first + rows] = block.min(axis=1)
+        stats[3, first:first + rows] = (np.maximum.accumulate(block, axis=1) - block).max(axis=1)
+    return stats
+
+
+def _attach(pnl: np.ndarray, blocks: np.ndarray | None, tail: np.ndarray | None) -> None:
+    global _pnl, _blocks, _tail  # pylint:disable=global-statement
+    _pnl, _blocks, _tail = pnl, blocks, tail
+
+
+def _simulate(paths: int, block_size: int, seed: np.random.SeedSequence) -> np.ndarray:
+    # rows of income, max drawdown and max loss of the paths
+    rng = np.random.default_rng(seed)
+    if _blocks is None:
+        return _simulate_shuffled(rng, paths)
+    starts = rng.integers(0, _blocks.shape[1], size=(paths, len(_pnl) // block_size))
+    total, high, low, drawdown = (np.take(row, starts) for row in _blocks)
+
+    # a block adds its own drawdown or deepens the one from the peak of the previous blocks
+    before = np.cumsum(total, axis=1)
+    income = before[:, -1].copy()
+    before -= total
+    peak = np.maximum.accumulate(before + high, axis=1)
+    low += before
+    max_drawdown = np.maximum(drawdown[:, 0], np.maximum(drawdown[:, 1:], peak[:, :-1] - low[:, 1:]).max(axis=1))
+    max_loss = -low.min(axis=1)
+    if _tail is not None:  # the last block is shorter
+        tail_starts = rng.integers(0, _tail.shape[1], size=paths)
+        tail_total, _, tail_low, tail_drawdown = (np.take(row, tail_starts) for row in _tail)
+        tail_low += income
+        max_drawdown = np.maximum(max_drawdown, np.maximum(tail_drawdown, peak[:, -1] - tail_low))
+        max_loss = np.maximum(max_loss, -tail_low)
+        income += tail_total
+    return np.stack((income, max_drawdown, max_loss))
+
+
+def _simulate_shuffled(rng: np.random.Generator, paths: int) -> np.ndarray:
+    equity = np.cumsum(rng.permuted(np.broadcast_to(_pnl, (paths, len(_pnl))), axis=1), axis=1)
+    peak = np.maximum.accumulate(np.maximum(equity, 0.0), axis=1)
+    return np.stack((equity[:, -1],
+                     (peak - equity).max(axis=1),
+                     np.maximum(-equity.min(axis=1), 0.0)))
+
+
+@dataclass
+class RobustnessReport:
+    """
+    Outcomes of resampled paths of a backtest, money amounts are in the instrument currency
+    """
+    income: np.ndarray
+    max_drawdown: np.ndarray  # from the highest equity of the path
+    max_loss: np.ndarray  # from the initial equity
+
+    def ruin_probability(self, loss: float) -> float:
+        """
+        Share of paths losing loss or more at some point, e.g. the whole capital
+        """
+        return float(np.mean(self.max_loss >= loss))
+
+    def summary(self, ruin_loss: float = None, quantiles: tuple[float, ...] = (0.05, 0.5, 0.95)) -> dict[str, any]:
+        stats = {'paths': len(self.income), 'income_mean': float(self.income.mean()),
+                 'loss_probability': float(np.mean(self.income < 0))}
+        for name in ('income', 'max_drawdown'):
+            for quantile, value in zip(quantiles, np.quantile(getattr(self, name), quantiles)):
+                stats[f'{name}_p{round(quantile * 100)}'] = float(value)
+        if ruin_loss is not None:
+            stats['ruin_probability'] = self.ruin_probability(ruin_loss)
+        return stats
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({'income': self.income, 'max_drawdown': self.max_drawdown, 'max_loss': self.max_loss})
+
+
+class RobustnessAnalysis:
+    """
+    Monte Carlo analysis of a series of equity changes, e.g. of pnl_from_report. Paths are built from blocks
+    of block_size consecutive changes drawn with replacement, which keeps their short-term dependence,
+    or from a random permutation of all changes if shuffle is set, so that only the order of trades differs.
+    Every block start is summarized once, so a block bootstrapped path costs O(blocks) rather than O(changes);
+    a shuffled path costs O(changes) and suits series of trades better than series of minute returns.
+    Paths are simulated in batches of NumPy arrays by worker processes.
+    """
+    pnl: np.ndarray
+    block_size: int
+    shuffle: bool
+    processes: int
+
+    def __init__(self, pnl: np.ndarray, block_size: int = None, shuffle: bool = False, processes: int = None):
+        self.pnl = np.asarray(pnl, dtype=float)
+        if len(self.pnl) == 0:
+            raise ValueError('No equity changes to resample')
+        # the cube root of the length is a common default for the block length
+        self.block_size = block_size or max(1, round(len(self.pnl) ** (1 / 3)))
+        if not 0 < self.block_size <= len(self.pnl):
+            raise ValueError('Block size must be positive and not longer than the series')
+        self.shuffle = shuffle
+        self.processes = processes or os.cpu_count()
+
+    @classmethod
+    def from_report(cls, df: pd.DataFrame, lot: int = 1, **kwargs) -> RobustnessAnalysis:  # pylint:disable=invalid-name
+        return cls(pnl_from_report(df, lot), **kwargs)
+
+    def run(self, paths: int = 10000, seed: int = None) -> RobustnessReport:
+        length = len(self.pnl)
+        if self.shuffle:
+            blocks, tail, samples = None, None, length
+        else:
+            blocks = block_stats(self.pnl, self.block_size)
+            tail = block_stats(self.pnl, length % self.block_size) if length % self.block_size else None
+            samples = -(-length // self.block_size)
+        batch = max(1, BATCH_ELEMENTS // samples)
+        sizes = [min(batch, paths - first) for first in range(0, paths, batch)]
+        seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+        processes = min(self.processes, len(sizes))
+        if processes <= 1:
+            _attach(self.pnl, blocks, tail)
+            try:
+                results = list(map(_simulate, sizes, itertools.repeat(self.block_size), seeds))
+            finally:
+                _attach(None, None, None)
+        else:
+            with ProcessPoolExecutor(max_workers=processes, initializer=_attach,
+                                     initargs=(self.pnl, blocks, tail)) as executor:
+                results = list(executor.map(_simulate, sizes, itertools.repeat(self.block_size), seeds,
+                                            chunksize=max(1, len(sizes) // (processes * 4))))
+        income, max_drawdown, max_loss = np.concatenate(results, axis=1)
+        return RobustnessReport(income=income, max_drawdown=max_drawdown, max_loss=max_loss)
+
+
+class RobustnessCalculator(TradeStatisticsCalculatorBase):  # pylint:disable=too-few-public-methods
+    """
+    Adds distributions of bootstrapped income and drawdown to a report processed by BalanceProcessor
+    """
+    lot: int
+    paths: int
+    ruin_loss: float | None
+    seed: int | None
+    options: dict[str, any]  # of RobustnessAnalysis
+
+    def __init__(self, lot: int = 1, paths: int = 10000, ruin_loss: float = None, seed: int = None, **options):
+        self.lot = lot
+        self.paths = paths
+        self.ruin_loss = ruin_loss
+        self.seed = seed
+        self.options = options
+
+    def calculate(self, df: pd.DataFrame) -> dict[str, any]:  # pylint:disable=invalid-name
+        if len(df) == 0:
+            return {}
+        report = RobustnessAnalysis.from_report(df, self.lot, **self.options).run(self.paths, self.seed)
+        return {f'bootstrap_{name}': value for name, value in report.summary(self.ruin_loss).items()}
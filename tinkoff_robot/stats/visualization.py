@@ -1,39 +1,128 @@
+import datetime
+import multiprocessing as mp
+import queue
+import time as time_module
+
+from collections import deque
+
+import matplotlib.dates as mdates
 import matplotlib.pyplot as plt
 
 
+def _render(events: mp.Queue, ticker: str, currency: str, window: int, fps: float):
+    """
+    Renderer process loop. Artists are created once and updated in place, the figure is redrawn
+    at most fps times per second and only when new points arrived.
+    """
+    fig, axes = plt.subplots()
+    axes.set_title(ticker)
+    axes.set_xlabel('time')
+    axes.set_ylabel(f'price ({currency})')
+    axes.xaxis_date()
+    price_line, = axes.plot([], [])
+    buy_lines = axes.vlines([], 0, 1, color='g')
+    sell_lines = axes.vlines([], 0, 1, color='r')
+    plt.show(block=False)
+
+    prices: deque[tuple[float, float]] = deque(maxlen=window)
+    buys: deque[float] = deque(maxlen=window)
+    sells: deque[float] = deque(maxlen=window)
+    frame = 1 / fps
+    while plt.fignum_exists(fig.number):
+        deadline = time_module.monotonic() + frame
+        changed = False
+        while (timeout := deadline - time_module.monotonic()) > 0:
+            try:
+                event = events.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if event is None:
+                plt.close(fig)
+                return
+            kind, time, price = event
+            time = mdates.date2num(time)
+            match kind:
+                case 'price':
+                    if prices and prices[-1][0] == time:  # update of the last candle
+                        prices.pop()
+                    prices.append((time, price))
+                case 'buy':
+                    buys.append(time)
+                case 'sell':
+                    sells.append(time)
+            changed = True
+
+        if changed and prices:
+            x, y = zip(*prices)
+            price_line.set_data(x, y)
+            axes.relim()
+            axes.autoscale_view()
+            ymin, ymax = min(y), max(y)
+            buy_lines.set_segments([[(buy, ymin), (buy, ymax)] for buy in buys if buy >= x[0]])
+            sell_lines.set_segments([[(sell, ymin), (sell, ymax)] for sell in sells if sell >= x[0]])
+            fig.canvas.draw_idle()
+        fig.canvas.flush_events()
+
+
 class Visualizer:
-    def __init__(self, ticker, currency):
+    """
+    Live price chart drawn by a separate process, started with the visualizer so that trading doesn't wait for it.
+    Points are passed through a bounded queue without blocking, they are dropped when the renderer falls behind
+    and after close.
+    """
+    QUEUE_SIZE: int = 1024
+
+    ticker: str
+    currency: str
+    window: int
+    fps: float
+    dropped: int
+
+    def __init__(self, ticker: str, currency: str, window: int = 50, fps: float = 5.0):
         self.ticker = ticker
         self.currency = currency
-        self.fig = plt.figure()
-        self.buys = []
-        self.sells = []
-        self.prices = {}
+        self.window = window
+        self.fps = fps
+        self.dropped = 0
+        self._events = None
+        self._renderer = None
+        self._start()
 
-    def add_price(self, time, price: float):
-        self.prices[time] = price
+    def add_price(self, time: datetime.datetime, price: float):
+        self._send('price', time, price)
 
-    def add_buy(self, time):
-        self.buys.append(time)
+    def add_buy(self, time: datetime.datetime):
+        self._send('buy', time, None)
 
-    def add_sell(self, time):
-        self.sells.append(time)
+    def add_sell(self, time: datetime.datetime):
+        self._send('sell', time, None)
 
     def update_plot(self):
-        self.fig.clear()
-
-        x = list(self.prices.keys())[-50:]
-        y = list(self.prices.values())[-50:]
-
-        minx = min(x)
-        buys = [buy for buy in self.buys if buy >= minx]
-        sells = [sell for sell in self.sells if sell >= minx]
-
-        plt.title(self.ticker)
-        plt.xlabel('time')
-        plt.ylabel(f'price ({self.currency})')
-        plt.plot(x, y)
-        plt.vlines(buys, ymin=min(y), ymax=max(y), color='g')
-        plt.vlines(sells, ymin=min(y), ymax=max(y), color='r')
-        plt.draw()
-        plt.pause(0.2)
+        """
+        The renderer redraws by itself, kept for compatibility
+        """
+
+    def close(self):
+        if self._renderer is None:
+            return
+        try:
+            self._events.put(None, timeout=1)
+        except queue.Full:
+            self._renderer.terminate()
+        self._renderer.join(timeout=1)
+        self._renderer = None
+
+    def _send(self, kind: str, time: datetime.datetime, price: float | None):
+        if self._renderer is None:
+            return
+        try:
+            self._events.put_nowait((kind, time, price))
+        except queue.Full:
+            self.dropped += 1
+
+    def _start(self):
+        context = mp.get_context('spawn')
+        self._events = context.Queue(maxsize=self.QUEUE_SIZE)
+        self._renderer = context.Process(target=_render, name=f'visualizer-{self.ticker}', daemon=True,
+                                         args=(self._events, self.ticker, self.currency, self.window, self.fps))
+        self._renderer.start()
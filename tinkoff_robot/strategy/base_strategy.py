@@ -1,8 +1,11 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
 
+import numpy as np
+
 from tinkoff.invest import (
     Candle,
+    CandleInterval,
     HistoricCandle,
     Instrument,
     MarketDataResponse,
@@ -10,8 +13,13 @@ from tinkoff.invest import (
     OrderDirection,
     OrderState,
     SubscriptionInterval,
+    Trade,
 )
+from helpers.candles import CandleArrays
 from helpers.money import Money
+from helpers.order_book import OrderBook, TradesBuffer
+from stats.analyzer import TradeStatisticsAnalyzer
+from strategy.indicators import InstrumentIndicators
 
 
 @dataclass
@@ -37,6 +45,8 @@ class StrategyDecision:
 
 class TradeStrategyBase(ABC):
     instrument_info: Instrument
+    order_book: OrderBook | None = None
+    trades: TradesBuffer | None = None
 
     @property
     @abstractmethod
@@ -53,6 +63,13 @@ class TradeStrategyBase(ABC):
     def trades_subscription(self) -> bool:  # set True to subscribe robot to trades stream
         return False
 
+    @property
+    def timeframes(self) -> tuple[CandleInterval, ...]:
+        """
+        Longer intervals to receive bars of in on_bar, the robot builds them from the subscribed candles
+        """
+        return ()
+
     @property
     @abstractmethod
     def strategy_id(self) -> str:
@@ -64,18 +81,85 @@ class TradeStrategyBase(ABC):
     def load_instrument_info(self, instrument_info: Instrument):
         self.instrument_info = instrument_info
 
+    def load_indicators(self, indicators: InstrumentIndicators) -> None:
+        """
+        Method used by robot to give the indicators of the instrument, shared with other strategies trading it.
+        Add the indicators used with indicators.add and keep the returned ones.
+        """
+        pass
+
+    def load_order_book(self, order_book: OrderBook | None, trades: TradesBuffer | None) -> None:
+        """
+        Method used by robot to give the order book of order_book_subscription_depth and the buffer of the last trades
+        if trades_subscription is set. Both are updated in place before every decide.
+        """
+        self.order_book = order_book
+        self.trades = trades
+
+    def load_trade_statistics(self, trade_statistics: TradeStatisticsAnalyzer) -> None:
+        """
+        Method used by robot to give the statistics of its trades before loading historic data
+        """
+        pass
+
     def load_candles(self, candles: list[HistoricCandle]) -> None:
         """
         Method used by robot to load historic data
         """
         pass
 
+    def on_order_posted(self, order: RobotTradeOrder, order_id: str | None) -> None:
+        """
+        Method used by robot to report the order of a decision it placed, after adding it to the statistics.
+        order_id is None if the order was rejected by the risk checks or the broker.
+        """
+        pass
+
+    def on_bar(self, interval: CandleInterval, bar: HistoricCandle) -> None:
+        """
+        Receives every finished bar of the timeframes, before the decision on the candle that finished it.
+        Bars built from the candles given to load_candles are sent after it.
+        """
+        pass
+
     @abstractmethod
     def decide(self, market_data: MarketDataResponse, params: TradeStrategyParams) -> StrategyDecision:
         if market_data.candle:
             return self.decide_by_candle(market_data.candle, params)
+        if market_data.orderbook:
+            return self.decide_by_order_book(self.order_book, params)
+        if market_data.trade:
+            return self.decide_by_trade(market_data.trade, params)
         return StrategyDecision()
 
     @abstractmethod
     def decide_by_candle(self, candle: Candle | HistoricCandle, params: TradeStrategyParams) -> StrategyDecision:
         pass
+
+    def decide_by_order_book(self, order_book: OrderBook, params: TradeStrategyParams) -> StrategyDecision:
+        """
+        Called on every update of the order book, already applied to order_book
+        """
+        return StrategyDecision()
+
+    def decide_by_trade(self, trade: Trade, params: TradeStrategyParams) -> StrategyDecision:
+        """
+        Called on every trade of the instrument, already added to trades
+        """
+        return StrategyDecision()
+
+    def close(self) -> None:
+        """
+        Method used by robot to release the resources of the strategy when trading stops
+        """
+        pass
+
+    def decide_batch(self, candles: CandleArrays, start: int) -> np.ndarray | None:
+        """
+        Vectorized counterpart of decide_by_candle used by batch backtests.
+        Returns signed amount of lots to trade on each candle of candles[start:] (positive to buy, negative to sell),
+        the robot cuts it to the available balances. Candles before start are history, as in load_candles.
+        Strategies with timeframes can build their bars with lib.candle_aggregator.resample.
+        None means that the strategy can't be backtested in batch mode.
+        """
+        return None
@@ -0,0 +1,284 @@
+from __future__ import annotations
+
+import datetime
+import logging
+
+from collections import Counter
+from dataclasses import dataclass
+from typing import Callable
+
+from strategy.base_strategy import *
+
+from tinkoff.invest import (
+    Candle,
+    CandleInterval,
+    HistoricCandle,
+    Instrument,
+    MarketDataResponse,
+    OrderDirection,
+    OrderType,
+    Quotation,
+    SubscriptionInterval,
+)
+from helpers.candles import nanos_to_datetime, nanos_to_quotation, quotation_to_nanos
+from helpers.money import Money
+from helpers.order_book import OrderBook, TradesBuffer
+from stats.analyzer import TradeStatisticsAnalyzer
+from strategy.indicators import InstrumentIndicators
+
+
+@dataclass
+class _Allocation:
+    member: int  # index in the strategies
+    lots: int  # left to fill
+
+
+class EnsembleStrategy(TradeStrategyBase):
+    """
+    Runs several strategies on one instrument in a single robot, so they share the market data stream,
+    the history and the indicators. Every member trades against its own virtual sub-ledger of the robot statistics,
+    holding its share of the initial balances, and gets only the market data it subscribes to.
+    Market orders of the members are netted into one order per update. Opposite ones cross internally and are
+    booked in the sub-ledgers at once, at the middle of the order book or the last price. Limit orders of one
+    direction are placed as a single order if no market order is left after netting, otherwise they are dropped.
+    Fills of the placed order are split between the members in the order of their orders when the robot
+    statistics report them, so the sub-ledgers hold only trades that happened. The robot reports the id of
+    the placed order with on_order_posted, as TradingRobot and Backtester do.
+    """
+    strategy_id: str = 'ensemble'
+
+    strategies: list[TradeStrategyBase]
+    names: list[str]  # unique names of the members, keys of their sub-ledgers
+    weights: list[float]  # shares of the initial balances
+    sub_ledgers: list[TradeStatisticsAnalyzer] | None
+    trade_statistics: TradeStatisticsAnalyzer | None  # of the robot, reports fills of the placed orders
+    _last_price: Quotation | None  # of the last candle or trade
+    _unposted: dict[int, tuple[RobotTradeOrder, list[_Allocation]]]  # id of the decided order -> its members
+    _allocations: dict[str, list[_Allocation]]  # order id -> unfilled lots of the members
+    _events_seen: int  # events of the ledger already processed
+
+    def __init__(self, strategies: list[TradeStrategyBase], weights: list[float] = None):
+        if len(strategies) == 0:
+            raise ValueError('Ensemble needs at least one strategy')
+        weights = weights or [1.0] * len(strategies)
+        if len(weights) != len(strategies) or min(weights) < 0 or sum(weights) <= 0:
+            raise ValueError('Weights must be non-negative, one per strategy')
+        if len({strategy.candle_subscription_interval for strategy in strategies} - {None}) > 1:
+            raise ValueError('Strategies of an ensemble must subscribe to the same candle interval')
+        self.strategies = list(strategies)
+        self.weights = [weight / sum(weights) for weight in weights]
+        counts = Counter(strategy.strategy_id for strategy in strategies)
+        self.names = [strategy.strategy_id if counts[strategy.strategy_id] == 1 else f'{strategy.strategy_id}{i}'
+                      for i, strategy in enumerate(strategies)]
+        self.sub_ledgers = None
+        self.trade_statistics = None
+        self._last_price = None
+        self._unposted = {}
+        self._allocations = {}
+        self._events_seen = 0
+
+    @property
+    def candle_subscription_interval(self) -> SubscriptionInterval | None:
+        return next((strategy.candle_subscription_interval for strategy in self.strategies
+                     if strategy.candle_subscription_interval), None)
+
+    @property
+    def order_book_subscription_depth(self) -> int | None:
+        # members share the deepest book requested
+        depths = [strategy.order_book_subscription_depth for strategy in self.strategies
+                  if strategy.order_book_subscription_depth]
+        return max(depths) if depths else None
+
+    @property
+    def trades_subscription(self) -> bool:
+        return any(strategy.trades_subscription for strategy in self.strategies)
+
+    @property
+    def timeframes(self) -> tuple[CandleInterval, ...]:
+        return tuple(dict.fromkeys(interval for strategy in self.strategies for interval in strategy.timeframes))
+
+    def load_instrument_info(self, instrument_info: Instrument):
+        super().load_instrument_info(instrument_info)
+        for strategy in self.strategies:
+            strategy.load_instrument_info(instrument_info)
+
+    def load_indicators(self, indicators: InstrumentIndicators) -> None:
+        for strategy in self.strategies:
+            strategy.load_indicators(indicators)
+
+    def load_order_book(self, order_book: OrderBook | None, trades: TradesBuffer | None) -> None:
+        super().load_order_book(order_book, trades)
+        for strategy in self.strategies:
+            strategy.load_order_book(order_book, trades)
+
+    def load_trade_statistics(self, trade_statistics: TradeStatisticsAnalyzer) -> None:
+        positions = trade_statistics.get_positions()
+        shares = [int(positions * weight) for weight in self.weights]
+        shares[0] += positions - sum(shares)
+        money = trade_statistics.get_money()
+        self.sub_ledgers = [trade_statistics.add_sub_analyzer(name, positions=share, money=money * weight)
+                            for name, share, weight in zip(self.names, shares, self.weights)]
+        for strategy, sub_ledger in zip(self.strategies, self.sub_ledgers):
+            strategy.load_trade_statistics(sub_ledger)
+        self.trade_statistics = trade_statistics
+        self._unposted = {}
+        self._allocations = {}
+        self._events_seen = len(trade_statistics.ledger)
+
+    def load_candles(self, candles: list[HistoricCandle]) -> None:
+        if candles:
+            self._last_price = candles[-1].close
+        for strategy in self.strategies:
+            strategy.load_candles(candles)
+
+    def on_order_posted(self, order: RobotTradeOrder, order_id: str | None) -> None:
+        unposted = self._unposted.pop(id(order), None)
+        if unposted is not None and order_id is not None:
+            self._allocations[order_id] = unposted[1]
+            self._book_fills()  # market orders are filled when posted
+
+    def close(self) -> None:
+        for strategy in self.strategies:
+            strategy.close()
+
+    def on_bar(self, interval: CandleInterval, bar: HistoricCandle) -> None:
+        for strategy in self.strategies:
+            if interval in strategy.timeframes:
+                strategy.on_bar(interval, bar)
+
+    def decide(self, market_data: MarketDataResponse, params: TradeStrategyParams) -> StrategyDecision:
+        if market_data.candle:
+            self._last_price = market_data.candle.close
+        elif market_data.trade:
+            self._last_price = market_data.trade.price
+        return self._net(lambda strategy, member_params: strategy.decide(market_data, member_params)
+                         if self._subscribed(strategy, market_data) else StrategyDecision(), params, trade_time=None)
+
+    def decide_by_candle(self, candle: Candle | HistoricCandle, params: TradeStrategyParams) -> StrategyDecision:
+        self._last_price = candle.close
+        return self._net(lambda strategy, member_params: strategy.decide_by_candle(candle, member_params), params,
+                         trade_time=candle.time)
+
+    @staticmethod
+    def _subscribed(strategy: TradeStrategyBase, market_data: MarketDataResponse) -> bool:
+        return bool(market_data.candle and strategy.candle_subscription_interval
+                    or market_data.orderbook and strategy.order_book_subscription_depth
+                    or market_data.trade and strategy.trades_subscription)
+
+    def _net(self, decide: Callable[[TradeStrategyBase, TradeStrategyParams], StrategyDecision],
+             params: TradeStrategyParams, trade_time: datetime.datetime | None) -> StrategyDecision:
+        if self.sub_ledgers is None:  # run outside of a robot or a backtester
+            self.load_trade_statistics(TradeStatisticsAnalyzer(
+                positions=params.instrument_balance, money=params.currency_balance,
+                instrument_info=self.instrument_info, logger=logging.getLogger(__name__)))
+        self._book_fills()
+
+        cancel_orders: dict[str, OrderState] = {}
+        buys: list[tuple[int, RobotTradeOrder]] = []
+        sells: list[tuple[int, RobotTradeOrder]] = []
+        limit_orders: list[tuple[int, RobotTradeOrder]] = []
+        for member, (strategy, sub_ledger) in enumerate(zip(self.strategies, self.sub_ledgers)):
+            decision = decide(strategy, TradeStrategyParams(instrument_balance=sub_ledger.get_positions(),
+                                                            currency_balance=sub_ledger.get_money(),
+                                                            pending_orders=params.pending_orders))
+            for order in decision.cancel_orders:
+                cancel_orders[order.order_id] = order
+            order = decision.robot_trade_order
+            if order is None or order.quantity <= 0:
+                continue
+            buy = order.direction == OrderDirection.ORDER_DIRECTION_BUY
+            limit = order.order_type == OrderType.ORDER_TYPE_LIMIT and order.price is not None
+            price = order.price.nanos if limit else self._market_price(order.direction)
+            if price is None:
+                continue
+            if buy and price * self.instrument_info.lot * order.quantity > sub_ledger.money_nanos \
+                    or not buy and order.quantity > sub_ledger.get_positions():
+                continue
+            if limit:
+                limit_orders.append((member, order))
+            else:
+                (buys if buy else sells).append((member, order))
+
+        decision = StrategyDecision(cancel_orders=list(cancel_orders.values()))
+        bought, sold = sum(order.quantity for _, order in buys), sum(order.quantity for _, order in sells)
+        crossed = min(bought, sold)
+        allocations = self._cross(buys, crossed, trade_time) + self._cross(sells, crossed, trade_time)
+        if allocations:
+            decision.robot_trade_order = RobotTradeOrder(
+                quantity=abs(bought - sold),
+                direction=OrderDirection.ORDER_DIRECTION_BUY if bought > sold else OrderDirection.ORDER_DIRECTION_SELL)
+        elif limit_orders and len({order.direction for _, order in limit_orders}) == 1:
+            decision.robot_trade_order = self._limit_order(limit_orders)
+            allocations = [_Allocation(member=member, lots=order.quantity) for member, order in limit_orders]
+        if decision.robot_trade_order is not None:
+            self._unposted[id(decision.robot_trade_order)] = (decision.robot_trade_order, allocations)
+        return decision
+
+    def _cross(self, orders: list[tuple[int, RobotTradeOrder]], lots: int,
+               trade_time: datetime.datetime | None) -> list[_Allocation]:
+        """
+        Books the first lots of the market orders as crossed internally, returns the rest to be placed
+        """
+        price = self._cross_price() if lots > 0 else None
+        allocations = []
+        for member, order in orders:
+            crossed = min(order.quantity, lots)
+            if crossed > 0:
+                self.sub_ledgers[member].add_backtest_trade(crossed, nanos_to_quotation(price), order.direction,
+                                                            trade_time)
+                lots -= crossed
+            if order.quantity > crossed:
+                allocations.append(_Allocation(member=member, lots=order.quantity - crossed))
+        return allocations
+
+    def _cross_price(self) -> int:
+        # both sides of a crossing get the same price, so the sub-ledgers add up to the robot balances
+        if self.order_book is not None and self.order_book.best_bid is not None \
+                and self.order_book.best_ask is not None:
+            return (self.order_book.best_bid + self.order_book.best_ask) // 2
+        return quotation_to_nanos(self._last_price)
+
+    @staticmethod
+    def _limit_order(limit_orders: list[tuple[int, RobotTradeOrder]]) -> RobotTradeOrder:
+        direction = limit_orders[0][1].direction
+        # the least aggressive price, so that no member pays more or gets less than it asked for
+        prices = [order.price.nanos for _, order in limit_orders]
+        price = min(prices) if direction == OrderDirection.ORDER_DIRECTION_BUY else max(prices)
+        return RobotTradeOrder(quantity=sum(order.quantity for _, order in limit_orders), direction=direction,
+                               price=Money.from_nanos(price), order_type=OrderType.ORDER_TYPE_LIMIT)
+
+    def _book_fills(self) -> None:
+        """
+        Splits new fills of the placed orders between the members which asked for them
+        """
+        ledger = self.trade_statistics.ledger
+        events = ledger.events
+        for row in range(self._events_seen, len(ledger)):
+            order = ledger.order_ids[int(events['order'][row])]
+            allocations = self._allocations.get(order)
+            if allocations is None:
+                continue
+            lots = int(events['lots_executed'][row])
+            if lots > 0:
+                price = nanos_to_quotation(int(events['total_order_amount'][row]) // (lots * self.instrument_info.lot))
+                direction = OrderDirection(int(events['direction'][row]))
+                time = nanos_to_datetime(int(events['time'][row]))
+                for allocation in allocations:
+                    filled = min(allocation.lots, lots)
+                    self.sub_ledgers[allocation.member].add_backtest_trade(filled, price, direction, time)
+                    allocation.lots -= filled
+                    lots -= filled
+                allocations[:] = [allocation for allocation in allocations if allocation.lots > 0]
+            if not allocations or int(events['execution_report_status'][row]) \
+                    not in TradeStatisticsAnalyzer.PENDING_ORDER_STATUSES:
+                del self._allocations[order]
+        self._events_seen = len(ledger)
+
+    def _market_price(self, direction: OrderDirection) -> int | None:
+        # market orders are filled from the opposite side of the book, without the book at the last price
+        if self.order_book is not None:
+            best = self.order_book.best_ask if direction == OrderDirection.ORDER_DIRECTION_BUY \
+                else self.order_book.best_bid
+            if best is not None:
+                return best
+        return quotation_to_nanos(self._last_price) if self._last_price is not None else None
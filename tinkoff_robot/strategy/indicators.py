@@ -0,0 +1,445 @@
+from __future__ import annotations
+
+import math
+import threading
+
+from abc import ABC, abstractmethod
+from typing import Callable, Iterable, TypeVar
+
+import numpy as np
+
+from tinkoff.invest import Candle, CandleInterval, HistoricCandle
+
+from helpers.candles import CandleArrays, datetime_to_nanos, interval_nanos, quotation_to_nanos
+from helpers.money import MOD
+
+# Streaming updates and batch versions share the float operations below and otherwise work on exact integers
+# (prices in billionths), so both give bit-identical values. Recursive smoothing can't be vectorized without
+# changing the rounding, batch versions run it through a ufunc accumulate over Python floats.
+
+
+def _ema_step(alpha: float) -> Callable[[float, float], float]:
+    def step(average: float, value: float) -> float:
+        return average + alpha * (value - average)
+    return step
+
+
+def _wilder_step(length: int) -> Callable[[float, float], float]:
+    def step(average: float, value: float) -> float:
+        return (average * (length - 1) + value) / length
+    return step
+
+
+def _accumulate(step: Callable[[float, float], float], seed: float, values: np.ndarray) -> np.ndarray:
+    """
+    [seed, step(seed, values[0]), step(step(seed, values[0]), values[1]), ...]
+    """
+    items = np.empty(len(values) + 1, dtype=object)
+    items[0] = seed
+    items[1:] = values.tolist()
+    return np.frompyfunc(step, 2, 1).accumulate(items).astype(np.float64)
+
+
+def _window_sums(values: np.ndarray, length: int) -> np.ndarray:
+    # int64 cumulative sums may wrap around, differences of them are still exact while a window sum fits
+    with np.errstate(over='ignore'):
+        sums = np.cumsum(values)
+        return sums[length - 1:] - np.concatenate([[0], sums[:-length]])
+
+
+def _divide(values: np.ndarray, divisor: int) -> np.ndarray:
+    # Python int / int is correctly rounded, int64 / int converts to float64 first and may round twice
+    return (values.astype(object) / divisor).astype(np.float64)
+
+
+def _padded(values: np.ndarray, size: int) -> np.ndarray:
+    # values of the last candles preceded with NaN for candles before the indicator is warmed up
+    return np.concatenate([np.full(size - len(values), np.nan), values])
+
+
+class Indicator(ABC):
+    """
+    Indicator updated with complete candles. value is None until enough candles are seen.
+    batch(candles)[i] equals value after updating a fresh indicator with candles[:i + 1], NaN instead of None.
+    """
+    PARAMS: tuple[str, ...] = ()  # constructor arguments making the key
+    value: float | None
+
+    @property
+    def key(self) -> tuple:
+        """
+        Indicators with equal keys compute the same values and are shared
+        """
+        return (type(self).__name__,) + tuple(vars(self)[name] for name in self.PARAMS)
+
+    @abstractmethod
+    def update(self, time: int, high: int, low: int, close: int, volume: int) -> None:
+        """
+        Adds a complete candle, time in nanoseconds and prices in billionths
+        """
+
+    @abstractmethod
+    def batch(self, candles: CandleArrays) -> np.ndarray:
+        pass
+
+
+class SMA(Indicator):
+    """
+    Simple moving average of closes
+    """
+    PARAMS = ('length',)
+    length: int
+    _closes: list[int]
+    _count: int
+    _sum: int
+
+    def __init__(self, length: int):
+        if length <= 0:
+            raise ValueError('Indicator length must be positive')
+        self.length = length
+        self.value = None
+        self._closes = [0] * length
+        self._count = 0
+        self._sum = 0
+
+    def update(self, time: int, high: int, low: int, close: int, volume: int) -> None:
+        slot = self._count % self.length
+        self._sum += close - self._closes[slot]
+        self._closes[slot] = close
+        self._count += 1
+        if self._count >= self.length:
+            self.value = self._sum / (self.length * MOD)
+
+    def batch(self, candles: CandleArrays) -> np.ndarray:
+        if len(candles) < self.length:
+            return np.full(len(candles), np.nan)
+        return _padded(_divide(_window_sums(candles.close, self.length), self.length * MOD), len(candles))
+
+
+class EMA(Indicator):
+    """
+    Exponential moving average of closes with alpha = 2 / (length + 1), seeded with the SMA of the first closes
+    """
+    PARAMS = ('length',)
+    length: int
+    _step: Callable[[float, float], float]
+    _count: int
+    _sum: int
+
+    def __init__(self, length: int):
+        if length <= 0:
+            raise ValueError('Indicator length must be positive')
+        self.length = length
+        self.value = None
+        self._step = _ema_step(2 / (length + 1))
+        self._count = 0
+        self._sum = 0
+
+    def update(self, time: int, high: int, low: int, close: int, volume: int) -> None:
+        self._count += 1
+        if self._count < self.length:
+            self._sum += close
+        elif self._count == self.length:
+            self.value = (self._sum + close) / (self.length * MOD)
+        else:
+            self.value = self._step(self.value, close / MOD)
+
+    def batch(self, candles: CandleArrays) -> np.ndarray:
+        if len(candles) < self.length:
+            return np.full(len(candles), np.nan)
+        seed = int(candles.close[:self.length].sum()) / (self.length * MOD)
+        return _padded(_accumulate(self._step, seed, _divide(candles.close[self.length:], MOD)), len(candles))
+
+
+class RSI(Indicator):
+    """
+    Relative strength index with Wilder's smoothing of gains and losses
+    """
+    PARAMS = ('length',)
+    length: int
+    _step: Callable[[float, float], float]
+    _count: int
+    _prev_close: int
+    _gain: float  # sums of the first gains and losses, then their smoothed averages, in billionths
+    _loss: float
+
+    def __init__(self, length: int = 14):
+        if length <= 0:
+            raise ValueError('Indicator length must be positive')
+        self.length = length
+        self.value = None
+        self._step = _wilder_step(length)
+        self._count = 0
+        self._prev_close = 0
+        self._gain = 0
+        self._loss = 0
+
+    @staticmethod
+    def _rsi(gain: float, loss: float) -> float:
+        if loss == 0:
+            return 100.0
+        return 100 - 100 / (1 + gain / loss)
+
+    def update(self, time: int, high: int, low: int, close: int, volume: int) -> None:
+        change, self._prev_close = close - self._prev_close, close
+        self._count += 1
+        if self._count == 1:
+            return
+        gain, loss = max(change, 0), max(-change, 0)
+        if self._count <= self.length:
+            self._gain += gain
+            self._loss += loss
+            return
+        if self._count == self.length + 1:
+            self._gain = (self._gain + gain) / self.length
+            self._loss = (self._loss + loss) / self.length
+        else:
+            self._gain = self._step(self._gain, gain)
+            self._loss = self._step(self._loss, loss)
+        self.value = self._rsi(self._gain, self._loss)
+
+    def batch(self, candles: CandleArrays) -> np.ndarray:
+        if len(candles) <= self.length:
+            return np.full(len(candles), np.nan)
+        changes = np.diff(candles.close)
+        gains, losses = np.maximum(changes, 0), np.maximum(-changes, 0)
+        gain = _accumulate(self._step, int(gains[:self.length].sum()) / self.length, gains[self.length:])
+        loss = _accumulate(self._step, int(losses[:self.length].sum()) / self.length, losses[self.length:])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            rsi = np.where(loss == 0, 100.0, 100 - 100 / (1 + gain / loss))
+        return _padded(rsi, len(candles))
+
+
+class Bollinger(Indicator):
+    """
+    Bollinger bands: SMA of closes and the bands width population standard deviations away from it.
+    value is the middle band.
+    """
+    PARAMS = ('length', 'width')
+    length: int
+    width: float
+    lower: float | None
+    upper: float | None
+    _closes: list[int]
+    _count: int
+    _sum: int
+    _squares: int
+
+    def __init__(self, length: int = 20, width: float = 2.0):
+        if length <= 0:
+            raise ValueError('Indicator length must be positive')
+        self.length = length
+        self.width = width
+        self.value = self.lower = self.upper = None
+        self._closes = [0] * length
+        self._count = 0
+        self._sum = 0
+        self._squares = 0
+
+    def _bands(self, middle: float, variance: int) -> tuple[float, float]:
+        deviation = self.width * (math.sqrt(variance) / (self.length * MOD))
+        return middle - deviation, middle + deviation
+
+    def update(self, time: int, high: int, low: int, close: int, volume: int) -> None:
+        slot = self._count % self.length
+        evicted, self._closes[slot] = self._closes[slot], close
+        self._sum += close - evicted
+        self._squares += close * close - evicted * evicted
+        self._count += 1
+        if self._count >= self.length:
+            # length^2 times the variance, exact in integers
+            variance = self.length * self._squares - self._sum * self._sum
+            self.value = self._sum / (self.length * MOD)
+            self.lower, self.upper = self._bands(self.value, variance)
+
+    def batch(self, candles: CandleArrays) -> np.ndarray:
+        """
+        Columns are the middle, lower and upper bands
+        """
+        bands = np.full((len(candles), 3), np.nan)
+        if len(candles) < self.length:
+            return bands
+        sums = _window_sums(candles.close, self.length)
+        closes = candles.close.astype(object)  # squares overflow int64, Python ints keep them exact
+        squares = np.cumsum(closes * closes)
+        squares = squares[self.length - 1:] - np.concatenate([[0], squares[:-self.length]])
+        variance = self.length * squares - sums.astype(object) ** 2
+        middle = _divide(sums, self.length * MOD)
+        deviation = self.width * (np.sqrt(variance.astype(np.float64)) / (self.length * MOD))
+        bands[self.length - 1:] = np.stack([middle, middle - deviation, middle + deviation], axis=1)
+        return bands
+
+
+class ATR(Indicator):
+    """
+    Average true range with Wilder's smoothing, the first true range is the high-low range of the first candle
+    """
+    PARAMS = ('length',)
+    length: int
+    _step: Callable[[float, float], float]
+    _count: int
+    _prev_close: int
+    _range: float  # sum of the first true ranges, then their smoothed average, in billionths
+
+    def __init__(self, length: int = 14):
+        if length <= 0:
+            raise ValueError('Indicator length must be positive')
+        self.length = length
+        self.value = None
+        self._step = _wilder_step(length)
+        self._count = 0
+        self._prev_close = 0
+        self._range = 0
+
+    def update(self, time: int, high: int, low: int, close: int, volume: int) -> None:
+        true_range = high - low if self._count == 0 \
+            else max(high, self._prev_close) - min(low, self._prev_close)
+        self._prev_close = close
+        self._count += 1
+        if self._count < self.length:
+            self._range += true_range
+            return
+        if self._count == self.length:
+            self._range = (self._range + true_range) / self.length
+        else:
+            self._range = self._step(self._range, true_range)
+        self.value = self._range / MOD
+
+    def batch(self, candles: CandleArrays) -> np.ndarray:
+        if len(candles) < self.length:
+            return np.full(len(candles), np.nan)
+        prev_close = candles.close[:-1]
+        true_ranges = np.concatenate([
+            candles.high[:1] - candles.low[:1],
+            np.maximum(candles.high[1:], prev_close) - np.minimum(candles.low[1:], prev_close)
+        ])
+        seed = int(true_ranges[:self.length].sum()) / self.length
+        return _padded(_accumulate(self._step, seed, true_ranges[self.length:]) / MOD, len(candles))
+
+
+class VWAP(Indicator):
+    """
+    Volume weighted average of typical prices (high + low + close) / 3, restarted every session interval
+    """
+    PARAMS = ('session',)
+    session: CandleInterval
+    _duration: int
+    _session_start: int | None
+    _price_volume: int  # sum of (high + low + close) * volume
+    _volume: int
+
+    def __init__(self, session: CandleInterval = CandleInterval.CANDLE_INTERVAL_DAY):
+        self.session = session
+        self.value = None
+        self._duration = interval_nanos(session)
+        self._session_start = None
+        self._price_volume = 0
+        self._volume = 0
+
+    def update(self, time: int, high: int, low: int, close: int, volume: int) -> None:
+        session_start = time - time % self._duration
+        if session_start != self._session_start:
+            self._session_start = session_start
+            self._price_volume = 0
+            self._volume = 0
+        self._price_volume += (high + low + close) * volume
+        self._volume += volume
+        self.value = self._price_volume / (3 * self._volume * MOD) if self._volume > 0 else None
+
+    def batch(self, candles: CandleArrays) -> np.ndarray:
+        if len(candles) == 0:
+            return np.empty(0)
+        sessions = candles.time - candles.time % self._duration
+        starts = np.flatnonzero(np.r_[True, sessions[1:] != sessions[:-1]])
+        first = np.repeat(starts, np.diff(np.r_[starts, len(candles)]))  # first candle of the session of each
+        # Python ints, price volume sums overflow int64
+        price_volume = np.cumsum((candles.high + candles.low + candles.close).astype(object)
+                                 * candles.volume.astype(object))
+        volume = np.cumsum(candles.volume.astype(object))
+        price_volume = price_volume - np.r_[0, price_volume][first]
+        volume = volume - np.r_[0, volume][first]
+        vwap = np.full(len(candles), np.nan)
+        traded = volume > 0
+        vwap[traded] = (price_volume[traded] / (3 * volume[traded] * MOD)).astype(np.float64)
+        return vwap
+
+
+IndicatorType = TypeVar('IndicatorType', bound=Indicator)
+
+
+class InstrumentIndicators:
+    """
+    Indicators of one instrument shared by all strategies trading it. A candle is passed to the indicators once,
+    when it is complete, i.e. when the stream moves to the next candle; repeated and late updates are skipped.
+    """
+    indicators: dict[tuple, Indicator]
+    _pending: Candle | HistoricCandle | None  # last candle, still being updated
+    _pending_time: int
+    _last_time: int  # last candle passed to the indicators
+    _lock: threading.Lock
+
+    def __init__(self):
+        self.indicators = {}
+        self._pending = None
+        self._pending_time = -1
+        self._last_time = -1
+        self._lock = threading.Lock()
+
+    def add(self, indicator: IndicatorType) -> IndicatorType:
+        """
+        Returns the registered indicator equal to the given one, registering it if there is none.
+        Indicators receive only candles passed after they are added, so add them before loading history.
+        """
+        with self._lock:
+            return self.indicators.setdefault(indicator.key, indicator)
+
+    def update(self, candle: Candle | HistoricCandle) -> None:
+        time = datetime_to_nanos(candle.time)
+        with self._lock:
+            if time < self._pending_time:
+                return
+            if time > self._pending_time and self._pending is not None:
+                self._pass(self._pending_time, self._pending)
+            self._pending, self._pending_time = candle, time
+
+    def load(self, candles: Iterable[HistoricCandle]) -> None:
+        """
+        Passes historic candles, the incomplete ones are kept pending as stream updates
+        """
+        for candle in candles:
+            self.update(candle)
+            if candle.is_complete:
+                with self._lock:
+                    if self._pending is candle:
+                        self._pass(self._pending_time, candle)
+                        self._pending = None
+
+    def _pass(self, time: int, candle: Candle | HistoricCandle) -> None:
+        if time <= self._last_time:
+            return
+        self._last_time = time
+        high, low, close = quotation_to_nanos(candle.high), quotation_to_nanos(candle.low), \
+            quotation_to_nanos(candle.close)
+        for indicator in self.indicators.values():
+            indicator.update(time, high, low, close, candle.volume)
+
+
+class IndicatorRegistry:
+    """
+    Indicators of every instrument traded in the process
+    """
+    _instruments: dict[str, InstrumentIndicators]
+    _lock: threading.Lock
+
+    def __init__(self):
+        self._instruments = {}
+        self._lock = threading.Lock()
+
+    def for_instrument(self, figi: str) -> InstrumentIndicators:
+        with self._lock:
+            if figi not in self._instruments:
+                self._instruments[figi] = InstrumentIndicators()
+            return self._instruments[figi]
+
+
+INDICATORS = IndicatorRegistry()
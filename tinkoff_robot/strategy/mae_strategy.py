@@ -2,6 +2,8 @@ from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
 import datetime
 
+import numpy as np
+
 from strategy.base_strategy import *
 from stats.visualization import *
 
@@ -12,6 +14,7 @@ from tinkoff.invest import (
     OrderDirection,
     SubscriptionInterval,
 )
+from helpers.candles import MOD, quotation_to_nanos
 from helpers.money import Money
 
 
@@ -26,30 +29,42 @@ class MAEStrategy(TradeStrategyBase):
     short_len: int
     long_len: int
     trade_count: int
-    prices = dict[datetime.datetime, Money]
     prev_sign: bool
 
+    # ring buffer with the last long_len minutely closes (in billionths), oldest one at _head
+    _times: list[datetime.datetime | None]
+    _prices: list[int]
+    _head: int
+    _size: int
+    _long_sum: int
+    _short_sum: int
+
     def __init__(self, short_len: int = 5, long_len: int = 20, trade_count: int = 1, visualizer: Visualizer = None):
         assert long_len > short_len
         self.short_len = short_len
         self.long_len = long_len
         self.trade_count = trade_count
-        self.prices = {}
         self.visualizer = visualizer
+        self._reset_prices()
+
+    def close(self) -> None:
+        if self.visualizer:
+            self.visualizer.close()
 
     def load_candles(self, candles: list[HistoricCandle]) -> None:
-        self.prices = {candle.time.replace(second=0, microsecond=0): Money(candle.close)
-                       for candle in candles[-self.long_len:]}
-        self.prev_sign = self._long_avg() > self._short_avg()
+        self._reset_prices()
+        for candle in candles[-self.long_len:]:
+            self._add_price(candle.time.replace(second=0, microsecond=0), quotation_to_nanos(candle.close))
+        self.prev_sign = self._sign()
 
     def decide(self, market_data: MarketDataResponse, params: TradeStrategyParams) -> StrategyDecision:
-        return self.decide_by_candle(market_data.candle, params)
+        return super().decide(market_data, params)
 
     def decide_by_candle(self, candle: Candle | HistoricCandle, params: TradeStrategyParams) -> StrategyDecision:
         time: datetime = candle.time.replace(second=0, microsecond=0)
         order: RobotTradeOrder | None = None
-        if time not in self.prices:  # make order only once a minute (when minutely candle is ready)
-            sign = self._long_avg() > self._short_avg()
+        if not self._has_price(time):  # make order only once a minute (when minutely candle is ready)
+            sign = self._sign()
             if sign != self.prev_sign:
                 if sign:
                     if params.instrument_balance > 0:
@@ -67,19 +82,99 @@ class MAEStrategy(TradeStrategyBase):
                             self.visualizer.add_buy(time)
 
             self.prev_sign = sign
-        self.prices[time] = Money(candle.close)
+        self._add_price(time, quotation_to_nanos(candle.close))
         if self.visualizer:
             self.visualizer.add_price(time, Money(candle.close).to_float())
-            self.visualizer.update_plot()
 
         return StrategyDecision(robot_trade_order=order)
 
+    def decide_batch(self, candles: CandleArrays, start: int) -> np.ndarray:
+        if len(candles) == start:
+            return np.zeros(0, dtype=np.int64)
+        # sums of the last long_len and short_len closes preceding every tested candle; missing history is
+        # zero-padded, as _long_avg and _short_avg do. Sums are exact as closes are in billionths
+        padded = np.concatenate([np.zeros(self.long_len, dtype=np.int64),
+                                 candles.close[max(0, start - self.long_len):-1]])
+        windows = np.lib.stride_tricks.sliding_window_view(padded, self.long_len)[start - len(candles):]
+        long_sum = windows.sum(axis=1)
+        short_sum = windows[:, -self.short_len:].sum(axis=1)
+
+        signs = long_sum * self.short_len > short_sum * self.long_len
+        changed = np.concatenate([[False], signs[1:] != signs[:-1]])
+        return np.where(changed, np.where(signs, -self.trade_count, self.trade_count), 0)
+
     def get_prices_list(self) -> list[Money]:
-        # sort by keys and then convert to a list of values
-        return list(map(lambda x: x[1], sorted(self.prices.items(), key=lambda x: x[0])))
+        return [Money.from_nanos(self._price(i)) for i in range(self._size)]
 
     def _long_avg(self):
-        return sum(float(price) for price in self.get_prices_list()[-self.long_len:]) / self.long_len
+        return self._long_sum / MOD / self.long_len
 
     def _short_avg(self):
-        return sum(float(price) for price in self.get_prices_list()[-self.short_len:]) / self.short_len
+        return self._short_sum / MOD / self.short_len
+
+    def _sign(self) -> bool:
+        # long average > short average, compared exactly
+        return self._long_sum * self.short_len > self._short_sum * self.long_len
+
+    def _reset_prices(self):
+        self._times = [None] * self.long_len
+        self._prices = [0] * self.long_len
+        self._head = 0
+        self._size = 0
+        self._long_sum = 0
+        self._short_sum = 0
+
+    def _time(self, index: int) -> datetime.datetime:
+        return self._times[(self._head + index) % self.long_len]
+
+    def _price(self, index: int) -> int:
+        return self._prices[(self._head + index) % self.long_len]
+
+    def _has_price(self, time: datetime.datetime) -> bool:
+        # minutes older than the window are treated as seen: they can't affect the averages anymore
+        if self._size == 0 or time > self._time(self._size - 1):
+            return False
+        if self._size == self.long_len and time < self._time(0):
+            return True
+        return self._find(time) is not None
+
+    def _find(self, time: datetime.datetime) -> int | None:
+        for index in range(self._size - 1, -1, -1):
+            if self._time(index) == time:
+                return index
+            if self._time(index) < time:
+                return None
+        return None
+
+    def _add_price(self, time: datetime.datetime, price: int):
+        if self._size == 0 or time > self._time(self._size - 1):
+            self._append_price(time, price)
+            return
+
+        index = self._find(time)
+        if index is not None:
+            delta = price - self._price(index)
+            self._prices[(self._head + index) % self.long_len] = price
+            self._long_sum += delta
+            if index >= self._size - self.short_len:
+                self._short_sum += delta
+        elif self._size < self.long_len or time > self._time(0):
+            # late candle inside the window, rebuild the buffer in O(long_len)
+            entries = sorted([(self._time(i), self._price(i)) for i in range(self._size)] + [(time, price)])
+            self._reset_prices()
+            for entry_time, entry_price in entries[-self.long_len:]:
+                self._append_price(entry_time, entry_price)
+
+    def _append_price(self, time: datetime.datetime, price: int):
+        if self._size == self.long_len:
+            self._long_sum -= self._prices[self._head]
+            self._head = (self._head + 1) % self.long_len
+            self._size -= 1
+        if self._size >= self.short_len:
+            self._short_sum -= self._price(self._size - self.short_len)
+
+        self._times[(self._head + self._size) % self.long_len] = time
+        self._prices[(self._head + self._size) % self.long_len] = price
+        self._size += 1
+        self._long_sum += price
+        self._short_sum += price
@@ -23,7 +23,7 @@ class RandomStrategy(TradeStrategyBase):
         self.high = high
 
     def decide(self, market_data: MarketDataResponse, params: TradeStrategyParams) -> StrategyDecision:
-        return self.decide_by_candle(market_data.candle, params)
+        return super().decide(market_data, params)
 
     def decide_by_candle(self, candle: Candle | HistoricCandle, params: TradeStrategyParams) -> StrategyDecision:
         low = max(self.low, -params.instrument_balance)
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# modules of the robot are imported relative to tinkoff_robot, as main.py does
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# lib.robot_factory has to be imported before lib.trading_robot
+import lib.robot_factory  # noqa: E402,F401  pylint:disable=wrong-import-position,unused-import
@@ -0,0 +1,155 @@
+import asyncio
+import datetime
+import logging
+import types
+
+from tinkoff.invest import (
+    Candle,
+    HistoricCandle,
+    Instrument,
+    MarketDataResponse,
+    MoneyValue,
+    OrderBook,
+    OrderDirection,
+    OrderExecutionReportStatus,
+    OrderState,
+    OrderType,
+    PostOrderResponse,
+    Quotation,
+    SubscriptionInterval,
+)
+
+from helpers.candles import nanos_to_quotation
+from helpers.clock import SimulatedClock
+from helpers.money import Money
+from lib.async_trading_robot import AsyncTradingRobot
+from stats.analyzer import TradeStatisticsAnalyzer
+from stats.metrics import MetricsRegistry, RobotMetrics
+from strategy.base_strategy import RobotTradeOrder, StrategyDecision, TradeStrategyBase, TradeStrategyParams
+
+INSTRUMENT = Instrument(figi='FIGI', lot=10)
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+UNIT = 10 ** 9
+BUY, SELL = OrderDirection.ORDER_DIRECTION_BUY, OrderDirection.ORDER_DIRECTION_SELL
+LOGGER = logging.getLogger('test')
+
+
+class ScriptedStrategy(TradeStrategyBase):
+    """
+    Makes the same decision on every candle and records the params it gets
+    """
+    strategy_id = 'scripted'
+    candle_subscription_interval = SubscriptionInterval.SUBSCRIPTION_INTERVAL_ONE_MINUTE
+    order_book_subscription_depth = None
+    trades_subscription = False
+
+    def __init__(self, order: RobotTradeOrder = None, cancel: bool = False):
+        self.order = order
+        self.cancel = cancel
+        self.params = []
+
+    def decide(self, market_data: MarketDataResponse, params: TradeStrategyParams) -> StrategyDecision:
+        self.params.append(params)
+        return super().decide(market_data, params)
+
+    def decide_by_candle(self, candle: HistoricCandle, params: TradeStrategyParams) -> StrategyDecision:
+        return StrategyDecision(robot_trade_order=self.order,
+                                cancel_orders=list(params.pending_orders) if self.cancel else [])
+
+    def decide_by_order_book(self, order_book: OrderBook, params: TradeStrategyParams) -> StrategyDecision:
+        return StrategyDecision()
+
+
+class Sandbox:
+    """
+    Sandbox service holding every request until it is released, market orders are filled at 100
+    """
+    def __init__(self):
+        self.posted = []
+        self.cancelled = []
+        self.released = asyncio.Event()
+
+    async def post_sandbox_order(self, figi: str, quantity: int, price: Quotation | None, direction: OrderDirection,
+                                 account_id: str, order_type: OrderType, order_id: str) -> PostOrderResponse:
+        # pylint:disable=unused-argument,too-many-arguments
+        self.posted.append(order_id)
+        await self.released.wait()
+        amount = nanos_to_quotation(100 * UNIT * quantity * INSTRUMENT.lot)
+        return PostOrderResponse(order_id=order_id, lots_requested=quantity, lots_executed=quantity,
+                                 total_order_amount=MoneyValue(currency='rub', units=amount.units, nano=amount.nano),
+                                 execution_report_status=OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL,
+                                 direction=direction, figi=figi)
+
+    async def cancel_sandbox_order(self, account_id: str, order_id: str) -> None:  # pylint:disable=unused-argument
+        self.cancelled.append(order_id)
+        await self.released.wait()
+
+    async def get_sandbox_order_state(self, account_id: str, order_id: str) -> OrderState:
+        raise AssertionError(f'Unexpected poll of {order_id}')
+
+
+def make_robot(strategy: TradeStrategyBase, positions: int, money: float) -> AsyncTradingRobot:
+    strategy.load_instrument_info(INSTRUMENT)
+    return AsyncTradingRobot('token', 'account', True, strategy,
+                             TradeStatisticsAnalyzer(positions, money, INSTRUMENT, LOGGER), INSTRUMENT, LOGGER,
+                             metrics=RobotMetrics(INSTRUMENT.figi, MetricsRegistry()), connection=object(),
+                             downloader=object(), clock=SimulatedClock())
+
+
+def candle(minute: int) -> MarketDataResponse:
+    price = nanos_to_quotation(100 * UNIT)
+    return MarketDataResponse(candle=Candle(
+        figi=INSTRUMENT.figi, interval=SubscriptionInterval.SUBSCRIPTION_INTERVAL_ONE_MINUTE, open=price, high=price,
+        low=price, close=price, volume=1, time=START + datetime.timedelta(minutes=minute)))
+
+
+async def run_updates(robot: AsyncTradingRobot, sandbox: Sandbox, held: int, after: int) -> None:
+    client = types.SimpleNamespace(sandbox=sandbox)
+    for minute in range(held):
+        robot._on_update(client, candle(minute))  # pylint:disable=protected-access
+        await asyncio.sleep(0)  # the posts start and wait for the release
+    sandbox.released.set()
+    await asyncio.gather(*robot._tasks)  # pylint:disable=protected-access
+    for minute in range(held, held + after):
+        robot._on_update(client, candle(minute))  # pylint:disable=protected-access
+        await asyncio.gather(*robot._tasks)  # pylint:disable=protected-access
+
+
+def test_buys_being_posted_reserve_money():
+    strategy = ScriptedStrategy(RobotTradeOrder(quantity=1, direction=BUY))
+    robot = make_robot(strategy, positions=0, money=2500.0)
+    sandbox = Sandbox()
+    asyncio.run(run_updates(robot, sandbox, held=3, after=1))
+
+    # the second post leaves 500 for the third update, which is rejected
+    assert [params.currency_balance for params in strategy.params] == [2500.0, 1500.0, 500.0, 500.0]
+    assert len(sandbox.posted) == 2
+    assert (robot.trade_statistics.positions, robot.trade_statistics.money) == (2, 500.0)
+    assert robot.metrics.orders_rejected.value == 2
+
+
+def test_sells_being_posted_reserve_lots():
+    strategy = ScriptedStrategy(RobotTradeOrder(quantity=2, direction=SELL))
+    robot = make_robot(strategy, positions=3, money=0.0)
+    sandbox = Sandbox()
+    asyncio.run(run_updates(robot, sandbox, held=2, after=1))
+
+    assert [params.instrument_balance for params in strategy.params] == [3, 1, 1]
+    assert len(sandbox.posted) == 1
+    assert (robot.trade_statistics.positions, robot.trade_statistics.money) == (1, 2000.0)
+
+
+def test_orders_being_cancelled_are_not_offered_again():
+    strategy = ScriptedStrategy(cancel=True)
+    robot = make_robot(strategy, positions=0, money=10000.0)
+    pending = OrderState(order_id='order', lots_requested=1, direction=BUY, figi=INSTRUMENT.figi,
+                         execution_report_status=OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_NEW,
+                         total_order_amount=MoneyValue(currency='rub', units=0, nano=0),
+                         initial_order_price=Money(90.0).to_money_value('rub'))
+    robot.trade_statistics.add_trade(pending)
+    sandbox = Sandbox()
+    asyncio.run(run_updates(robot, sandbox, held=2, after=1))
+
+    assert [len(params.pending_orders) for params in strategy.params] == [1, 0, 0]
+    assert sandbox.cancelled == ['order']
+    assert robot.trade_statistics.get_pending_orders() == []
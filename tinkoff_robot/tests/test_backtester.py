@@ -0,0 +1,48 @@
+import datetime
+import logging
+
+import numpy as np
+import pytest
+
+from tinkoff.invest import Instrument
+
+from benchmarks.data import synthetic_candles
+from helpers.candles import datetime_to_nanos
+from lib.backtester import Backtester
+from lib.batch_backtest import run_batch_backtest
+from stats.ledger import TradeLedger
+from strategy.base_strategy import TradeStrategyParams
+from strategy.mae_strategy import MAEStrategy
+
+INSTRUMENT = Instrument(figi='FIGI', lot=10)
+END = datetime.datetime(2024, 1, 10, tzinfo=datetime.timezone.utc)
+LOGGER = logging.getLogger('test')
+
+
+@pytest.mark.parametrize('start', [0, 3, 25, 500])
+def test_loop_and_batch_ledgers_match(start: int):
+    candles = synthetic_candles(3000, END, seed=start)
+    params = TradeStrategyParams(instrument_balance=0, currency_balance=15000.0, pending_orders=[])
+
+    strategy = MAEStrategy(trade_count=3)
+    strategy.load_instrument_info(INSTRUMENT)
+    strategy.load_candles(list(candles[:start].candles()))
+    loop = Backtester(strategy, INSTRUMENT, LOGGER).run(candles[start:].candles(), params)
+    batch = run_batch_backtest(MAEStrategy(trade_count=3), candles, start, params, INSTRUMENT, LOGGER)
+
+    assert len(loop.ledger) > 10
+    for name in TradeLedger.EVENT_COLUMNS:
+        assert np.array_equal(loop.ledger.events[name], batch.ledger.events[name]), name
+    assert (loop.positions, loop.money_nanos) == (batch.positions, batch.money_nanos)
+
+
+def test_trades_are_stamped_with_candle_time():
+    candles = synthetic_candles(500, END, seed=1)
+    strategy = MAEStrategy()
+    strategy.load_candles([])
+    trade_statistics = Backtester(strategy, INSTRUMENT, LOGGER).run(
+        candles.candles(), TradeStrategyParams(instrument_balance=0, currency_balance=15000.0, pending_orders=[]))
+
+    assert len(trade_statistics.ledger) > 0
+    assert np.isin(trade_statistics.ledger.events['time'], candles.time).all()
+    assert trade_statistics.ledger.events['time'][-1] <= datetime_to_nanos(END)
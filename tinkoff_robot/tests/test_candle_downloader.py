@@ -0,0 +1,115 @@
+import collections
+import datetime
+import logging
+import threading
+import types
+
+import numpy as np
+import pytest
+
+from grpc import StatusCode
+from tinkoff.invest import CandleInterval
+from tinkoff.invest.exceptions import RequestError
+
+from benchmarks.data import synthetic_candles
+from helpers.candles import CandleArrays, datetime_to_nanos, nanos_to_datetime
+from lib.candle_downloader import CandleDownloader, DownloadError, RateLimiter
+from lib.candle_store import CandleStore
+
+END = datetime.datetime(2022, 6, 1, tzinfo=datetime.timezone.utc)
+HISTORY = synthetic_candles(60 * 24 * 5, END, seed=1)
+START = nanos_to_datetime(int(HISTORY.time[0]))
+STOP = nanos_to_datetime(int(HISTORY.time[-1]) + 60 * 10 ** 9)
+MINUTE = CandleInterval.CANDLE_INTERVAL_1_MIN
+LOGGER = logging.getLogger('test')
+
+
+class MarketDataService:
+    """
+    GetCandles over the history, HISTORY by default, failing the first failures[from_] requests of a chunk
+    """
+    def __init__(self, failures: dict[datetime.datetime, int] = None, history: CandleArrays = HISTORY):
+        self.failures = collections.Counter(failures or {})
+        self.history = history
+        self.requests = []
+        self._lock = threading.Lock()
+
+    def get_candles(self, figi: str, from_: datetime.datetime, to: datetime.datetime,  # pylint:disable=invalid-name
+                    interval: CandleInterval) -> types.SimpleNamespace:
+        assert (figi, interval) == ('FIGI', MINUTE)
+        with self._lock:
+            self.requests.append(from_)
+            if self.failures[from_] > 0:
+                self.failures[from_] -= 1
+                raise RequestError(StatusCode.RESOURCE_EXHAUSTED, 'limit exceeded',
+                                   types.SimpleNamespace(ratelimit_reset=0.01))
+        first, last = np.searchsorted(self.history.time, [datetime_to_nanos(from_), datetime_to_nanos(to)])
+        return types.SimpleNamespace(candles=list(self.history[first:last].candles()))
+
+
+def downloader(service: MarketDataService, candle_store: CandleStore = None, retries: int = 3) -> CandleDownloader:
+    connection = types.SimpleNamespace(services=types.SimpleNamespace(market_data=service))
+    return CandleDownloader(connection, candle_store, LOGGER, rate_limiter=RateLimiter(1000, 4), retries=retries,
+                            backoff=0.001, checkpoint_interval=0.0)
+
+
+def assert_history(candles):
+    for column in ('time', 'open', 'high', 'low', 'close', 'volume'):
+        assert np.array_equal(getattr(candles, column), getattr(HISTORY, column)), column
+
+
+def test_download_in_chunks():
+    service = MarketDataService()
+    assert_history(downloader(service).download('FIGI', MINUTE, START, STOP))
+    assert sorted(service.requests) == [START + datetime.timedelta(days=day) for day in range(5)]
+
+
+def test_failed_requests_are_retried():
+    service = MarketDataService({START: 3, START + datetime.timedelta(days=2): 1})
+    assert_history(downloader(service, retries=3).download('FIGI', MINUTE, START, STOP))
+    assert len(service.requests) == 5 + 4
+
+
+def test_chunks_failing_all_retries_are_reported():
+    failed = START + datetime.timedelta(days=1)
+    with pytest.raises(DownloadError) as error:
+        downloader(MarketDataService({failed: 3}), retries=2).download('FIGI', MINUTE, START, STOP)
+    assert error.value.ranges == [(failed, failed + datetime.timedelta(days=1))]
+    assert len(error.value.candles) == len(HISTORY) - 60 * 24
+
+
+def test_download_resumes_from_checkpoints(tmp_path):
+    candle_store = CandleStore(str(tmp_path))
+    failed = START + datetime.timedelta(days=3)
+    with pytest.raises(DownloadError) as error:
+        downloader(MarketDataService({failed: 10}), candle_store, retries=1).download('FIGI', MINUTE, START, STOP)
+    # fetched chunks are checkpointed, the failed one is missing from the store
+    assert len(error.value.candles) == len(HISTORY) - 60 * 24
+    assert candle_store.missing_ranges('FIGI', MINUTE, START, STOP) == [(failed, failed + datetime.timedelta(days=1))]
+
+    service = MarketDataService()
+    assert_history(downloader(service, candle_store).download('FIGI', MINUTE, START, STOP))
+    assert service.requests == [failed]
+
+    service = MarketDataService()
+    assert_history(downloader(service, candle_store).download('FIGI', MINUTE, START, STOP))
+    assert not service.requests
+
+
+def test_gaps_within_a_day_are_reported():
+    def without(*minutes: range) -> CandleArrays:
+        keep = np.ones(len(HISTORY), dtype=bool)
+        for missing in minutes:
+            keep[missing.start:missing.stop] = False
+        return HISTORY[keep]
+
+    # 30 minutes missing are tolerated, and so is a night break across midnight
+    night = range(60 * 24 - 120, 60 * 24 + 120)
+    history = without(range(600, 630), night)
+    candles = downloader(MarketDataService(history=history)).download('FIGI', MINUTE, START, STOP)
+    assert np.array_equal(candles.time, history.time)
+
+    with pytest.raises(DownloadError) as error:
+        downloader(MarketDataService(history=without(range(600, 631), night))).download('FIGI', MINUTE, START, STOP)
+    assert error.value.ranges == [(START + datetime.timedelta(minutes=600), START + datetime.timedelta(minutes=631))]
+    assert len(error.value.candles) == len(HISTORY) - 31 - len(night)
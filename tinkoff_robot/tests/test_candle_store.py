@@ -0,0 +1,84 @@
+import dataclasses
+import datetime
+
+import numpy as np
+
+from tinkoff.invest import CandleInterval
+
+from benchmarks.data import synthetic_candles
+from helpers.candles import CandleArrays, nanos_to_datetime
+from lib.candle_store import CandleStore
+
+END = datetime.datetime(2022, 6, 1, tzinfo=datetime.timezone.utc)
+HISTORY = synthetic_candles(180, END, seed=2)
+MINUTE = CandleInterval.CANDLE_INTERVAL_1_MIN
+
+
+def at(minute: int) -> datetime.datetime:
+    return nanos_to_datetime(int(HISTORY.time[0])) + datetime.timedelta(minutes=minute)
+
+
+def merge(candle_store: CandleStore, first: int, last: int, candles: CandleArrays = HISTORY) -> None:
+    """
+    Stores the candles of minutes [first, last) as fetched for that range
+    """
+    candle_store.merge('FIGI', MINUTE, candles[first:last].candles(), at(first), at(last))
+
+
+def assert_candles(candles: CandleArrays, expected: CandleArrays):
+    for column in CandleArrays.COLUMNS:
+        assert np.array_equal(getattr(candles, column), getattr(expected, column)), column
+
+
+def test_overlapping_ranges_are_merged(tmp_path):
+    candle_store = CandleStore(str(tmp_path))
+    merge(candle_store, 0, 60)
+    # fetched again with other prices, fresh candles override the cached ones
+    changed = dataclasses.replace(HISTORY, close=HISTORY.close + 10 ** 9)
+    merge(candle_store, 30, 90, changed)
+
+    assert candle_store.missing_ranges('FIGI', MINUTE, at(0), at(120)) == [(at(90), at(120))]
+    candles = candle_store.load_arrays('FIGI', MINUTE, at(0), at(120))
+    assert_candles(candles[:30], HISTORY[:30])
+    assert_candles(candles[30:], changed[30:90])
+
+
+def test_adjacent_ranges_are_joined(tmp_path):
+    candle_store = CandleStore(str(tmp_path))
+    merge(candle_store, 60, 90)
+    merge(candle_store, 0, 30)
+    assert candle_store.missing_ranges('FIGI', MINUTE, at(0), at(90)) == [(at(30), at(60))]
+
+    merge(candle_store, 30, 60)
+    assert candle_store.missing_ranges('FIGI', MINUTE, at(0), at(90)) == []
+    assert candle_store.missing_ranges('FIGI', MINUTE, at(-10), at(100)) == [(at(-10), at(0)), (at(90), at(100))]
+    assert_candles(candle_store.load_arrays('FIGI', MINUTE, at(0), at(90)), HISTORY[:90])
+
+
+def test_memory_map_is_reopened_after_append(tmp_path):
+    candle_store = CandleStore(str(tmp_path))
+    merge(candle_store, 0, 60)
+    before = candle_store.load_arrays('FIGI', MINUTE, at(0), at(180))
+    assert isinstance(before.time, np.memmap)
+
+    merge(candle_store, 60, 180)
+    # the files are replaced, arrays mapped before keep the old ones
+    assert_candles(before, HISTORY[:60])
+    assert_candles(candle_store.load_arrays('FIGI', MINUTE, at(0), at(180)), HISTORY)
+    assert_candles(CandleStore(str(tmp_path)).load_arrays('FIGI', MINUTE, at(0), at(180)), HISTORY)
+
+
+def test_load_arrays_bounds(tmp_path):
+    candle_store = CandleStore(str(tmp_path))
+    assert len(candle_store.load_arrays('FIGI', MINUTE, at(0), at(180))) == 0
+    merge(candle_store, 0, 180)
+
+    # from_time is included, to_time is not
+    assert_candles(candle_store.load_arrays('FIGI', MINUTE, at(10), at(20)), HISTORY[10:20])
+    assert_candles(candle_store.load_arrays('FIGI', MINUTE, at(-60), at(1)), HISTORY[:1])
+    assert_candles(candle_store.load_arrays('FIGI', MINUTE, at(179), at(240)), HISTORY[179:])
+    assert_candles(candle_store.load_arrays('FIGI', MINUTE, at(10) + datetime.timedelta(seconds=1), at(20)),
+                   HISTORY[11:20])
+    assert len(candle_store.load_arrays('FIGI', MINUTE, at(20), at(20))) == 0
+    assert len(candle_store.load_arrays('FIGI', MINUTE, at(180), at(240))) == 0
+    assert len(candle_store.load_arrays('FIGI', MINUTE, at(-60), at(0))) == 0
@@ -0,0 +1,197 @@
+import datetime
+import logging
+
+from tinkoff.invest import (
+    HistoricCandle,
+    Instrument,
+    MarketDataResponse,
+    OrderBook,
+    OrderDirection,
+    OrderType,
+    SubscriptionInterval,
+)
+
+from benchmarks.data import market_data, synthetic_candles
+from helpers.candles import datetime_to_nanos, nanos_to_quotation
+from helpers.money import Money
+from lib.backtester import Backtester
+from lib.risk import RiskLimits
+from stats.analyzer import TradeStatisticsAnalyzer
+from strategy.base_strategy import RobotTradeOrder, StrategyDecision, TradeStrategyBase, TradeStrategyParams
+from strategy.ensemble_strategy import EnsembleStrategy
+from strategy.mae_strategy import MAEStrategy
+
+INSTRUMENT = Instrument(figi='FIGI', lot=10)
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+UNIT = 10 ** 9
+BUY, SELL = OrderDirection.ORDER_DIRECTION_BUY, OrderDirection.ORDER_DIRECTION_SELL
+LOGGER = logging.getLogger('test')
+
+
+class ScriptedStrategy(TradeStrategyBase):
+    """
+    Makes the given orders on the candles of the given minutes and records the order books it gets
+    """
+    strategy_id = 'scripted'
+    candle_subscription_interval = SubscriptionInterval.SUBSCRIPTION_INTERVAL_ONE_MINUTE
+    order_book_subscription_depth = None
+    trades_subscription = False
+
+    def __init__(self, orders: dict[int, RobotTradeOrder], order_book_depth: int = None):
+        self.orders = orders
+        self.order_book_subscription_depth = order_book_depth
+        self.order_books = 0
+
+    def decide(self, market_data: MarketDataResponse, params: TradeStrategyParams) -> StrategyDecision:
+        return super().decide(market_data, params)
+
+    def decide_by_candle(self, candle: HistoricCandle, params: TradeStrategyParams) -> StrategyDecision:
+        minute = (candle.time - START) // datetime.timedelta(minutes=1)
+        return StrategyDecision(robot_trade_order=self.orders.get(minute))
+
+    def decide_by_order_book(self, order_book: OrderBook, params: TradeStrategyParams) -> StrategyDecision:
+        self.order_books += 1
+        return StrategyDecision()
+
+
+def candle(minute: int, open_price: int, low: int, close: int, volume: int) -> HistoricCandle:
+    return HistoricCandle(open=nanos_to_quotation(open_price * UNIT), high=nanos_to_quotation(open_price * UNIT),
+                          low=nanos_to_quotation(low * UNIT), close=nanos_to_quotation(close * UNIT), volume=volume,
+                          time=START + datetime.timedelta(minutes=minute), is_complete=True)
+
+
+def limit(direction: OrderDirection, quantity: int, price: int) -> RobotTradeOrder:
+    return RobotTradeOrder(quantity=quantity, direction=direction, order_type=OrderType.ORDER_TYPE_LIMIT,
+                           price=Money.from_nanos(price * UNIT))
+
+
+def backtest(ensemble: EnsembleStrategy, candles: list[HistoricCandle],
+             positions: int = 0) -> TradeStatisticsAnalyzer:
+    params = TradeStrategyParams(instrument_balance=positions, currency_balance=10000.0, pending_orders=[])
+    return Backtester(ensemble, INSTRUMENT, LOGGER).run(candles, params)
+
+
+def balances(trade_statistics: TradeStatisticsAnalyzer) -> list[tuple[int, int]]:
+    return [(sub.positions, sub.money_nanos) for sub in trade_statistics.sub_analyzers.values()]
+
+
+def test_single_member_trades_as_the_member():
+    candles = list(synthetic_candles(2000, START, seed=2).candles())
+    member = MAEStrategy()
+    member.load_candles([])
+    alone = Backtester(member, INSTRUMENT, LOGGER).run(
+        candles, TradeStrategyParams(instrument_balance=0, currency_balance=15000.0, pending_orders=[]))
+    ensemble = EnsembleStrategy([MAEStrategy()])
+    ensemble.load_candles([])
+    together = Backtester(ensemble, INSTRUMENT, LOGGER).run(
+        candles, TradeStrategyParams(instrument_balance=0, currency_balance=15000.0, pending_orders=[]))
+
+    assert len(alone.ledger) > 0
+    assert (together.positions, together.money_nanos) == (alone.positions, alone.money_nanos)
+    assert balances(together) == [(alone.positions, alone.money_nanos)]
+
+
+def test_members_get_only_subscribed_market_data():
+    order_books = ScriptedStrategy({}, order_book_depth=10)
+    ensemble = EnsembleStrategy([MAEStrategy(), order_books])
+    ensemble.load_instrument_info(INSTRUMENT)
+    ensemble.load_candles([])
+    params = TradeStrategyParams(instrument_balance=0, currency_balance=10000.0, pending_orders=[])
+    book = MarketDataResponse(orderbook=OrderBook(figi=INSTRUMENT.figi, depth=10, bids=[], asks=[], time=START))
+    for message in market_data(synthetic_candles(30, START), INSTRUMENT.figi):
+        ensemble.decide(message, params)
+        ensemble.decide(book, params)
+    assert order_books.order_books == 30
+
+
+def test_market_orders_cross_internally():
+    ensemble = EnsembleStrategy([ScriptedStrategy({0: RobotTradeOrder(quantity=3, direction=BUY)}),
+                                 ScriptedStrategy({0: RobotTradeOrder(quantity=1, direction=SELL)})])
+    trade_statistics = backtest(ensemble, [candle(0, 100, 100, 100, 100)], positions=2)
+    assert trade_statistics.positions == 4
+    assert balances(trade_statistics) == [(1 + 3, (5000 - 3 * 10 * 100) * UNIT), (1 - 1, (5000 + 10 * 100) * UNIT)]
+
+
+def test_limit_fills_are_split_between_members():
+    ensemble = EnsembleStrategy([ScriptedStrategy({0: limit(BUY, 3, 99)}), ScriptedStrategy({0: limit(BUY, 2, 98)})])
+    candles = [candle(0, 100, 100, 100, 100),
+               candle(1, 100, 99, 100, 100),  # above the net limit of 98
+               candle(2, 99, 97, 98, 2),
+               candle(3, 98, 97, 98, 100)]
+
+    trade_statistics = backtest(ensemble, candles[:2])
+    assert trade_statistics.positions == 0 and len(trade_statistics.get_pending_orders()) == 1
+    assert balances(trade_statistics) == [(0, 5000 * UNIT), (0, 5000 * UNIT)]
+    # fills are booked on the update after they are reported, the first member asked first
+    trade_statistics = backtest(ensemble, candles[:3])
+    assert balances(trade_statistics) == [(2, (5000 - 2 * 10 * 98) * UNIT), (0, 5000 * UNIT)]
+    trade_statistics = backtest(ensemble, candles)
+    assert trade_statistics.positions == 5
+    assert balances(trade_statistics) == [(3, (5000 - 3 * 10 * 98) * UNIT), (2, (5000 - 2 * 10 * 98) * UNIT)]
+    times = [sub.ledger.events['time'].tolist() for sub in trade_statistics.sub_analyzers.values()]
+    assert times == [[datetime_to_nanos(candles[2].time), datetime_to_nanos(candles[3].time)],
+                     [datetime_to_nanos(candles[3].time)]]
+
+
+def test_limit_orders_are_dropped_with_market_orders_left():
+    ensemble = EnsembleStrategy([ScriptedStrategy({0: limit(BUY, 3, 99)}),
+                                 ScriptedStrategy({0: RobotTradeOrder(quantity=1, direction=BUY)})])
+    trade_statistics = backtest(ensemble, [candle(0, 100, 100, 100, 100), candle(1, 98, 98, 98, 100)])
+    assert trade_statistics.positions == 1
+    assert balances(trade_statistics) == [(0, 5000 * UNIT), (1, (5000 - 10 * 100) * UNIT)]
+
+
+def test_rejected_orders_are_not_booked():
+    ensemble = EnsembleStrategy([ScriptedStrategy({0: RobotTradeOrder(quantity=2, direction=BUY)}),
+                                 ScriptedStrategy({0: RobotTradeOrder(quantity=1, direction=BUY),
+                                                   1: RobotTradeOrder(quantity=1, direction=BUY)})])
+    params = TradeStrategyParams(instrument_balance=0, currency_balance=10000.0, pending_orders=[])
+    trade_statistics = Backtester(ensemble, INSTRUMENT, LOGGER, risk_limits=RiskLimits(max_order_quantity=2)).run(
+        [candle(0, 100, 100, 100, 100), candle(1, 100, 100, 100, 100)], params)
+    # the net order of 3 lots is rejected, the one of the next candle is filled
+    assert trade_statistics.positions == 1
+    assert balances(trade_statistics) == [(0, 5000 * UNIT), (1, (5000 - 10 * 100) * UNIT)]
+
+
+def test_fills_of_other_orders_are_not_booked():
+    ensemble = EnsembleStrategy([ScriptedStrategy({0: RobotTradeOrder(quantity=2, direction=BUY)})])
+    ensemble.load_instrument_info(INSTRUMENT)
+    trade_statistics = TradeStatisticsAnalyzer(0, 10000.0, INSTRUMENT, LOGGER)
+    ensemble.load_trade_statistics(trade_statistics)
+    params = TradeStrategyParams(instrument_balance=0, currency_balance=10000.0, pending_orders=[])
+    order = ensemble.decide_by_candle(candle(0, 100, 100, 100, 100), params).robot_trade_order
+    ensemble.on_order_posted(order, None)
+    # an order of the same direction placed by hand is not the rejected one
+    trade_statistics.add_backtest_trade(2, nanos_to_quotation(100 * UNIT), BUY)
+    ensemble.decide_by_candle(candle(1, 100, 100, 100, 100), params)
+    assert balances(trade_statistics) == [(0, 10000 * UNIT)]
+
+
+def test_sub_ledgers_add_up_to_the_robot_ledger():
+    candles = list(synthetic_candles(3000, START + datetime.timedelta(minutes=2999), seed=4).candles())
+    members = [MAEStrategy(), MAEStrategy(short_len=5, long_len=30),
+               ScriptedStrategy({minute: limit(BUY if minute % 60 < 30 else SELL, 1 + minute % 3, 99 + minute % 4)
+                                 for minute in range(0, 3000, 7)})]
+    ensemble = EnsembleStrategy(members)
+    ensemble.load_candles([])
+    params = TradeStrategyParams(instrument_balance=30, currency_balance=100000.0, pending_orders=[])
+    trade_statistics = Backtester(ensemble, INSTRUMENT, LOGGER, risk_limits=RiskLimits(max_order_quantity=3)).run(
+        candles, params)
+
+    subs = trade_statistics.sub_analyzers.values()
+    assert len(trade_statistics.ledger) > 0 and all(len(sub.ledger) > 0 for sub in subs)
+    assert sum(sub.positions for sub in subs) == trade_statistics.positions
+    # the initial balances are split in floats, the trades since then add up exactly
+    assert sum(sub.ledger.balance for sub in subs) == trade_statistics.ledger.balance
+
+
+def test_close_reaches_the_visualizers_of_members():
+    class Visualizer:
+        closed = False
+
+        def close(self):
+            self.closed = True
+
+    visualizer = Visualizer()
+    EnsembleStrategy([MAEStrategy(visualizer=visualizer), MAEStrategy()]).close()
+    assert visualizer.closed
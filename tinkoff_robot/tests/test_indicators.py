@@ -0,0 +1,52 @@
+import datetime
+
+import numpy as np
+import pytest
+
+from benchmarks.data import synthetic_candles
+from helpers.candles import CandleArrays
+from strategy.indicators import ATR, EMA, RSI, SMA, VWAP, Bollinger, Indicator
+
+END = datetime.datetime(2024, 1, 10, tzinfo=datetime.timezone.utc)
+
+
+def candles_with_nanos(size: int, price: float) -> CandleArrays:
+    """
+    Synthetic candles with closes not rounded to cents, so that sums of closes use all the bits of billionths
+    """
+    candles = synthetic_candles(size, END, seed=3, price=price)
+    close = candles.close + np.random.default_rng(3).integers(0, 10 ** 7, size)
+    return CandleArrays(time=candles.time, volume=candles.volume, open=candles.open,
+                        high=np.maximum(candles.high, close), low=np.minimum(candles.low, close), close=close)
+
+
+def streamed(indicator: Indicator, candles: CandleArrays) -> np.ndarray:
+    values = []
+    for time, high, low, close, volume in zip(candles.time.tolist(), candles.high.tolist(), candles.low.tolist(),
+                                              candles.close.tolist(), candles.volume.tolist()):
+        indicator.update(time, high, low, close, volume)
+        if isinstance(indicator, Bollinger):
+            values.append([np.nan if value is None else value
+                           for value in (indicator.value, indicator.lower, indicator.upper)])
+        else:
+            values.append(np.nan if indicator.value is None else indicator.value)
+    return np.array(values)
+
+
+# sums of 200 closes of 50,000 or 20,000,000 units don't fit the float64 mantissa
+@pytest.mark.parametrize('price', [100.0, 50_000.0, 20_000_000.0])
+@pytest.mark.parametrize('make', [lambda: SMA(200), lambda: SMA(7), lambda: EMA(200), lambda: EMA(12),
+                                  lambda: Bollinger(200), lambda: Bollinger(20, 2.5), lambda: RSI(14),
+                                  lambda: ATR(14), VWAP])
+def test_batch_equals_updates(make, price: float):
+    candles = candles_with_nanos(2000, price)
+    batch = make().batch(candles)
+    assert np.array_equal(batch, streamed(make(), candles), equal_nan=True)
+    assert np.isfinite(batch[-1]).all()
+
+
+def test_batch_of_few_candles():
+    candles = synthetic_candles(5, END)
+    for indicator in (SMA(10), EMA(10), RSI(10), ATR(10)):
+        assert np.isnan(indicator.batch(candles)).all()
+    assert np.isnan(Bollinger(10).batch(candles)).all()
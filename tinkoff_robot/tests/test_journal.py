@@ -0,0 +1,175 @@
+import datetime
+import logging
+import os
+
+import numpy as np
+import pytest
+
+from tinkoff.invest import Instrument, MoneyValue, OrderDirection, OrderExecutionReportStatus, OrderState
+
+from helpers.candles import datetime_to_nanos, nanos_to_quotation
+from helpers.clock import SimulatedClock
+from stats.analyzer import TradeStatisticsAnalyzer
+from stats.journal import TradeJournal
+
+INSTRUMENT = Instrument(figi='FIGI', lot=1)
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+LOGGER = logging.getLogger('test')
+
+
+def money(nanos: int) -> MoneyValue:
+    quotation = nanos_to_quotation(nanos)
+    return MoneyValue(currency='rub', units=quotation.units, nano=quotation.nano)
+
+
+def analyzer(positions: int = 0, money_amount: float = 10000.0) -> TradeStatisticsAnalyzer:
+    trade_statistics = TradeStatisticsAnalyzer(positions, money_amount, INSTRUMENT, LOGGER)
+    trade_statistics.clock = SimulatedClock(datetime_to_nanos(START))
+    return trade_statistics
+
+
+def add_trades(trade_statistics: TradeStatisticsAnalyzer, first: int, count: int) -> None:
+    """
+    Orders of 2 lots bought or sold alternately at 100.5 + order number, a partial fill first
+    """
+    for number in range(first, first + count):
+        trade_statistics.clock.now += 60 * 10 ** 9
+        price = 100_500_000_000 + number * 10 ** 9
+        direction = OrderDirection.ORDER_DIRECTION_SELL if number % 2 else OrderDirection.ORDER_DIRECTION_BUY
+        for lots, status in ((1, OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL),
+                             (2, OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL)):
+            trade_statistics.add_trade(OrderState(order_id=f'order-{number}', execution_report_status=status,
+                                                  lots_requested=2, lots_executed=lots,
+                                                  total_order_amount=money(price * lots),
+                                                  average_position_price=money(price), direction=direction,
+                                                  figi=INSTRUMENT.figi))
+
+
+def assert_same(loaded: TradeStatisticsAnalyzer, expected: TradeStatisticsAnalyzer):
+    assert (loaded.positions, loaded.money_nanos) == (expected.positions, expected.money_nanos)
+    assert loaded.ledger.order_ids == expected.ledger.order_ids
+    for name in loaded.ledger.EVENT_COLUMNS:
+        assert np.array_equal(loaded.ledger.events[name], expected.ledger.events[name]), name
+
+
+def test_journal_round_trip(tmp_path):
+    filename = str(tmp_path / 'stats.journal')
+    trade_statistics = analyzer()
+    trade_statistics.open_journal(filename)
+    add_trades(trade_statistics, 0, 5)
+    trade_statistics.close_journal()
+
+    loaded = TradeStatisticsAnalyzer.load_from_file(filename, INSTRUMENT, LOGGER)
+    assert_same(loaded, trade_statistics)
+    assert loaded.positions == 2 and loaded.money_nanos == 9795 * 10 ** 9
+
+
+def test_journal_time_range(tmp_path):
+    filename = str(tmp_path / 'stats.journal')
+    trade_statistics = analyzer()
+    add_trades(trade_statistics, 0, 5)
+    trade_statistics.save_to_file(filename)
+
+    _, records = TradeJournal.read(filename, START + datetime.timedelta(minutes=2),
+                                   START + datetime.timedelta(minutes=4))
+    assert records['order_id'].tolist() == [b'order-1', b'order-1', b'order-2', b'order-2']
+
+
+def test_resume_continues_the_journal(tmp_path):
+    filename = str(tmp_path / 'stats.journal')
+    expected = analyzer()
+    add_trades(expected, 0, 6)
+
+    first = analyzer()
+    first.open_journal(filename)
+    add_trades(first, 0, 3)
+    first.close_journal()
+    # restarted robot, balances are the current ones of the account
+    second = analyzer(first.positions, first.money)
+    second.clock = first.clock
+    second.open_journal(filename)
+    assert second.ledger.order_ids == first.ledger.order_ids
+    add_trades(second, 3, 3)
+    second.close_journal()
+
+    assert (second.positions, second.money_nanos) == (expected.positions, expected.money_nanos)
+    assert_same(TradeStatisticsAnalyzer.load_from_file(filename, INSTRUMENT, LOGGER), expected)
+
+
+def test_resume_restores_pending_orders(tmp_path):
+    filename = str(tmp_path / 'stats.journal')
+    expected = analyzer()
+    add_trades(expected, 0, 2)
+
+    first = analyzer()
+    first.open_journal(filename)
+    add_trades(first, 0, 2)
+    first.close_journal()
+    # stopped after the partial fill of the second order
+    with open(filename, 'r+b') as file:
+        file.truncate(os.path.getsize(filename) - TradeJournal.RECORD_DTYPE.itemsize)
+
+    second = analyzer(expected.positions + 1, expected.money - 101.5)
+    second.clock = first.clock
+    second.open_journal(filename)
+    pending = second.get_pending_orders()
+    assert [(order.order_id, order.direction, order.execution_report_status, order.lots_executed)
+            for order in pending] == [('order-1', OrderDirection.ORDER_DIRECTION_SELL,
+                                       OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL, 1)]
+    assert pending[0].total_order_amount == money(101_500_000_000)
+
+    # the polled state of the order completes it
+    second.clock.now -= 60 * 10 ** 9
+    add_trades(second, 1, 1)
+    second.close_journal()
+    assert second.get_pending_orders() == []
+    assert (second.positions, second.money_nanos) == (expected.positions, expected.money_nanos)
+
+
+def test_resume_into_analyzer_with_trades_fails(tmp_path):
+    filename = str(tmp_path / 'stats.journal')
+    trade_statistics = analyzer()
+    add_trades(trade_statistics, 0, 1)
+    trade_statistics.save_to_file(filename)
+    with pytest.raises(ValueError):
+        trade_statistics.open_journal(filename)
+
+
+def test_journal_of_another_instrument_fails(tmp_path):
+    filename = str(tmp_path / 'stats.journal')
+    analyzer().save_to_file(filename)
+    with pytest.raises(ValueError):
+        TradeJournal(filename, figi='OTHER', positions=0, money=0)
+
+
+def test_torn_record_is_dropped(tmp_path):
+    filename = str(tmp_path / 'stats.journal')
+    expected = analyzer()
+    add_trades(expected, 0, 4)
+
+    trade_statistics = analyzer()
+    trade_statistics.open_journal(filename)
+    add_trades(trade_statistics, 0, 3)
+    trade_statistics.close_journal()
+    # crash in the middle of writing the fill of the last order
+    with open(filename, 'r+b') as file:
+        file.truncate(os.path.getsize(filename) - TradeJournal.RECORD_DTYPE.itemsize // 2)
+
+    loaded = TradeStatisticsAnalyzer.load_from_file(filename, INSTRUMENT, LOGGER)
+    assert len(loaded.ledger) == 5
+    assert loaded.ledger.events['execution_report_status'][-1] == \
+        OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL
+
+    # the torn record is cut off on reopening, the restarted robot has the balances of the account
+    resumed = analyzer(trade_statistics.positions, trade_statistics.money)
+    resumed.clock = trade_statistics.clock
+    resumed.open_journal(filename)
+    add_trades(resumed, 3, 1)
+    resumed.close_journal()
+    assert (resumed.positions, resumed.money_nanos) == (expected.positions, expected.money_nanos)
+    assert (os.path.getsize(filename) - TradeJournal.HEADER_DTYPE.itemsize) % TradeJournal.RECORD_DTYPE.itemsize == 0
+
+    _, records = TradeJournal.read(filename)
+    assert records['order_id'].tolist() == [b'order-0', b'order-0', b'order-1', b'order-1', b'order-2',
+                                            b'order-3', b'order-3']
+    assert np.array_equal(records['time'][-2:], expected.ledger.events['time'][-2:])
@@ -0,0 +1,99 @@
+import pickle
+import random
+
+import numpy as np
+
+from tinkoff.invest import OrderDirection, OrderExecutionReportStatus
+
+from stats.ledger import TradeLedger
+
+BUY, SELL = OrderDirection.ORDER_DIRECTION_BUY, OrderDirection.ORDER_DIRECTION_SELL
+NEW = OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_NEW
+PARTIALLYFILL = OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL
+FILL = OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL
+
+
+def random_ledger(seed: int, orders: int = 200) -> tuple[TradeLedger, int, int]:
+    """
+    Ledger of orders placed and filled in parts, interleaved with batches of orders filled at once,
+    with the instrument and money balances computed independently
+    """
+    rng = random.Random(seed)
+    ledger, time, open_orders = TradeLedger(), 1_700_000_000 * 10 ** 9, {}
+    instrument_balance = balance = 0
+    for number in range(orders):
+        time += rng.randint(1, 10 ** 9)
+        if rng.random() < 0.2:
+            count = rng.randint(1, 5)
+            direction = np.array([rng.choice((BUY, SELL)) for _ in range(count)], dtype=np.int8)
+            lots = np.array([rng.randint(1, 10) for _ in range(count)], dtype=np.int64)
+            price = np.array([rng.randint(1, 10 ** 12) for _ in range(count)], dtype=np.int64)
+            ledger.record_fills([f'{seed}-batch-{number}-{i}' for i in range(count)], np.full(count, time),
+                                direction, FILL, lots, lots * price, price)
+            sign = np.where(direction == BUY, 1, -1)
+            instrument_balance += int((lots * sign).sum())
+            balance -= int((lots * price * sign).sum())
+            continue
+
+        order_id = f'{seed}-order-{number}'
+        open_orders[order_id] = [rng.choice((BUY, SELL)), rng.randint(1, 10), 0, 0]
+        ledger.record(order_id, time, open_orders[order_id][0], NEW, 0, 0, 0)
+        for order_id in rng.sample(list(open_orders), min(len(open_orders), 2)):
+            direction, requested, executed, amount = open_orders[order_id]
+            lots, price = rng.randint(1, requested - executed), rng.randint(1, 10 ** 12)
+            open_orders[order_id][2:] = executed + lots, amount + lots * price
+            status = FILL if executed + lots == requested else PARTIALLYFILL
+            ledger.record(order_id, time, direction, status, executed + lots, amount + lots * price, price)
+            if status == FILL:
+                del open_orders[order_id]
+            sign = 1 if direction == BUY else -1
+            instrument_balance += lots * sign
+            balance -= lots * price * sign
+    return ledger, instrument_balance, balance
+
+
+def assert_same(ledger: TradeLedger, expected: TradeLedger):
+    assert ledger.order_ids == expected.order_ids
+    assert ledger.order_index == expected.order_index
+    for name in TradeLedger.EVENT_COLUMNS:
+        assert np.array_equal(ledger.events[name], expected.events[name]), name
+    for name in TradeLedger.ORDER_COLUMNS:
+        assert np.array_equal(ledger.orders[name], expected.orders[name]), name
+    assert (ledger.instrument_balance, ledger.balance) == (expected.instrument_balance, expected.balance)
+
+
+def test_running_balances():
+    ledger, instrument_balance, balance = random_ledger(0)
+    assert (ledger.instrument_balance, ledger.balance) == (instrument_balance, balance)
+    assert ledger.events['instrument_balance'][-1] == instrument_balance
+    assert ledger.events['balance'][-1] == balance
+
+
+def test_records_round_trip():
+    for seed in range(5):
+        ledger, _, _ = random_ledger(seed)
+        assert_same(TradeLedger.from_records(ledger.to_records()), ledger)
+        assert_same(pickle.loads(pickle.dumps(ledger)), ledger)
+
+
+def test_records_of_empty_ledger():
+    ledger = TradeLedger.from_records(TradeLedger().to_records())
+    assert len(ledger) == 0 and ledger.order_ids == [] and ledger.balance == 0
+
+
+def test_concatenate_continues_balances():
+    parts = [random_ledger(seed, orders=50) for seed in range(3)]
+    ledger = TradeLedger.concatenate([part for part, _, _ in parts])
+    assert len(ledger) == sum(len(part) for part, _, _ in parts)
+    assert ledger.instrument_balance == sum(instrument_balance for _, instrument_balance, _ in parts)
+    assert ledger.balance == sum(balance for _, _, balance in parts)
+    assert_same(TradeLedger.from_records(ledger.to_records()), ledger)
+
+
+def test_frame():
+    ledger, instrument_balance, balance = random_ledger(1)
+    df = ledger.to_frame()  # pylint:disable=invalid-name
+    assert len(df) == len(ledger)
+    assert df['instrument_balance'].iloc[-1] == instrument_balance
+    assert df['balance'].iloc[-1] == balance / 10 ** 9
+    assert set(df['order_id']) == set(ledger.order_ids)
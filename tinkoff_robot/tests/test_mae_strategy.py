@@ -0,0 +1,118 @@
+import datetime
+import random
+
+import pytest
+
+from tinkoff.invest import HistoricCandle, Instrument, OrderDirection
+
+from helpers.candles import nanos_to_quotation
+from helpers.money import Money
+from strategy.base_strategy import RobotTradeOrder, StrategyDecision, TradeStrategyParams
+from strategy.mae_strategy import MAEStrategy
+
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+INSTRUMENT = Instrument(figi='FIGI', lot=10)
+
+
+class LegacyMAEStrategy(MAEStrategy):
+    """
+    The dict-based MAEStrategy before prices were kept in a ring buffer
+    """
+    def load_candles(self, candles: list[HistoricCandle]) -> None:
+        self.prices = {candle.time.replace(second=0, microsecond=0): Money(candle.close)
+                       for candle in candles[-self.long_len:]}
+        self.prev_sign = self._long_avg() > self._short_avg()
+
+    def decide_by_candle(self, candle: HistoricCandle, params: TradeStrategyParams) -> StrategyDecision:
+        time = candle.time.replace(second=0, microsecond=0)
+        order = None
+        if time not in self.prices:
+            sign = self._long_avg() > self._short_avg()
+            if sign != self.prev_sign:
+                if sign:
+                    if params.instrument_balance > 0:
+                        order = RobotTradeOrder(quantity=min(self.trade_count, params.instrument_balance),
+                                                direction=OrderDirection.ORDER_DIRECTION_SELL)
+                else:
+                    lot_price = Money(candle.close).to_float() * self.instrument_info.lot
+                    lots_available = int(params.currency_balance / lot_price)
+                    if params.currency_balance >= lot_price:
+                        order = RobotTradeOrder(quantity=min(self.trade_count, lots_available),
+                                                direction=OrderDirection.ORDER_DIRECTION_BUY)
+            self.prev_sign = sign
+        self.prices[time] = Money(candle.close)
+        return StrategyDecision(robot_trade_order=order)
+
+    def get_prices_list(self) -> list[Money]:
+        return [price for _, price in sorted(self.prices.items())]
+
+    def _long_avg(self):
+        return sum(float(price) for price in self.get_prices_list()[-self.long_len:]) / self.long_len
+
+    def _short_avg(self):
+        return sum(float(price) for price in self.get_prices_list()[-self.short_len:]) / self.short_len
+
+
+def candle(minute: int, price: int, second: int = 0) -> HistoricCandle:
+    quotation = nanos_to_quotation(price)
+    return HistoricCandle(open=quotation, high=quotation, low=quotation, close=quotation, volume=1,
+                          time=START + datetime.timedelta(minutes=minute, seconds=second), is_complete=True)
+
+
+def random_stream(rng: random.Random, length: int, long_len: int, too_old: bool) -> list[HistoricCandle]:
+    """
+    Minute candles of a random walk with repeated minutes and late candles. Late candles come from inside
+    the averaging window, or from before it too if too_old is set.
+    """
+    candles, minute, price = [], 0, 100 * 10 ** 9
+    for _ in range(length):
+        price = max(10 ** 9, price + rng.randint(-50, 50) * 10 ** 7 + rng.randint(0, 10 ** 7))
+        kind = rng.random()
+        if kind < 0.15:  # update of the current minute
+            candles.append(candle(minute, price, second=rng.randint(1, 59)))
+        elif kind < 0.2 and minute > 2:  # late candle of a skipped minute
+            oldest = 1 if too_old else min(minute - 1, max(1, minute - long_len + 2))
+            candles.append(candle(rng.randint(oldest, minute - 1), price))
+        else:
+            minute += rng.choice((1, 1, 1, 2))
+            candles.append(candle(minute, price))
+    return candles
+
+
+def decisions(strategy: MAEStrategy, candles: list[HistoricCandle]) -> list[tuple | None]:
+    strategy.load_instrument_info(INSTRUMENT)
+    strategy.load_candles(candles[:strategy.long_len])
+    result = []
+    for i, item in enumerate(candles[strategy.long_len:]):
+        # balances allow both buys and sells, so every sign change gives an order
+        params = TradeStrategyParams(instrument_balance=i % 3 + 1, currency_balance=10 ** 6, pending_orders=[])
+        order = strategy.decide_by_candle(item, params).robot_trade_order
+        result.append((order.direction, order.quantity) if order else None)
+    return result
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('short_len, long_len', [(5, 20), (3, 7), (1, 2)])
+def test_decisions_match_legacy_implementation(seed: int, short_len: int, long_len: int):
+    candles = random_stream(random.Random(seed), 500, long_len, too_old=False)
+    assert decisions(MAEStrategy(short_len, long_len, trade_count=2), candles) == \
+        decisions(LegacyMAEStrategy(short_len, long_len, trade_count=2), candles)
+
+
+def test_candle_older_than_window_is_ignored():
+    # intended difference: the legacy strategy decided on a candle older than the averaging window,
+    # although it can't change the averages; the decision is now made on the next new minute
+    prices = [100, 100, 100, 100, 90]
+    stream = [candle(minute, price * 10 ** 9) for minute, price in enumerate(prices)]
+    old, fresh = candle(-10, 95 * 10 ** 9), candle(len(prices), 90 * 10 ** 9)
+    sell = (OrderDirection.ORDER_DIRECTION_SELL, 1)
+
+    assert decisions(LegacyMAEStrategy(2, 4), stream + [old, fresh])[-2:] == [sell, None]
+    assert decisions(MAEStrategy(2, 4), stream + [old, fresh])[-2:] == [None, sell]
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_too_old_candles_only_delay_decisions(seed: int):
+    candles = random_stream(random.Random(seed), 500, 20, too_old=True)
+    new, legacy = decisions(MAEStrategy(), candles), decisions(LegacyMAEStrategy(), candles)
+    assert [order for order in new if order] == [order for order in legacy if order]
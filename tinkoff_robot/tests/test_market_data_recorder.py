@@ -0,0 +1,114 @@
+import datetime
+import os
+import random
+
+from tinkoff.invest import (
+    Candle,
+    MarketDataResponse,
+    Order,
+    OrderBook,
+    SecurityTradingStatus,
+    SubscriptionInterval,
+    Trade,
+    TradeDirection,
+    TradingStatus,
+)
+
+from helpers.candles import datetime_to_nanos, nanos_to_quotation
+from lib.market_data_recorder import MarketDataRecorder
+
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+UNIT = 10 ** 9
+CENT = 10 ** 7
+
+
+def order_book(figi: str, time: datetime.datetime, price: int, bids: int, asks: int) -> MarketDataResponse:
+    return MarketDataResponse(orderbook=OrderBook(
+        figi=figi, depth=10, is_consistent=True, time=time,
+        bids=[Order(price=nanos_to_quotation(price - CENT * level), quantity=level + 1) for level in range(bids)],
+        asks=[Order(price=nanos_to_quotation(price + CENT * (level + 1)), quantity=level + 2) for level in range(asks)],
+        limit_up=nanos_to_quotation(2 * price), limit_down=nanos_to_quotation(price // 2)))
+
+
+def stream(size: int, seed: int = 0) -> list[tuple[int, MarketDataResponse]]:
+    """
+    Messages of every kind received 250 milliseconds apart, trades of FIGI and OTHER
+    """
+    rng = random.Random(seed)
+    price = 100 * UNIT
+    messages = []
+    for i in range(size):
+        price = max(UNIT, price + rng.randint(-3, 3) * CENT)
+        time = START + datetime.timedelta(milliseconds=250 * i)
+        if i % 4 == 0:
+            message = MarketDataResponse(candle=Candle(
+                figi='FIGI', interval=SubscriptionInterval.SUBSCRIPTION_INTERVAL_ONE_MINUTE,
+                open=nanos_to_quotation(price), high=nanos_to_quotation(price + CENT),
+                low=nanos_to_quotation(price - CENT), close=nanos_to_quotation(price), volume=rng.randint(1, 50),
+                time=time.replace(second=0, microsecond=0), last_trade_ts=time))
+        elif i % 4 == 1:
+            message = order_book('FIGI', time, price, 1 + i % 7, i % 5)
+        elif i % 4 == 2:
+            message = MarketDataResponse(trade=Trade(
+                figi='OTHER' if i % 8 == 2 else 'FIGI', direction=TradeDirection(1 + i % 2),
+                price=nanos_to_quotation(price), quantity=rng.randint(1, 5), time=time))
+        else:
+            message = MarketDataResponse(trading_status=TradingStatus(
+                figi='FIGI', trading_status=SecurityTradingStatus.SECURITY_TRADING_STATUS_NORMAL_TRADING, time=time,
+                limit_order_available_flag=True, market_order_available_flag=i % 8 == 3))
+        messages.append((datetime_to_nanos(START) + 250 * 10 ** 6 * i, message))
+    return messages
+
+
+def record(filename: str, messages: list[tuple[int, MarketDataResponse]]) -> None:
+    recorder = MarketDataRecorder(filename)
+    for time, message in messages:
+        recorder.write(message, time)
+    recorder.close()
+
+
+def test_messages_round_trip(tmp_path):
+    filename = str(tmp_path / 'market_data.log')
+    messages = stream(4000)
+    record(filename, messages[:2500])
+    record(filename, messages[2500:])  # appended after a reopen
+    assert list(MarketDataRecorder.messages(filename)) == messages
+
+    # unsupported messages are skipped and receive times never decrease
+    recorder = MarketDataRecorder(filename)
+    recorder.write(MarketDataResponse(ping=1), messages[-1][0])
+    recorder.write(messages[0][1], messages[0][0])
+    recorder.close()
+    assert list(MarketDataRecorder.messages(filename)) == messages + [(messages[-1][0], messages[0][1])]
+
+
+def test_time_range_and_figi(tmp_path):
+    filename = str(tmp_path / 'market_data.log')
+    messages = stream(4000)
+    record(filename, messages)
+    for start, end in ((100.0, 200.0), (100.1, 100.6), (0.0, 0.25), (999.0, 2000.0), (50.0, 50.0)):
+        start, end = START + datetime.timedelta(seconds=start), START + datetime.timedelta(seconds=end)
+        assert list(MarketDataRecorder.messages(filename, start, end)) == \
+            [(time, message) for time, message in messages if datetime_to_nanos(start) <= time < datetime_to_nanos(end)]
+    other = list(MarketDataRecorder.messages(filename, figi='OTHER'))
+    assert other == [(time, message) for time, message in messages if message.trade and message.trade.figi == 'OTHER']
+    assert len(other) == 500
+
+
+def test_torn_order_book_is_dropped(tmp_path):
+    filename = str(tmp_path / 'market_data.log')
+    messages = stream(41)
+    torn = (messages[-1][0] + 10 ** 9, order_book('FIGI', START + datetime.timedelta(seconds=11), 100 * UNIT, 5, 4))
+    record(filename, messages + [torn])
+    # a crash in the middle of the price levels of the last order book, 3 level records follow its record
+    size = os.path.getsize(filename)
+    with open(filename, 'r+b') as file:
+        file.truncate(size - MarketDataRecorder.RECORD_DTYPE.itemsize - 40)
+    assert list(MarketDataRecorder.messages(filename)) == messages
+
+    record(filename, [torn])  # the torn records are cut off on reopen
+    size = os.path.getsize(filename) - MarketDataRecorder.HEADER_DTYPE.itemsize
+    assert size % MarketDataRecorder.RECORD_DTYPE.itemsize == 0
+    assert list(MarketDataRecorder.messages(filename)) == messages + [torn]
+    start = START + datetime.timedelta(seconds=10.5)
+    assert list(MarketDataRecorder.messages(filename, start)) == [torn]
@@ -0,0 +1,38 @@
+import datetime
+
+from tinkoff.invest import Trade, TradeDirection
+
+from helpers.candles import datetime_to_nanos, nanos_to_quotation
+from helpers.order_book import TradesBuffer
+
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+UNIT = 10 ** 9
+
+
+def trade(second: int, price: int, quantity: int, direction: TradeDirection) -> Trade:
+    return Trade(figi='FIGI', direction=direction, price=nanos_to_quotation(price), quantity=quantity,
+                 time=START + datetime.timedelta(seconds=second))
+
+
+def test_trades_buffer_keeps_the_last_trades():
+    trades = TradesBuffer(3)
+    assert trades.vwap() is None and trades.last_price is None
+    for second, (price, quantity) in enumerate([(100, 1), (101, 2), (102, 3), (103, 4)]):
+        trades.update(trade(second, price * UNIT, quantity, TradeDirection(1 + second % 2)))
+    assert len(trades) == 3 and trades.last_price == 103 * UNIT
+    assert trades.ordered()['quantity'].tolist() == [2, 3, 4]
+    assert trades.volume() == 9
+    assert trades.signed_volume() == -2 + 3 - 4
+    assert trades.vwap() == (101 * 2 + 102 * 3 + 103 * 4) * UNIT / 9
+    since = datetime_to_nanos(START + datetime.timedelta(seconds=3))
+    assert trades.volume(since) == 4 and trades.vwap(since) == 103 * UNIT
+
+
+def test_vwap_of_large_trades():
+    trades = TradesBuffer(100)
+    # the sum of billionths times lots is far beyond int64
+    prices = [(2_000_000 + i) * UNIT + 123_456_789 for i in range(100)]
+    for second, price in enumerate(prices):
+        trades.update(trade(second, price, 10 ** 7, TradeDirection.TRADE_DIRECTION_BUY))
+    assert trades.vwap() == sum(prices) * 10 ** 7 / (100 * 10 ** 7)
+    assert abs(trades.vwap() - sum(prices) / 100) < 1
@@ -0,0 +1,154 @@
+import logging
+
+from tinkoff.invest import Instrument, MoneyValue, OrderDirection, OrderExecutionReportStatus, OrderState
+
+from helpers.candles import nanos_to_quotation
+
+from lib.risk import RiskEngine, RiskLimits, RiskState
+from stats.analyzer import TradeStatisticsAnalyzer
+from strategy.base_strategy import RobotTradeOrder
+
+INSTRUMENT = Instrument(figi='FIGI', lot=10)
+UNIT = 10 ** 9
+SECOND = 10 ** 9
+BUY, SELL = OrderDirection.ORDER_DIRECTION_BUY, OrderDirection.ORDER_DIRECTION_SELL
+LOGGER = logging.getLogger('test')
+
+
+def engine(limits: RiskLimits = None, positions: int = 0, money: float = 10000.0,
+           account: RiskState = None) -> RiskEngine:
+    return RiskEngine(TradeStatisticsAnalyzer(positions, money, INSTRUMENT, LOGGER), limits, account, LOGGER)
+
+
+def pending_sell(order_id: str, requested: int, executed: int) -> OrderState:
+    amount = nanos_to_quotation(100 * UNIT * executed * INSTRUMENT.lot)
+    return OrderState(order_id=order_id, direction=SELL, lots_requested=requested, lots_executed=executed,
+                      total_order_amount=MoneyValue(currency='rub', units=amount.units, nano=amount.nano),
+                      execution_report_status=OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_NEW
+                      if executed == 0 else OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL)
+
+
+def buy(quantity: int) -> RobotTradeOrder:
+    return RobotTradeOrder(quantity=quantity, direction=BUY)
+
+
+def sell(quantity: int) -> RobotTradeOrder:
+    return RobotTradeOrder(quantity=quantity, direction=SELL)
+
+
+def test_balances():
+    risk = engine(positions=2, money=1000.0)
+    assert risk.check(buy(1), 100 * UNIT, 0)
+    assert not risk.check(buy(2), 100 * UNIT, 0)  # 2000 for 2 lots of 10
+    assert risk.check(sell(2), 100 * UNIT, 0)
+    assert not risk.check(sell(3), 100 * UNIT, 0)
+    assert not risk.check(buy(0), 100 * UNIT, 0)
+    assert not risk.check(buy(1), None, 0)
+
+
+def test_position_and_order_limits():
+    risk = engine(RiskLimits(max_position=5, max_order_quantity=3), positions=4, money=10 ** 6)
+    assert risk.check(buy(1), 100 * UNIT, 0)
+    assert not risk.check(buy(2), 100 * UNIT, 0)
+    assert not risk.check(sell(4), 100 * UNIT, 0)  # reduces the position, but is too large
+    assert risk.check(sell(3), 100 * UNIT, 0)
+
+    # positions above the limit may still be reduced
+    risk = engine(RiskLimits(max_position=5), positions=8, money=10 ** 6)
+    assert risk.check(sell(1), 100 * UNIT, 0)
+    assert not risk.check(buy(1), 100 * UNIT, 0)
+
+
+def test_notional_limit():
+    risk = engine(RiskLimits(max_notional=5000.0), positions=3, money=10 ** 6)
+    risk.mark(100 * UNIT)  # 3000 held
+    assert risk.check(buy(2), 100 * UNIT, 0)
+    assert not risk.check(buy(3), 100 * UNIT, 0)
+    assert risk.check(sell(1), 100 * UNIT, 0)
+    risk.mark(200 * UNIT)  # 6000 held after the price doubled
+    assert not risk.check(buy(1), 200 * UNIT, 0)
+    assert risk.check(sell(1), 200 * UNIT, 0)
+
+
+def test_order_rate_limit():
+    risk = engine(RiskLimits(max_orders=3, orders_interval=1.0), money=10 ** 6)
+    assert all(risk.check(buy(1), 100 * UNIT, now) for now in (0, SECOND // 4, SECOND // 2))
+    assert not risk.check(buy(1), 100 * UNIT, SECOND // 2)
+    assert not risk.check(buy(1), 100 * UNIT, SECOND - 1)
+    assert risk.check(buy(1), 100 * UNIT, SECOND)  # the first order left the interval
+    assert not risk.check(buy(1), 100 * UNIT, SECOND)
+
+
+def test_drawdown_halts_trading():
+    risk = engine(RiskLimits(max_drawdown=500.0), positions=10, money=10 ** 6)
+    for price in (100, 104, 101):  # the drawdown is 300 from the peak
+        risk.mark(price * UNIT)
+    assert risk.halted is None and risk.check(sell(1), 101 * UNIT, 0)
+    risk.mark(99 * UNIT)  # 500 below the peak of 104
+    assert risk.halted is not None
+    assert not risk.check(buy(1), 99 * UNIT, 0)
+    risk.mark(110 * UNIT)  # the halt stays after the price recovers
+    assert not risk.check(buy(1), 110 * UNIT, 0)
+
+    risk.resume()
+    assert risk.halted is None and risk.check(buy(1), 110 * UNIT, 0)
+    risk.mark(106 * UNIT)  # the drawdown is counted from the PnL at the resume
+    assert risk.halted is None
+    risk.mark(105 * UNIT)
+    assert risk.halted is not None
+
+
+def test_kill_switch():
+    risk = engine(money=10 ** 6)
+    risk.halt('manual')
+    assert risk.halted == 'manual' and not risk.check(buy(1), 100 * UNIT, 0)
+    assert not risk.check(sell(1), 100 * UNIT, 0)  # no position to reduce
+    risk.resume()
+    assert risk.check(buy(1), 100 * UNIT, 0)
+
+
+def test_shared_account_limits():
+    account = RiskState(RiskLimits(max_notional=3000.0, max_drawdown=500.0))
+    first = engine(account=account, positions=1, money=10 ** 6)
+    second = engine(account=account, positions=1, money=10 ** 6)
+    first.mark(100 * UNIT)
+    second.mark(100 * UNIT)
+    assert account.notional == 2000 * UNIT
+    assert first.check(buy(1), 100 * UNIT, 0)
+    assert not first.check(buy(2), 100 * UNIT, 0)  # 4000 in the account
+
+    first.mark(70 * UNIT)  # each instrument loses 300, the account 300 and then 600
+    assert account.halted is None
+    second.mark(70 * UNIT)
+    assert account.halted is not None
+    assert first.halted is not None and second.halted is not None
+    assert not first.check(buy(1), 70 * UNIT, 0)
+    assert first.check(sell(1), 70 * UNIT, 0)
+    assert first.state.halted is None  # the instrument limits were not hit
+
+
+def test_positions_are_reduced_while_halted():
+    risk = engine(RiskLimits(max_drawdown=100.0, max_order_quantity=5), positions=8, money=10 ** 6)
+    risk.mark(100 * UNIT)
+    risk.mark(98 * UNIT)  # 160 lost
+    assert risk.halted is not None
+    assert not risk.check(buy(1), 98 * UNIT, 0)
+    assert not risk.check(sell(6), 98 * UNIT, 0)  # other limits still apply
+    assert risk.check(sell(5), 98 * UNIT, 0)
+    assert not risk.check(sell(9), 98 * UNIT, 0)  # more than held
+
+    risk.trade_statistics.add_backtest_trade(8, nanos_to_quotation(98 * UNIT), SELL)
+    assert not risk.check(sell(1), 98 * UNIT, 0)  # would open a short position
+
+
+def test_pending_sells_reserve_lots():
+    risk = engine(positions=5, money=10 ** 6)
+    risk.trade_statistics.add_trade(pending_sell('first', requested=3, executed=1))  # 4 held, 2 reserved
+    assert risk.check(sell(2), 100 * UNIT, 0)
+    assert not risk.check(sell(3), 100 * UNIT, 0)
+    risk.trade_statistics.add_trade(pending_sell('second', requested=2, executed=0))
+    assert not risk.check(sell(1), 100 * UNIT, 0)
+    risk.trade_statistics.cancel_order('first')
+    assert risk.check(sell(2), 100 * UNIT, 0) and not risk.check(sell(3), 100 * UNIT, 0)
+    # lots being posted are reserved too
+    assert not risk.check(sell(2), 100 * UNIT, 0, reserved_lots=1)
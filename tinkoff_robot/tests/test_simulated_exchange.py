@@ -0,0 +1,112 @@
+import datetime
+import logging
+
+from tinkoff.invest import HistoricCandle, Instrument, OrderDirection, OrderExecutionReportStatus, OrderType
+
+from helpers.candles import datetime_to_nanos, nanos_to_quotation
+from helpers.clock import SimulatedClock
+from helpers.money import Money
+from lib.simulated_exchange import SimulatedExchange
+from stats.analyzer import TradeStatisticsAnalyzer
+from strategy.base_strategy import RobotTradeOrder
+
+INSTRUMENT = Instrument(figi='FIGI', lot=10)
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+UNIT = 10 ** 9
+BUY, SELL = OrderDirection.ORDER_DIRECTION_BUY, OrderDirection.ORDER_DIRECTION_SELL
+LOGGER = logging.getLogger('test')
+
+
+def candle(minute: int, open_price: int, low: int, high: int, close: int, volume: int) -> HistoricCandle:
+    return HistoricCandle(open=nanos_to_quotation(open_price * UNIT), high=nanos_to_quotation(high * UNIT),
+                          low=nanos_to_quotation(low * UNIT), close=nanos_to_quotation(close * UNIT), volume=volume,
+                          time=START + datetime.timedelta(minutes=minute), is_complete=True)
+
+
+def limit(direction: OrderDirection, quantity: int, price: int) -> RobotTradeOrder:
+    return RobotTradeOrder(quantity=quantity, direction=direction, order_type=OrderType.ORDER_TYPE_LIMIT,
+                           price=Money.from_nanos(price * UNIT))
+
+
+def market(direction: OrderDirection, quantity: int) -> RobotTradeOrder:
+    return RobotTradeOrder(quantity=quantity, direction=direction, order_type=OrderType.ORDER_TYPE_MARKET)
+
+
+def make_exchange(positions: int = 0, money: float = 10000.0,
+                  volume_share: float = 1.0) -> tuple[SimulatedExchange, TradeStatisticsAnalyzer]:
+    trade_statistics = TradeStatisticsAnalyzer(positions, money, INSTRUMENT, LOGGER)
+    trade_statistics.clock = SimulatedClock()
+    return SimulatedExchange(INSTRUMENT, trade_statistics, LOGGER, volume_share), trade_statistics
+
+
+def test_market_order_is_filled_at_close():
+    exchange, trade_statistics = make_exchange()
+    state = exchange.post_order(market(BUY, 2), candle(0, 100, 99, 102, 101, 1))
+    assert state.execution_report_status == OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_FILL
+    assert trade_statistics.positions == 2
+    assert trade_statistics.money_nanos == (10000 - 2 * 10 * 101) * UNIT
+
+
+def test_limit_order_is_filled_in_parts_by_volume():
+    exchange, trade_statistics = make_exchange(volume_share=0.5)
+    state = exchange.post_order(limit(BUY, 5, 95), candle(0, 100, 99, 101, 100, 10))
+    assert state.execution_report_status == OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_NEW
+    assert exchange.reserved_money == 5 * 10 * 95 * UNIT
+
+    exchange.match(candle(1, 97, 94, 98, 96, 4))  # half of the volume is available
+    assert trade_statistics.positions == 2
+    assert exchange.reserved_money == 3 * 10 * 95 * UNIT
+    assert trade_statistics.get_trade(state.order_id).execution_report_status == \
+        OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL
+
+    exchange.match(candle(2, 93, 90, 94, 92, 100))  # gapped below the limit, filled at the open
+    assert trade_statistics.positions == 5
+    assert trade_statistics.money_nanos == (10000 - 2 * 10 * 95 - 3 * 10 * 93) * UNIT
+    assert exchange.reserved_money == 0 and not exchange.orders
+    assert trade_statistics.get_pending_orders() == []
+    assert trade_statistics.ledger.events['time'][-1] == 0  # stamped by the analyzer clock
+
+
+def test_reservations_limit_new_orders():
+    exchange, trade_statistics = make_exchange(positions=3, money=2000.0)
+    assert exchange.post_order(limit(BUY, 1, 150), candle(0, 160, 159, 161, 160, 1)) is not None
+    # 1500 of 2000 are reserved by the resting buy
+    assert exchange.post_order(limit(BUY, 1, 60), candle(0, 160, 159, 161, 160, 1)) is None
+    assert exchange.post_order(limit(BUY, 1, 50), candle(0, 160, 159, 161, 160, 1)) is not None
+
+    assert exchange.post_order(limit(SELL, 2, 170), candle(0, 160, 159, 161, 160, 1)) is not None
+    assert exchange.post_order(market(SELL, 2), candle(0, 160, 159, 161, 160, 1)) is None
+    assert exchange.reserved_lots == 2
+
+    for order_id in list(exchange.orders):
+        assert exchange.cancel_order(order_id)
+    assert exchange.reserved_money == 0 and exchange.reserved_lots == 0
+    assert not exchange.cancel_order(order_id)
+    assert exchange.post_order(market(SELL, 3), candle(1, 160, 159, 161, 160, 1)) is not None
+    assert (trade_statistics.positions, trade_statistics.money_nanos) == (0, (2000 + 3 * 10 * 160) * UNIT)
+
+
+def test_orders_are_matched_by_price_then_time():
+    exchange, trade_statistics = make_exchange(positions=10)
+    first = exchange.post_order(limit(SELL, 2, 105), candle(0, 100, 99, 101, 100, 1))
+    second = exchange.post_order(limit(SELL, 2, 105), candle(0, 100, 99, 101, 100, 1))
+    best = exchange.post_order(limit(SELL, 2, 103), candle(0, 100, 99, 101, 100, 1))
+
+    exchange.match(candle(1, 101, 100, 106, 104, 3))
+    assert trade_statistics.get_trade(best.order_id) is None  # filled
+    assert trade_statistics.get_trade(first.order_id).lots_executed == 1
+    assert trade_statistics.get_trade(second.order_id).lots_executed == 0
+    assert trade_statistics.money_nanos == (10000 + 2 * 10 * 103 + 1 * 10 * 105) * UNIT
+    assert exchange.reserved_lots == 3
+
+
+def test_trades_match_resting_orders():
+    exchange, trade_statistics = make_exchange()
+    exchange.trade_statistics.clock.now = datetime_to_nanos(START)
+    exchange.post_order(limit(BUY, 3, 100), candle(0, 101, 100, 102, 101, 1))
+    exchange.match_trade(nanos_to_quotation(101 * UNIT), 5, START)  # above the limit
+    assert trade_statistics.positions == 0
+    exchange.match_trade(nanos_to_quotation(99 * UNIT), 2, START)
+    exchange.match_trade(nanos_to_quotation(100 * UNIT), 2, START)
+    assert trade_statistics.positions == 3
+    assert trade_statistics.money_nanos == (10000 - 2 * 10 * 99 - 10 * 100) * UNIT
@@ -0,0 +1,140 @@
+import datetime
+import logging
+
+from tinkoff.invest import (
+    Candle,
+    HistoricCandle,
+    Instrument,
+    MarketDataResponse,
+    OrderBook,
+    OrderDirection,
+    OrderType,
+    SubscriptionInterval,
+    Trade,
+    TradeDirection,
+)
+
+from helpers.candles import datetime_to_nanos, nanos_to_quotation
+from helpers.money import Money
+from lib.market_data_recorder import MarketDataRecorder
+from lib.tick_replay import TickReplay
+from lib.trading_robot import TradingRobot
+from stats.analyzer import TradeStatisticsAnalyzer
+from stats.metrics import MetricsRegistry, RobotMetrics
+from strategy.base_strategy import RobotTradeOrder, StrategyDecision, TradeStrategyBase, TradeStrategyParams
+from tests.test_market_data_recorder import order_book, stream
+
+INSTRUMENT = Instrument(figi='FIGI', lot=10)
+START = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+UNIT = 10 ** 9
+CENT = 10 ** 7
+BUY, SELL = OrderDirection.ORDER_DIRECTION_BUY, OrderDirection.ORDER_DIRECTION_SELL
+LOGGER = logging.getLogger('test')
+
+
+class ScriptedStrategy(TradeStrategyBase):
+    """
+    Makes the given orders on the order books of the given numbers and records the messages it gets
+    """
+    strategy_id = 'scripted'
+    candle_subscription_interval = None
+    order_book_subscription_depth = 10
+    trades_subscription = False
+
+    def __init__(self, orders: dict[int, RobotTradeOrder]):
+        self.orders = orders
+        self.received = []
+
+    def decide(self, market_data: MarketDataResponse, params: TradeStrategyParams) -> StrategyDecision:
+        self.received.append(market_data)
+        return super().decide(market_data, params)
+
+    def decide_by_candle(self, candle: HistoricCandle, params: TradeStrategyParams) -> StrategyDecision:
+        return StrategyDecision()
+
+    def decide_by_order_book(self, order_book: OrderBook, params: TradeStrategyParams) -> StrategyDecision:
+        return StrategyDecision(robot_trade_order=self.orders.get(len(self.received) - 1))
+
+
+def make_robot(strategy: TradeStrategyBase) -> TradingRobot:
+    strategy.load_instrument_info(INSTRUMENT)
+    return TradingRobot('token', 'account', True, strategy, TradeStatisticsAnalyzer(0, 1.0, INSTRUMENT, LOGGER),
+                        INSTRUMENT, LOGGER, metrics=RobotMetrics(INSTRUMENT.figi, MetricsRegistry()),
+                        connection=object(), downloader=object())
+
+
+def trade(second: float, price: int, quantity: int, figi: str = INSTRUMENT.figi) -> MarketDataResponse:
+    return MarketDataResponse(trade=Trade(figi=figi, direction=TradeDirection.TRADE_DIRECTION_BUY,
+                                          price=nanos_to_quotation(price * UNIT), quantity=quantity,
+                                          time=START + datetime.timedelta(seconds=second)))
+
+
+def record(filename: str, messages: list[tuple[float, MarketDataResponse]]) -> None:
+    recorder = MarketDataRecorder(filename)
+    for second, message in messages:
+        recorder.write(message, datetime_to_nanos(START + datetime.timedelta(seconds=second)))
+    recorder.close()
+
+
+def test_robot_trades_on_recorded_ticks(tmp_path):
+    filename = str(tmp_path / 'market_data.log')
+    books = [(second, order_book(INSTRUMENT.figi, START + datetime.timedelta(seconds=second), 100 * UNIT, 3, 3))
+             for second in range(20)]
+    record(filename, sorted(books + [
+        (0.5, trade(0.5, 101, 50)),
+        (2.5, trade(2.5, 102, 50, figi='OTHER')),  # of another instrument, does not fill the limit order
+        (3.5, trade(3.5, 101, 1)),
+        (4.5, trade(4.5, 102, 50)),
+        (5.5, MarketDataResponse(candle=Candle(
+            figi=INSTRUMENT.figi, interval=SubscriptionInterval.SUBSCRIPTION_INTERVAL_ONE_MINUTE,
+            open=nanos_to_quotation(100 * UNIT), high=nanos_to_quotation(110 * UNIT),
+            low=nanos_to_quotation(90 * UNIT), close=nanos_to_quotation(100 * UNIT), volume=1000, time=START))),
+    ], key=lambda message: message[0]))
+
+    strategy = ScriptedStrategy({
+        0: RobotTradeOrder(quantity=3, direction=BUY),  # at the best ask of 100.01
+        1: RobotTradeOrder(quantity=2, direction=SELL, order_type=OrderType.ORDER_TYPE_LIMIT,
+                           price=Money.from_nanos(101 * UNIT)),
+    })
+    robot = make_robot(strategy)
+    trade_statistics = TickReplay(robot, filename).run(
+        TradeStrategyParams(instrument_balance=0, currency_balance=10000.0, pending_orders=[]))
+
+    # only the order books are delivered to the strategy
+    assert strategy.received == [message for _, message in books]
+    assert robot.trade_statistics is trade_statistics
+    # the limit order is filled at the prices of the trades at 3.5 and 4.5 seconds, the robot learns of it on the
+    # poll after that
+    assert trade_statistics.positions == 3 - 2
+    assert trade_statistics.money_nanos == (10000 - 3 * 10 * 100 + 10 * 101 + 10 * 102) * UNIT - 3 * 10 * CENT
+    assert not trade_statistics.get_pending_orders() and not robot.orders_executed
+    times = trade_statistics.ledger.events['time'].tolist()
+    assert times[0] == datetime_to_nanos(START)
+    assert times[-1] > datetime_to_nanos(START + datetime.timedelta(seconds=4.5))
+
+
+def test_replays_are_repeatable(tmp_path):
+    filename = str(tmp_path / 'market_data.log')
+    recorder = MarketDataRecorder(filename)
+    for time, message in stream(4000):
+        recorder.write(message, time)
+    recorder.close()
+    orders = {number: RobotTradeOrder(quantity=1, direction=BUY if number % 4 < 2 else SELL)
+              for number in range(0, 1000, 10)}
+    orders.update({number: RobotTradeOrder(quantity=2, direction=SELL, order_type=OrderType.ORDER_TYPE_LIMIT,
+                                           price=Money.from_nanos(101 * UNIT))
+                   for number in range(5, 1000, 50)})
+
+    results = []
+    for start in (None, START + datetime.timedelta(seconds=500)):
+        strategy = ScriptedStrategy(orders)
+        robot = make_robot(strategy)
+        params = TradeStrategyParams(instrument_balance=10, currency_balance=100000.0, pending_orders=[])
+        for _ in range(2):  # the robot is reset by every run
+            strategy.received = []
+            trade_statistics = TickReplay(robot, filename).run(params, start=start)
+            events = trade_statistics.ledger.events
+            results.append((trade_statistics.positions, trade_statistics.money_nanos,
+                            {name: events[name].tolist() for name in events.columns}))
+    assert results[0] == results[1] and results[2] == results[3]
+    assert len(results[0][2]['time']) > len(results[2][2]['time']) > 0
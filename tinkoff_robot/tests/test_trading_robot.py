@@ -0,0 +1,139 @@
+import dataclasses
+import datetime
+import logging
+import types
+
+from tinkoff.invest import (
+    Instrument,
+    MoneyValue,
+    OrderDirection,
+    OrderExecutionReportStatus,
+    OrderState,
+    OrderTrade,
+    OrderTrades,
+    PostOrderResponse,
+)
+
+from helpers.candles import nanos_to_quotation
+from helpers.clock import SimulatedClock
+from lib.trading_robot import TradingRobot
+from stats.analyzer import TradeStatisticsAnalyzer
+from stats.metrics import MetricsRegistry, RobotMetrics
+from strategy.base_strategy import RobotTradeOrder
+from strategy.mae_strategy import MAEStrategy
+
+INSTRUMENT = Instrument(figi='FIGI', lot=10)
+PRICE = 100 * 10 ** 9
+ORDER_ID = 'order'
+
+
+def make_robot(clock: SimulatedClock = None) -> TradingRobot:
+    logger = logging.getLogger('test')
+    strategy = MAEStrategy()
+    strategy.load_instrument_info(INSTRUMENT)
+    return TradingRobot('token', 'account', True, strategy, TradeStatisticsAnalyzer(0, 10 ** 6, INSTRUMENT, logger),
+                        INSTRUMENT, logger, metrics=RobotMetrics(INSTRUMENT.figi, MetricsRegistry()),
+                        connection=object(), downloader=object(), clock=clock)
+
+
+def money(lots: int) -> MoneyValue:
+    quotation = nanos_to_quotation(PRICE * lots * INSTRUMENT.lot)
+    return MoneyValue(currency='rub', units=quotation.units, nano=quotation.nano)
+
+
+def order_state(lots: int, status: OrderExecutionReportStatus) -> OrderState:
+    return OrderState(order_id=ORDER_ID, execution_report_status=status, lots_requested=10, lots_executed=lots,
+                      total_order_amount=money(lots), direction=OrderDirection.ORDER_DIRECTION_BUY,
+                      figi=INSTRUMENT.figi)
+
+
+def order_trades(*trades: tuple[str, int]) -> OrderTrades:
+    time = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    return OrderTrades(order_id=ORDER_ID, direction=OrderDirection.ORDER_DIRECTION_BUY, figi=INSTRUMENT.figi,
+                       trades=[OrderTrade(date_time=time, price=nanos_to_quotation(PRICE),
+                                          quantity=lots * INSTRUMENT.lot, trade_id=trade_id)
+                               for trade_id, lots in trades])
+
+
+def test_streamed_fills_are_not_counted_twice():
+    robot = make_robot()
+    posted = PostOrderResponse(order_id=ORDER_ID, lots_requested=10, total_order_amount=money(0),
+                               execution_report_status=OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_NEW,
+                               direction=OrderDirection.ORDER_DIRECTION_BUY, figi=INSTRUMENT.figi)
+    robot._on_order_posted(  # pylint:disable=protected-access
+        RobotTradeOrder(quantity=10, direction=OrderDirection.ORDER_DIRECTION_BUY), posted)
+
+    robot._on_order_trades(order_trades(('a', 2), ('b', 1)))  # pylint:disable=protected-access
+    assert robot.trade_statistics.get_positions() == 3
+    # a poll includes the streamed trades and one more, which is streamed afterwards
+    robot._update_order_state(  # pylint:disable=protected-access
+        ORDER_ID, order_state(5, OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL))
+    robot._on_order_trades(order_trades(('c', 2)))  # pylint:disable=protected-access
+    assert robot.trade_statistics.get_positions() == 5
+    # trades delivered again after a reconnect of the stream
+    robot._on_order_trades(order_trades(('a', 2), ('c', 2)))  # pylint:disable=protected-access
+    assert robot.trade_statistics.get_positions() == 5
+
+    robot._on_order_trades(order_trades(('d', 5)))  # pylint:disable=protected-access
+    assert robot.trade_statistics.get_positions() == 10
+    assert robot.trade_statistics.get_money() == 10 ** 6 - PRICE * 10 * INSTRUMENT.lot / 10 ** 9
+    assert ORDER_ID not in robot.orders_executed
+
+
+def test_streamed_amounts_are_exact():
+    robot = make_robot()
+    posted = PostOrderResponse(order_id=ORDER_ID, lots_requested=10, total_order_amount=money(0),
+                               execution_report_status=OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_NEW,
+                               direction=OrderDirection.ORDER_DIRECTION_BUY, figi=INSTRUMENT.figi)
+    robot._on_order_posted(  # pylint:disable=protected-access
+        RobotTradeOrder(quantity=10, direction=OrderDirection.ORDER_DIRECTION_BUY), posted)
+    # prices with all nine digits of billionths, their float sums are off by a few billionths
+    prices = [1_234_567 * 10 ** 9 + 987_654_321 + i for i in range(10)]
+    time = datetime.datetime(2024, 1, 1, tzinfo=datetime.timezone.utc)
+    for i, price in enumerate(prices):
+        robot._on_order_trades(OrderTrades(  # pylint:disable=protected-access
+            order_id=ORDER_ID, direction=OrderDirection.ORDER_DIRECTION_BUY, figi=INSTRUMENT.figi,
+            trades=[OrderTrade(date_time=time, price=nanos_to_quotation(price), quantity=INSTRUMENT.lot,
+                               trade_id=str(i))]))
+    assert robot.trade_statistics.get_positions() == 10
+    assert robot.trade_statistics.money_nanos == 10 ** 6 * 10 ** 9 - sum(prices) * INSTRUMENT.lot
+
+
+def test_order_polls_are_throttled():
+    clock = SimulatedClock(10 ** 18)
+    robot = make_robot(clock)
+    polls = []
+    for second in range(20):  # ten updates a second
+        for tenth in range(10):
+            clock.now = 10 ** 18 + second * 10 ** 9 + tenth * 10 ** 8
+            if robot._orders_check_due():  # pylint:disable=protected-access
+                polls.append(second)
+    assert polls == list(range(0, 20, round(TradingRobot.ORDERS_POLL_INTERVAL)))
+
+    # with fills streamed the order states are only reconciled now and then
+    robot._order_trades_streaming = True  # pylint:disable=protected-access
+    clock.now = 10 ** 18 + int((polls[-1] + TradingRobot.ORDERS_RECONCILIATION_INTERVAL - 1) * 10 ** 9)
+    assert not robot._orders_check_due()  # pylint:disable=protected-access
+    clock.now += 2 * 10 ** 9
+    assert robot._orders_check_due()  # pylint:disable=protected-access
+
+
+def test_orders_left_pending_are_polled():
+    robot = make_robot()
+    robot.trade_statistics.add_trade(order_state(4, OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL))
+    # as restored from the journal, which doesn't keep the requested lots
+    robot.trade_statistics.pending_orders[ORDER_ID] = dataclasses.replace(
+        robot.trade_statistics.get_trade(ORDER_ID), lots_requested=0)
+    polled = []
+
+    def get_sandbox_order_state(account_id: str, order_id: str) -> OrderState:  # pylint:disable=unused-argument
+        polled.append(order_id)
+        return order_state(6, OrderExecutionReportStatus.EXECUTION_REPORT_STATUS_PARTIALLYFILL)
+
+    assert robot._track_pending_orders()  # pylint:disable=protected-access
+    robot._check_trade_orders(types.SimpleNamespace(  # pylint:disable=protected-access
+        sandbox=types.SimpleNamespace(get_sandbox_order_state=get_sandbox_order_state)))
+    assert polled == [ORDER_ID]
+    assert robot.trade_statistics.get_trade(ORDER_ID).lots_requested == 10
+    assert robot.trade_statistics.positions == 6
+    assert ORDER_ID in robot.orders_executed